@@ -0,0 +1,40 @@
+'''Record the API responses that `bookkeeper status` and `craft_profit` need,
+for replaying with `run.py --data-dir . --fixtures FILE`.
+
+Run this from a working directory with `api_key.txt` and an up-to-date
+`storage/`.  Responses are written to `api_fixtures.json` (or the path given
+as the first argument).  The benchmarks read everything else from `storage/`,
+so copy the working directory after recording to keep the two in sync.
+
+    python3 ../gw2-scripts/benchmarks/record_fixtures.py [out.json]
+'''
+
+import contextlib
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.getcwd())
+
+import gw2.api
+import bookkeeper
+
+def main():
+    out_path = sys.argv[1] if len(sys.argv) > 1 else 'api_fixtures.json'
+
+    with open('api_key.txt') as f:
+        gw2.api.API_KEY = f.read().strip()
+    gw2.api.RECORD = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        bookkeeper.calculate_status()
+        bookkeeper.do_craft_profit()
+
+    with open(out_path, 'w') as f:
+        json.dump(gw2.api.RECORD, f)
+    print('recorded %d responses to %s' % (len(gw2.api.RECORD), out_path), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,351 @@
+'''Benchmarks for bookkeeper's hot paths, run fully offline.
+
+By default this generates a synthetic dataset (see `synthetic.py`) in a
+temporary directory and replays its recorded account responses.  `--data-dir`
+runs against an existing working directory instead, such as a copy of a real
+one with fixtures recorded by `record_fixtures.py`.
+
+Each benchmark is run `--repeat` times after an untimed setup step that resets
+the caches it exercises.  Results are written as JSON and compared against the
+baseline: benchmarks whose best time is more than `--tolerance` slower than
+the baseline are reported as regressions, and the exit status is 1.  Timings
+depend on the machine, so the baseline isn't checked in; the first run (or
+`--update-baseline`) writes it.
+
+    python3 benchmarks/run.py [--items N] [--depth D] [--repeat R]
+        [--out results.json] [--baseline benchmarks/baseline.json]
+        [--update-baseline]
+'''
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+# Benchmarks, in the order they run: `(name, setup, func)`.  `setup()` returns
+# the argument passed to `func`.
+BENCHMARKS = []
+
+def benchmark(name, setup=lambda: None):
+    def register(func):
+        BENCHMARKS.append((name, setup, func))
+        return func
+    return register
+
+def _load_environment(data_dir, fixtures_path):
+    '''Switch to `data_dir` and set up the `gw2` modules to read from it, with
+    API requests answered from `fixtures_path`.  Returns the `bookkeeper`
+    module.'''
+    os.chdir(data_dir)
+    # Pick up the dataset's `policy.py`.
+    sys.path.insert(0, data_dir)
+
+    import gw2.api
+    gw2.api.OFFLINE = True
+    with open(fixtures_path) as f:
+        gw2.api.REPLAY = json.load(f)
+
+    forge_path = os.path.join(data_dir, 'mystic_forge.json')
+    if os.path.exists(forge_path):
+        import gw2.mystic_forge
+        with open(forge_path) as f:
+            gw2.mystic_forge._RECIPES = json.load(f)
+
+    import bookkeeper
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    return bookkeeper
+
+
+def _reset_caches():
+    '''Drop every in-memory and on-disk cache that bookkeeper keeps between
+    calls, so each run starts cold.'''
+    import bookkeeper
+    import gw2.account
+    import gw2.items
+    import gw2.recipes
+    import gw2.util
+
+    bookkeeper.clear_policy_cache()
+    bookkeeper.set_strategy_params({}, set(), set(), bookkeeper.can_craft_any_recipe)
+    bookkeeper.clear_solver_caches(on_disk=True)
+    gw2.items.get.cache_clear()
+    gw2.recipes.get.cache_clear()
+    gw2.util.DataStorage.clear_cache()
+    gw2.account.clear()
+
+def _output_item_ids():
+    import bookkeeper
+    return set(bookkeeper.craftable_items())
+
+def _strategy_prices():
+    import bookkeeper
+    output_item_ids = _output_item_ids()
+    buy_prices, _ = bookkeeper.get_prices(bookkeeper.gather_related_items(output_item_ids))
+    return output_item_ids, buy_prices
+
+def _set_params(buy_prices):
+    import bookkeeper
+    bookkeeper.set_strategy_params(buy_prices, bookkeeper.policy_forbid_buy(),
+            bookkeeper.policy_forbid_craft(), bookkeeper.policy_can_craft_recipe)
+
+
+def _items_storage():
+    import gw2.items
+    import gw2.util
+    gw2.util.DataStorage.clear_cache()
+    return gw2.util.DataStorage(gw2.items.INDEX_FILE, gw2.items.DATA_FILE)
+
+@benchmark('datastorage_open')
+def _(_):
+    import gw2.items
+    import gw2.util
+    gw2.util.DataStorage(gw2.items.INDEX_FILE, gw2.items.DATA_FILE)
+
+@benchmark('datastorage_get', _items_storage)
+def _(data):
+    for k in list(data.keys()):
+        data.get(k)
+
+@benchmark('datastorage_iter', _items_storage)
+def _(data):
+    for _ in data.iter():
+        pass
+
+
+def _cold_gather():
+    _reset_caches()
+    return _output_item_ids()
+
+def _warm_gather():
+    import bookkeeper
+    output_item_ids = _cold_gather()
+    bookkeeper.gather_related_items(output_item_ids)
+    bookkeeper.clear_solver_caches()
+    return output_item_ids
+
+@benchmark('gather_related_items_cold', _cold_gather)
+def _(output_item_ids):
+    import bookkeeper
+    bookkeeper.gather_related_items(output_item_ids)
+
+@benchmark('gather_related_items_warm', _warm_gather)
+def _(output_item_ids):
+    import bookkeeper
+    bookkeeper.gather_related_items(output_item_ids)
+
+
+def _cold_strategies():
+    _reset_caches()
+    output_item_ids, buy_prices = _strategy_prices()
+    _set_params(buy_prices)
+    return output_item_ids
+
+def _warm_strategies():
+    import bookkeeper
+    output_item_ids = _cold_strategies()
+    bookkeeper.solve_strategies(output_item_ids)
+    bookkeeper.clear_solver_caches()
+    _set_params(bookkeeper.STRATEGY_PRICES)
+    return output_item_ids
+
+@benchmark('optimal_cost', _cold_strategies)
+def _(output_item_ids):
+    import bookkeeper
+    for item_id in output_item_ids:
+        bookkeeper.optimal_craft_cost(item_id)
+
+@benchmark('solve_strategies_cold', _cold_strategies)
+def _(output_item_ids):
+    import bookkeeper
+    bookkeeper.solve_strategies(output_item_ids)
+
+@benchmark('solve_strategies_warm', _warm_strategies)
+def _(output_item_ids):
+    import bookkeeper
+    bookkeeper.solve_strategies(output_item_ids)
+
+
+def _count_craftable_setup():
+    import bookkeeper
+    output_item_ids = _cold_strategies()
+    bookkeeper.solve_strategies(output_item_ids)
+    inventory = bookkeeper.get_inventory()
+    targets = [(item_id, 5) for item_id in sorted(output_item_ids)[:500]]
+    return targets, inventory
+
+@benchmark('count_craftable', _count_craftable_setup)
+def _(args):
+    import bookkeeper
+    targets, inventory = args
+    bookkeeper.count_craftable(targets, inventory, set())
+
+
+@benchmark('calculate_status', _reset_caches)
+def _(_):
+    import bookkeeper
+    with contextlib.redirect_stdout(io.StringIO()):
+        bookkeeper.calculate_status()
+
+@benchmark('do_craft_profit', _reset_caches)
+def _(_):
+    import bookkeeper
+    with contextlib.redirect_stdout(io.StringIO()):
+        bookkeeper.do_craft_profit()
+
+def _whatif_setup():
+    import bookkeeper
+    _reset_caches()
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine = bookkeeper.ScenarioEngine()
+    status = engine.base
+    bought = sorted(item_id for item_id, count in status['buy_items'].items() if count > 0)
+    crafted = sorted(item_id for item_id, count in status['craft_items'].items() if count > 0)
+    scenarios = [
+            bookkeeper.Scenario('prices', {item_id: 1.5 for item_id in bought[:10]}),
+            bookkeeper.Scenario('goals', goals={item_id: 5 for item_id in crafted[:3]}),
+            bookkeeper.Scenario('forbid', forbid_buy=bought[:3], forbid_craft=crafted[:3]),
+            ]
+    return engine, scenarios
+
+@benchmark('whatif_scenarios', _whatif_setup)
+def _(args):
+    engine, scenarios = args
+    with contextlib.redirect_stdout(io.StringIO()):
+        for scenario in scenarios:
+            engine.evaluate(scenario)
+
+
+def run_benchmarks(repeat, names=None):
+    results = {}
+    for name, setup, func in BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+        times = []
+        for _ in range(repeat):
+            arg = setup()
+            # Like `timeit`, keep garbage collection out of the measurement.
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                func(arg)
+                times.append(time.perf_counter() - start)
+            finally:
+                gc.enable()
+        results[name] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'repeat': repeat,
+        }
+        print('%-28s %9.4fs  (median %.4fs)' % (name, min(times), statistics.median(times)),
+                file=sys.stderr)
+    return results
+
+def compare(results, baseline, tolerance):
+    '''Print each benchmark's change from `baseline`, and return the names of
+    those that are more than `tolerance` (a fraction) slower.'''
+    regressions = []
+    print('%-28s %10s %10s %8s' % ('Benchmark', 'Baseline', 'Current', 'Change'))
+    for name, r in results.items():
+        b = baseline.get(name)
+        if b is None:
+            print('%-28s %10s %9.4fs' % (name, '-', r['min']))
+            continue
+        ratio = r['min'] / b['min'] if b['min'] > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-28s %9.4fs %9.4fs %+7.1f%%%s' % (name, b['min'], r['min'],
+            (ratio - 1) * 100, flag))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--items', type=int, default=5000,
+            help='size of the synthetic dataset')
+    parser.add_argument('--depth', type=int, default=4,
+            help='number of intermediate tiers in the synthetic recipe graph')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir',
+            help='run against this working directory instead of a synthetic one')
+    parser.add_argument('--fixtures',
+            help='recorded API responses (default: DATA_DIR/api_fixtures.json)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', metavar='NAME',
+            help='run only these benchmarks')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true',
+            help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+            help='allowed slowdown relative to the baseline (default 0.25)')
+    args = parser.parse_args()
+
+    baseline_path = os.path.abspath(args.baseline)
+    out_path = os.path.abspath(args.out) if args.out is not None else None
+
+    tmp = None
+    if args.data_dir is not None:
+        data_dir = os.path.abspath(args.data_dir)
+    else:
+        import synthetic
+        tmp = tempfile.TemporaryDirectory(prefix='bookkeeper-bench-')
+        data_dir = tmp.name
+        synthetic.generate(data_dir, args.items, args.depth, args.seed)
+    fixtures_path = os.path.abspath(args.fixtures or
+            os.path.join(data_dir, 'api_fixtures.json'))
+
+    _load_environment(data_dir, fixtures_path)
+    results = {
+        'meta': {
+            'items': args.items if args.data_dir is None else None,
+            'depth': args.depth if args.data_dir is None else None,
+            'seed': args.seed if args.data_dir is None else None,
+            'data_dir': args.data_dir,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': int(time.time()),
+        },
+        'results': run_benchmarks(args.repeat, args.only),
+    }
+
+    if out_path is not None:
+        with open(out_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    status = 0
+    if args.update_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('wrote baseline to %s' % baseline_path, file=sys.stderr)
+    else:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('items') != results['meta']['items'] or \
+                baseline['meta'].get('depth') != results['meta']['depth']:
+            print('warning: baseline was recorded with a different dataset', file=sys.stderr)
+        if compare(results['results'], baseline['results'], args.tolerance):
+            status = 1
+
+    if tmp is not None:
+        os.chdir(REPO_DIR)
+        tmp.cleanup()
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
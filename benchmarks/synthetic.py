@@ -0,0 +1,313 @@
+'''Generate a synthetic, self-contained bookkeeper working directory: item,
+recipe, and trading post storage in the same on-disk format as `gw2.items`,
+`gw2.recipes`, and `gw2.trading_post`, Mystic Forge recipes, goals, a neutral
+`policy.py`, and recorded API responses for the account (characters,
+inventory, bank, materials, wallet, delivery box, and current and historical
+orders).  Nothing in the generated directory needs network access.
+
+The recipe graph is layered like the real one: raw materials are refined into
+intermediates, intermediates are combined into components over `depth`
+tiers, and the top tier holds the weapons, armor, and other end products
+that `craft_profit` scans.  About one output in 20 also has a Mystic Forge
+recipe.
+
+    python3 benchmarks/synthetic.py OUT_DIR [--items N] [--depth D] [--seed S]
+'''
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gw2.util import DataStorage
+
+BUILD = 100000
+DISCIPLINES = ('Armorsmith', 'Artificer', 'Chef', 'Huntsman', 'Jeweler',
+        'Leatherworker', 'Scribe', 'Tailor', 'Weaponsmith')
+TOP_TYPES = ('Weapon', 'Armor', 'Trinket', 'Consumable', 'UpgradeComponent')
+CHARACTERS = ('Bench One', 'Bench Two', 'Bench Three')
+
+# Overrides the default policy functions, which look up real item names that
+# don't exist in the synthetic data.
+POLICY = '''# Neutral policy for benchmarks, generated by benchmarks/synthetic.py.
+
+def policy_can_craft_recipe(default, r):
+    return True
+
+def policy_forbid_buy(default):
+    return set()
+
+def policy_forbid_craft(default):
+    return set()
+
+def policy_buy_on_demand(default):
+    return set()
+
+def policy_auto_refine(default):
+    return ()
+
+def policy_research_note_strategies(default):
+    return ()
+
+def policy_row_filter(default, row):
+    return True
+'''
+
+def _item(item_id, name, type, rarity='Basic', level=0, flags=(), detail_type='Default'):
+    return {
+        'id': item_id,
+        'name': name,
+        'type': type,
+        'rarity': rarity,
+        'level': level,
+        'flags': list(flags),
+        'vendor_value': 8,
+        'details': {'type': detail_type},
+    }
+
+def _recipe(recipe_id, output_item_id, ingredients, type, output_count=1):
+    return {
+        'id': recipe_id,
+        'type': type,
+        'output_item_id': output_item_id,
+        'output_item_count': output_count,
+        'min_rating': 0,
+        'disciplines': [random.choice(DISCIPLINES)],
+        'flags': [],
+        'ingredients': [{'type': 'Item', 'id': i, 'count': c} for i, c in ingredients],
+        'chat_link': '',
+    }
+
+def _write_storage(dir_path, entries):
+    os.makedirs(dir_path, exist_ok=True)
+    index_path = os.path.join(dir_path, 'index.json')
+    data_path = os.path.join(dir_path, 'data.json')
+    for path in (index_path, data_path):
+        with open(path, 'w'):
+            pass
+    data = DataStorage(index_path, data_path)
+    for k, v in entries:
+        data.add(k, v)
+    data.index_file.close()
+    data.data_file.close()
+    with open(os.path.join(dir_path, 'build.txt'), 'w') as f:
+        f.write(str(BUILD))
+
+def _write_cache(dir_path, index_name, data_name, entries):
+    os.makedirs(dir_path, exist_ok=True)
+    index_path = os.path.join(dir_path, index_name)
+    data_path = os.path.join(dir_path, data_name)
+    for path in (index_path, data_path):
+        with open(path, 'w'):
+            pass
+    data = DataStorage(index_path, data_path, allow_replace=True)
+    now = time.time()
+    for k, v in entries:
+        data.replace(k, [now, v])
+    data.index_file.close()
+    data.data_file.close()
+
+def _timestamp(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(t))
+
+def generate(out_dir, num_items=5000, depth=4, seed=0):
+    '''Write a synthetic dataset with roughly `num_items` items and `depth`
+    tiers of intermediate components to `out_dir`.'''
+    random.seed(seed)
+    storage = os.path.join(out_dir, 'storage')
+    os.makedirs(storage, exist_ok=True)
+    with open(os.path.join(storage, 'build.txt'), 'w') as f:
+        f.write('%d 0 0' % BUILD)
+
+    items = {}
+    def add_item(name, type, **kw):
+        item_id = 10000 + len(items)
+        items[item_id] = _item(item_id, name, type, **kw)
+        return item_id
+
+    # Split the item budget between raw materials, each tier of
+    # intermediates, and the top tier.
+    num_raw = max(10, num_items // 10)
+    num_tier = max(10, num_items // (3 * depth))
+    num_top = max(10, num_items - num_raw - num_tier * depth)
+
+    tiers = [[add_item('Raw Material %d' % i, 'CraftingMaterial')
+        for i in range(num_raw)]]
+    recipes = []
+    for t in range(1, depth + 1):
+        tier = []
+        for i in range(num_tier):
+            item_id = add_item('Tier %d Component %d' % (t, i), 'CraftingMaterial')
+            lower = random.choice(tiers[max(0, t - 2):])
+            n = 1 if t == 1 else random.randint(2, 4)
+            ingredients = {random.choice(lower): random.randint(1, 10) for _ in range(n)}
+            if t > 1 and random.random() < 0.3:
+                ingredients[random.choice(tiers[0])] = random.randint(1, 5)
+            recipes.append(_recipe(len(recipes) + 1, item_id, ingredients.items(),
+                'Refinement' if t == 1 else 'Component',
+                output_count=random.choice((1, 1, 1, 2, 5, 10))))
+            tier.append(item_id)
+        tiers.append(tier)
+
+    top = []
+    for i in range(num_top):
+        type = random.choice(TOP_TYPES)
+        item_id = add_item('%s %d' % (type, i), type,
+                rarity=random.choice(('Fine', 'Masterwork', 'Rare', 'Exotic')),
+                level=80)
+        ingredients = {random.choice(random.choice(tiers[1:])): random.randint(1, 5)
+                for _ in range(random.randint(2, 4))}
+        recipes.append(_recipe(len(recipes) + 1, item_id, ingredients.items(), type))
+        top.append(item_id)
+
+    forge = []
+    for item_id in random.sample(top + tiers[-1], (num_top + num_tier) // 20):
+        forge.append({
+            'id': len(forge),
+            'output_item_id': item_id,
+            'output_item_count': 1,
+            'ingredients': [
+                {'item_id': random.choice(random.choice(tiers)), 'count': random.randint(1, 250)}
+                for _ in range(4)],
+        })
+
+    # Trading post prices, rising with each tier.  A few items aren't sold,
+    # which the cache records as `None`.  Top-tier items (which goals are
+    # chosen from) always are.
+    prices = []
+    listings = []
+    for t, tier in enumerate(tiers + [top]):
+        for item_id in tier:
+            if random.random() < 0.05 and t < len(tiers):
+                prices.append((item_id, None))
+                listings.append((item_id, None))
+                continue
+            buy = random.randint(5, 100) * (t + 1) ** 3
+            sell = int(buy * random.uniform(1.05, 1.6))
+            buys = [{'listings': 1, 'unit_price': buy - 2 * j, 'quantity': random.randint(1, 500)}
+                    for j in range(10)]
+            sells = [{'listings': 1, 'unit_price': sell + 3 * j, 'quantity': random.randint(1, 500)}
+                    for j in range(10)]
+            prices.append((item_id, {'id': item_id, 'whitelisted': False,
+                'buys': {'quantity': sum(l['quantity'] for l in buys), 'unit_price': buy},
+                'sells': {'quantity': sum(l['quantity'] for l in sells), 'unit_price': sell},
+                }))
+            listings.append((item_id, {'id': item_id, 'buys': buys, 'sells': sells}))
+
+    _write_storage(os.path.join(storage, 'items'), sorted(items.items()))
+    by_name = [(item['name'], item_id) for item_id, item in sorted(items.items())]
+    with open(os.path.join(storage, 'items', 'by_name.json'), 'w') as f:
+        json.dump(by_name, f)
+    with open(os.path.join(storage, 'items', 'by_name_multi.json'), 'w') as f:
+        json.dump([(name, [item_id]) for name, item_id in by_name], f)
+
+    _write_storage(os.path.join(storage, 'recipes'), [(r['id'], r) for r in recipes])
+    by_output = {}
+    for r in recipes:
+        by_output.setdefault(r['output_item_id'], []).append(r['id'])
+    with open(os.path.join(storage, 'recipes', 'by_output.json'), 'w') as f:
+        json.dump(list(by_output.items()), f)
+
+    tp_dir = os.path.join(storage, 'trading_post')
+    _write_cache(tp_dir, 'index.json', 'data.json', prices)
+    _write_cache(tp_dir, 'listings_index.json', 'listings_data.json', listings)
+
+    chars_dir = os.path.join(storage, 'characters')
+    os.makedirs(chars_dir, exist_ok=True)
+    with open(os.path.join(chars_dir, 'characters.txt'), 'w') as f:
+        f.write(''.join(c + '\n' for c in CHARACTERS))
+    with open(os.path.join(chars_dir, 'characters_crafting.json'), 'w') as f:
+        json.dump({c: {d: 500 for d in DISCIPLINES} for c in CHARACTERS}, f)
+    with open(os.path.join(chars_dir, 'build.txt'), 'w') as f:
+        f.write(str(BUILD))
+
+    with open(os.path.join(out_dir, 'mystic_forge.json'), 'w') as f:
+        json.dump(forge, f)
+
+    os.makedirs(os.path.join(out_dir, 'books'), exist_ok=True)
+    goals = [(item_id, random.randint(1, 20)) for item_id in random.sample(top, min(50, len(top)))]
+    with open(os.path.join(out_dir, 'books', 'goals.json'), 'w') as f:
+        json.dump(goals, f)
+    stockpile = [(item_id, random.randint(10, 100)) for item_id in random.sample(tiers[1], 10)]
+    with open(os.path.join(out_dir, 'books', 'stockpile.json'), 'w') as f:
+        json.dump(stockpile, f)
+
+    with open(os.path.join(out_dir, 'policy.py'), 'w') as f:
+        f.write(POLICY)
+    with open(os.path.join(out_dir, 'api_key.txt'), 'w') as f:
+        f.write('benchmark\n')
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+        'vendorprices.json'), out_dir)
+
+    with open(os.path.join(out_dir, 'api_fixtures.json'), 'w') as f:
+        json.dump(account_fixtures(tiers, top), f)
+
+def account_fixtures(tiers, top):
+    '''Build recorded API responses for a synthetic account holding a mix of
+    materials, intermediates, and finished items.'''
+    def stacks(pool, n, max_count=250):
+        return [{'id': item_id, 'count': random.randint(1, max_count)}
+                for item_id in random.sample(pool, min(n, len(pool)))]
+
+    def entry(j, pages=None):
+        headers = {} if pages is None else {'X-Page-Total': str(pages)}
+        return {'json': j, 'headers': headers}
+
+    now = time.time()
+    def transactions(n, offset):
+        return [{
+            'id': offset + i,
+            'item_id': random.choice(top),
+            'price': random.randint(100, 100000),
+            'quantity': random.randint(1, 10),
+            'created': _timestamp(now - 86400 * (i + 2)),
+            'purchased': _timestamp(now - 86400 * (i + 1)),
+            } for i in range(n)]
+
+    intermediates = [item_id for tier in tiers[1:] for item_id in tier]
+    fixtures = {
+        '/v2/characters': entry(list(CHARACTERS)),
+        '/v2/account/materials': entry(stacks(tiers[0], len(tiers[0]))),
+        '/v2/account/bank': entry(stacks(intermediates, 300) + stacks(top, 50, 5)),
+        '/v2/account/wallet': entry([{'id': 1, 'value': 50000000}, {'id': 61, 'value': 1000}]),
+        '/v2/commerce/delivery': entry({'coins': 12345, 'items': []}),
+        '/v2/commerce/transactions/current/buys': entry(
+            [dict(t, created=t['created'], purchased=None) for t in transactions(50, 1)], 1),
+        '/v2/commerce/transactions/current/sells': entry(
+            [dict(t, purchased=None) for t in transactions(50, 1000)], 1),
+        '/v2/commerce/transactions/history/buys?page=0&page_size=200':
+            entry(transactions(200, 100000), 1),
+        '/v2/commerce/transactions/history/sells?page=0&page_size=200':
+            entry(transactions(200, 200000), 1),
+    }
+    for c in CHARACTERS:
+        fixtures['/v2/characters/%s/inventory' % urllib.parse.quote(c)] = entry({
+            'bags': [{'inventory': stacks(intermediates + tiers[0], 60) + [None] * 20}, None],
+        })
+        fixtures['/v2/characters/%s/equipment' % urllib.parse.quote(c)] = entry({
+            'equipment': [{'id': item_id, 'slot': slot, 'upgrades': [random.choice(tiers[0])]}
+                for item_id, slot in zip(random.sample(top, 3), ('Helm', 'Coat', 'Boots'))],
+        })
+        fixtures['/v2/characters/%s/crafting' % urllib.parse.quote(c)] = entry({
+            'crafting': [{'discipline': d, 'rating': 500, 'active': True}
+                for d in DISCIPLINES],
+        })
+    return fixtures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('out_dir')
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.items, args.depth, args.seed)
+
+if __name__ == '__main__':
+    main()
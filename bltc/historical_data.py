@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 
 from gw2.util import DataStorage
 from gw2.constants import STORAGE_DIR
+import gw2.price_history
 
 HISTORICAL_DATA_DIR = os.path.join(STORAGE_DIR, 'historical_data')
 RAW_INDEX_FILE = os.path.join(HISTORICAL_DATA_DIR, 'index.json')
@@ -56,6 +57,13 @@ class ProcessedData:
         self.bought_weekly = bought_weekly
 
 def get_raw_item_data(item_id):
+    # Prefer our own recorded prices, if recording is enabled and they cover
+    # as much time as the gw2bltc series.
+    if gw2.price_history.ENABLED:
+        rows = gw2.price_history.covering_chart_rows(item_id)
+        if rows is not None:
+            return rows
+
     raw_data = _get_raw_data()
     if raw_data.contains(item_id):
         return raw_data.get(item_id)
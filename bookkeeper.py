@@ -9,24 +9,44 @@ if __name__ == '__main__':
     bookkeeper.main()
     sys.exit(0)
 
-from collections import defaultdict, namedtuple
+from collections import ChainMap, OrderedDict, defaultdict, namedtuple
+import concurrent.futures
+import contextlib
+import copy
 import datetime
 import functools
-from itertools import chain
+import hashlib
+import heapq
+import io
+from itertools import chain, islice
 import json
 import math
+import multiprocessing
 import os
+import shutil
+import socketserver
 import sqlite3
 import sys
+import threading
 import time
-import urllib.parse
+import traceback
 
+import numpy as np
+
+import gw2.account
 import gw2.api
+import gw2.build
 import gw2.items
+import gw2.locations
 import gw2.mystic_forge
+import gw2.order_book
+import gw2.profiling
+from gw2.profiling import phase
 import gw2.recipes
+import gw2.table_output
 import gw2.trading_post
 import gw2.character
+from gw2.constants import STORAGE_DIR
 
 import bltc.historical_data
 
@@ -36,6 +56,12 @@ try:
 except:
     policy = None
 
+try:
+    import scipy.optimize
+    import scipy.sparse
+except ImportError:
+    scipy = None
+
 
 def policy_func(f):
     '''If the user has provided a `policy.py` containing a function of the same
@@ -50,6 +76,26 @@ def policy_func(f):
     else:
         return f
 
+# Results of policy hooks that take no arguments, keyed by name.  See
+# `policy_once`.
+_POLICY_CACHE = {}
+
+def policy_once(f):
+    '''Evaluate `f`, a policy hook that takes no arguments, at most once per
+    run (or until `clear_policy_cache`).  Each caller gets its own shallow
+    copy of the result, so it can be modified freely.'''
+    @functools.wraps(f)
+    def g():
+        if f.__name__ not in _POLICY_CACHE:
+            _POLICY_CACHE[f.__name__] = f()
+        return copy.copy(_POLICY_CACHE[f.__name__])
+    return g
+
+def clear_policy_cache():
+    _POLICY_CACHE.clear()
+    # The default `policy_can_craft_recipe` checks the disciplines.
+    gw2.character.clear()
+
 
 def _load_dict(path):
     if os.path.exists(path):
@@ -142,7 +188,9 @@ def parse_timestamp(s):
 _PRINTED_ORIGINS=set()
 
 def add_vendor_prices(buy_prices):
-    # Allow buying any vendor items that are priced in gold.
+    '''Allow buying any vendor items that are priced in gold.  Returns the
+    set of vendor item IDs added to `buy_prices`.'''
+    vendor_items = set()
     with open('vendorprices.json') as f:
         j = json.load(f)
     for k, v in j.items():
@@ -157,6 +205,8 @@ def add_vendor_prices(buy_prices):
             continue
         price = v['cost'] / v['quantity']
         buy_prices[k] = price
+        vendor_items.add(k)
+    return vendor_items
 
 def item_vendor_price(item):
     if 'NoSell' in item['flags']:
@@ -167,11 +217,15 @@ def item_vendor_price(item):
 def policy_adjust_prices(buy_prices, sell_prices):
     pass
 
-def get_prices(item_ids):
+# Maximum age of trading post data used by `status`, which decides what to buy
+# and sell right now.  Other commands use `gw2.trading_post.DEFAULT_MAX_AGE`.
+STATUS_PRICE_MAX_AGE = 60
+
+def get_prices(item_ids, max_age=gw2.trading_post.DEFAULT_MAX_AGE):
     buy_prices = {}
     sell_prices = {}
 
-    for x in gw2.trading_post.get_prices_multi(item_ids):
+    for x in gw2.trading_post.get_prices_multi(item_ids, max_age=max_age):
         if x is None:
             continue
 
@@ -198,13 +252,13 @@ def get_prices(item_ids):
     return buy_prices, sell_prices
 
 
-def get_prices_and_listings(item_ids):
+def get_prices_and_listings(item_ids, max_age=gw2.trading_post.DEFAULT_MAX_AGE):
     buy_prices = {}
     sell_prices = {}
     buy_listings = {}
     sell_listings = {}
 
-    for x in gw2.trading_post.get_listings_multi(item_ids):
+    for x in gw2.trading_post.get_listings_multi(item_ids, max_age=max_age):
         if x is None:
             continue
 
@@ -241,36 +295,16 @@ def get_prices_and_listings(item_ids):
     policy_adjust_prices(buy_prices, sell_prices)
     return buy_prices, sell_prices, buy_listings, sell_listings
 
+def get_account_snapshot(*sources):
+    '''Return the `gw2.account.AccountSnapshot` for this run, with `sources`
+    (see `gw2.account.SOURCES`) fetched up front.  Other sources are fetched
+    when first used.'''
+    return gw2.account.get(get_char_names, sources)
+
 def get_inventory():
     '''Return a dict listing the quantities of all items in material storage,
     the bank, and character inventories.'''
-    counts = defaultdict(int)
-
-    char_names = get_char_names()
-    for char_name in char_names:
-        char = gw2.api.fetch_with_retries('/v2/characters/%s/inventory' %
-                urllib.parse.quote(char_name))
-        for bag in char['bags']:
-            if bag is None:
-                continue
-            for item in bag['inventory']:
-                if item is None or item['count'] == 0:
-                    continue
-                counts[item['id']] += item['count']
-
-    materials = gw2.api.fetch_with_retries('/v2/account/materials')
-    for item in materials:
-        if item is None or item['count'] == 0:
-            continue
-        counts[item['id']] += item['count']
-
-    bank = gw2.api.fetch('/v2/account/bank')
-    for item in bank:
-        if item is None or item['count'] == 0:
-            continue
-        counts[item['id']] += item['count']
-
-    return dict(counts)
+    return dict(get_account_snapshot().inventory())
 
 def condense_transactions(transactions):
     '''Combine transactions with the same item and price.'''
@@ -288,8 +322,9 @@ def condense_transactions(transactions):
 
 
 def craftable_items():
+    craftable = craftable_recipe_ids()
     for r in gw2.recipes.iter_all():
-        if not policy_can_craft_recipe(r):
+        if r['id'] not in craftable:
             continue
         item_id = r['output_item_id']
         if not gw2.items.is_known(item_id):
@@ -393,6 +428,8 @@ def sum_costs(xs):
     return cost
 
 class StrategyBuy:
+    __slots__ = ('item_id', 'price')
+
     def __init__(self, item_id, price):
         self.item_id = item_id
         self.price = price
@@ -412,18 +449,25 @@ class StrategyBuy:
 
 
 class StrategyCraft:
+    __slots__ = ('recipe', 'output_item_id', 'output_count', 'ingredients')
+
     def __init__(self, recipe):
         self.recipe = recipe
+        self.output_item_id = recipe['output_item_id']
+        self.output_count = recipe['output_item_count']
+        # `(item_id, count)` for each ingredient, as given by
+        # `recipe_ingredient_items`.
+        self.ingredients = tuple(recipe_ingredient_items(recipe))
 
     def cost(self):
-        output_count = self.recipe['output_item_count']
+        output_count = self.output_count
         #x = tuple(
         #    (i['count'] / output_count, optimal_strategy(i['item_id']).cost())
         #        for i in self.recipe['ingredients'])
         #print('crafting %s: inputs = %r' %
         #(gw2.items.name(self.recipe['output_item_id']), x))
         costs = []
-        for item_id, count in recipe_ingredient_items(self.recipe):
+        for item_id, count in self.ingredients:
             if item_id is None:
                 costs.append((None, None))
             else:
@@ -439,7 +483,7 @@ class StrategyCraft:
         * `max_output` (int): Don't produce more than this many output items.
         '''
         max_times = None
-        for item_id, count in recipe_ingredient_items(self.recipe):
+        for item_id, count in self.ingredients:
             avail = state.inventory[item_id]
             if exclude:
                 avail -= exclude.get(item_id, 0)
@@ -448,40 +492,40 @@ class StrategyCraft:
                 max_times = times
 
         if max_output is not None:
-            times = max_output // self.recipe['output_item_count']
+            times = max_output // self.output_count
             if max_times is None or max_times > times:
                 max_times = times
 
         if max_times is None:
             max_times = 0
-        return max_times * self.recipe['output_item_count']
+        return max_times * self.output_count
 
     def apply(self, state, count):
-        r = self.recipe
-        item_id = r['output_item_id']
-        times = (count + r['output_item_count'] - 1) // r['output_item_count']
-        state.craft_items[item_id] += r['output_item_count'] * times
-        state.inventory[item_id] += r['output_item_count'] * times
-        for item_id, count in recipe_ingredient_items(self.recipe):
+        output_count = self.output_count
+        item_id = self.output_item_id
+        times = (count + output_count - 1) // output_count
+        state.craft_items[item_id] += output_count * times
+        state.inventory[item_id] += output_count * times
+        for item_id, count in self.ingredients:
             state.inventory[item_id] -= count * times
             state.pending_items.add(item_id)
 
     def related_items(self):
-        return tuple(item_id for item_id, count in recipe_ingredient_items(self.recipe))
+        return tuple(item_id for item_id, count in self.ingredients)
 
     def describe(self, count):
-        r = self.recipe
-        times = (count + r['output_item_count'] - 1) // r['output_item_count']
-        return times, 'Craft ' + gw2.items.name(self.recipe['output_item_id'])
+        times = (count + self.output_count - 1) // self.output_count
+        return times, 'Craft ' + gw2.items.name(self.output_item_id)
 
     def detailed_name(self):
-        r = self.recipe
-        output_count_str = '' if r['output_item_count'] == 1 else ' %d' % r['output_item_count']
+        output_count_str = '' if self.output_count == 1 else ' %d' % self.output_count
         inputs_str = ', '.join('%d %s' % (count, gw2.items.name(item_id))
-                for item_id, count in recipe_ingredient_items(r))
+                for item_id, count in self.ingredients)
         return 'Craft%s from %s' % (output_count_str, inputs_str)
 
 class StrategyUnknown:
+    __slots__ = ('item_id',)
+
     def __init__(self, item_id):
         self.item_id = item_id
 
@@ -499,6 +543,8 @@ class StrategyUnknown:
         return count, 'Obtain ' + gw2.items.name(self.item_id)
 
 class StrategyResearchNote:
+    __slots__ = ('name', 'items')
+
     def __init__(self, name, items):
         '''Build a strategy that salvages the items described by `items`.  Each
         entry in `items` should be a tuple of `(item_id, count, notes)`,
@@ -543,113 +589,948 @@ class StrategyResearchNote:
 STRATEGY_PRICES = {}
 STRATEGY_FORBID_BUY = set()
 STRATEGY_FORBID_CRAFT = set()
-STRATEGY_CAN_CRAFT_RECIPE = lambda r: True
+def can_craft_any_recipe(r):
+    return True
+
+STRATEGY_CAN_CRAFT_RECIPE = can_craft_any_recipe
+# If `STRATEGY_CAN_CRAFT_RECIPE` is `policy_can_craft_recipe`, the verdict
+# for each recipe ID checked so far, so `valid_strategies` calls the policy at
+# most once per recipe.  If `policy.py` overrides the batch hook
+# `policy_can_craft_recipes`, `_CAN_CRAFT_RECIPE_IDS` is the set of recipe IDs
+# it allows instead.
+_CAN_CRAFT_RECIPE_MEMO = None
+_CAN_CRAFT_RECIPE_IDS = None
 _OPTIMAL_STRATEGY_CACHE = {}
 _OPTIMAL_COST_CACHE = {}
+_OPTIMAL_CRAFT_STRATEGY_CACHE = {}
+_OPTIMAL_CRAFT_COST_CACHE = {}
+# Strategy choices loaded from the persistent strategy cache, as `(choice,
+# craft_choice)` indices.  See `solve_strategies`.
+_RESTORED_CHOICES = {}
+# Dependency graph of the items covered by `solve_strategies`: each item's
+# dependencies and users, and its topological level.
+_SOLVED_DEPS = {}
+_SOLVED_USERS = defaultdict(list)
+_SOLVED_ORDER = {}
 STRATEGY_RESEARCH_NOTE_SEPARATE = False
+# Strategy objects built by `valid_strategies`, so that repeated calls for the
+# same item return the same objects instead of allocating new ones.  Keys are
+# `('buy', item_id)`, `('craft', source, recipe_id)`, `('unknown', item_id)`,
+# `('note', item_id, notes)`, or `('notes',)` for the list of research note
+# strategies.  `'craft'` entries are `(refine_only, strategy)` pairs (see
+# `_craft_strategy`).  Cleared by `set_strategy_params`.
+_STRATEGY_INTERN = {}
 
 def set_strategy_params(prices, forbid_buy, forbid_craft, can_craft_recipe,
         research_note_separate=False):
     '''Set prices to use for `StrategyBuy`.'''
     global STRATEGY_PRICES, STRATEGY_FORBID_BUY, STRATEGY_FORBID_CRAFT, \
             STRATEGY_CAN_CRAFT_RECIPE, STRATEGY_RESEARCH_NOTE_SEPARATE
-    global _OPTIMAL_STRATEGY_CACHE, _OPTIMAL_COST_CACHE
+    global _OPTIMAL_STRATEGY_CACHE, _OPTIMAL_COST_CACHE, \
+            _OPTIMAL_CRAFT_STRATEGY_CACHE, _OPTIMAL_CRAFT_COST_CACHE, \
+            _RESTORED_CHOICES, _SOLVED_ORDER, _CAN_CRAFT_RECIPE_MEMO, \
+            _CAN_CRAFT_RECIPE_IDS
     STRATEGY_PRICES = prices
     STRATEGY_FORBID_BUY = forbid_buy
     STRATEGY_FORBID_CRAFT = forbid_craft
     STRATEGY_CAN_CRAFT_RECIPE = can_craft_recipe
+    _CAN_CRAFT_RECIPE_MEMO = None
+    _CAN_CRAFT_RECIPE_IDS = None
+    if can_craft_recipe is policy_can_craft_recipe:
+        if _overrides_can_craft_recipes():
+            _CAN_CRAFT_RECIPE_IDS = craftable_recipe_ids()
+        else:
+            _CAN_CRAFT_RECIPE_MEMO = _POLICY_CACHE.setdefault('can_craft_recipe', {})
     STRATEGY_RESEARCH_NOTE_SEPARATE = research_note_separate
     _OPTIMAL_STRATEGY_CACHE = {}
     _OPTIMAL_COST_CACHE = {}
+    _OPTIMAL_CRAFT_STRATEGY_CACHE = {}
+    _OPTIMAL_CRAFT_COST_CACHE = {}
+    _RESTORED_CHOICES = {}
+    _SOLVED_DEPS.clear()
+    _SOLVED_USERS.clear()
+    _SOLVED_ORDER = {}
+    _CRAFT_DELTA_CACHE.clear()
+    _STRATEGY_INTERN.clear()
 
 @policy_func
 def policy_extra_strategies(item_id):
     return
 
-def valid_strategies(item_id, allow_refine_only=False):
-    if item_id not in STRATEGY_FORBID_BUY:
+def _craft_strategy(source, recipe_id):
+    '''Return `(refine_only, strategy)` for recipe `recipe_id` from `source`
+    (`'recipe'` or `'mystic'`), where `strategy` is `None` if the recipe can't
+    be crafted under the current parameters.  The recipe is only fetched the
+    first time; after that the interned entry is returned as is.'''
+    key = ('craft', source, recipe_id)
+    entry = _STRATEGY_INTERN.get(key)
+    if entry is None:
+        if source == 'recipe':
+            r = gw2.recipes.get(recipe_id)
+            ok = _can_craft_recipe(recipe_id, r)
+        else:
+            r = gw2.mystic_forge.get(recipe_id)
+            ok = True
+        entry = (bool(r.get('bookkeeper_refine_only')),
+                StrategyCraft(r) if ok else None)
+        _STRATEGY_INTERN[key] = entry
+    return entry
+
+def _research_note_strategies():
+    strategies = _STRATEGY_INTERN.get(('notes',))
+    if strategies is not None:
+        return strategies
+
+    if not STRATEGY_RESEARCH_NOTE_SEPARATE:
+        strategies = tuple(policy_research_note_strategies())
+    else:
+        strategies = []
+        for strategy in chain(
+                policy_research_note_strategies(),
+                default_policy_research_note_strategies(include_disabled=True)):
+            for item_id, count, notes in strategy.items:
+                key = ('note', item_id, notes)
+                note_strategy = _STRATEGY_INTERN.get(key)
+                if note_strategy is None:
+                    note_strategy = StrategyResearchNote(gw2.items.name(item_id),
+                            [(item_id, 1, notes)])
+                    _STRATEGY_INTERN[key] = note_strategy
+                strategies.append(note_strategy)
+        strategies = tuple(strategies)
+    _STRATEGY_INTERN[('notes',)] = strategies
+    return strategies
+
+def _can_craft_recipe(recipe_id, r):
+    memo = _CAN_CRAFT_RECIPE_MEMO
+    if memo is not None:
+        ok = memo.get(recipe_id)
+        if ok is None:
+            ok = memo[recipe_id] = bool(policy_can_craft_recipe(r))
+        return ok
+    if _CAN_CRAFT_RECIPE_IDS is not None:
+        return recipe_id in _CAN_CRAFT_RECIPE_IDS
+    return STRATEGY_CAN_CRAFT_RECIPE(r)
+
+def valid_strategies(item_id, allow_refine_only=False, allow_buy=True):
+    if allow_buy and item_id not in STRATEGY_FORBID_BUY:
         price = STRATEGY_PRICES.get(item_id)
         if price is not None:
-            yield StrategyBuy(item_id, price)
+            # `update_strategy_prices` can change the price without clearing
+            # `_STRATEGY_INTERN`.
+            key = ('buy', item_id)
+            strategy = _STRATEGY_INTERN.get(key)
+            if strategy is None or strategy.price != price:
+                strategy = StrategyBuy(item_id, price)
+                _STRATEGY_INTERN[key] = strategy
+            yield strategy
 
     if item_id not in STRATEGY_FORBID_CRAFT:
-        recipe_ids = gw2.recipes.search_output(item_id)
-        for recipe_id in recipe_ids:
-            r = gw2.recipes.get(recipe_id)
-            if r.get('bookkeeper_refine_only') and not allow_refine_only:
-                continue
-            if STRATEGY_CAN_CRAFT_RECIPE(r):
-                yield StrategyCraft(r)
-
-        mystic_recipe_ids = gw2.mystic_forge.search_output(item_id)
-        for mystic_recipe_id in mystic_recipe_ids:
-            r = gw2.mystic_forge.get(mystic_recipe_id)
-            if r.get('bookkeeper_refine_only') and not allow_refine_only:
-                continue
-            yield StrategyCraft(r)
+        for source, recipe_ids in (
+                ('recipe', gw2.recipes.search_output(item_id)),
+                ('mystic', gw2.mystic_forge.search_output(item_id))):
+            for recipe_id in recipe_ids:
+                refine_only, strategy = _craft_strategy(source, recipe_id)
+                if refine_only and not allow_refine_only:
+                    continue
+                if strategy is not None:
+                    yield strategy
 
         if item_id == ITEM_RESEARCH_NOTE:
-            if not STRATEGY_RESEARCH_NOTE_SEPARATE:
-                yield from policy_research_note_strategies()
-            else:
-                for strategy in chain(
-                        policy_research_note_strategies(),
-                        default_policy_research_note_strategies(include_disabled=True)):
-                    for item_id, count, notes in strategy.items:
-                        yield StrategyResearchNote(gw2.items.name(item_id),
-                                [(item_id, 1, notes)])
+            yield from _research_note_strategies()
 
     extra = policy_extra_strategies(item_id)
     if extra is not None:
         yield from extra
 
 
+def _unknown_strategy(item_id):
+    key = ('unknown', item_id)
+    strategy = _STRATEGY_INTERN.get(key)
+    if strategy is None:
+        strategy = StrategyUnknown(item_id)
+        _STRATEGY_INTERN[key] = strategy
+    return strategy
+
+def _choose_strategy(item_id, strategies):
+    best_strategy = None
+    best_cost = None
+    for strategy in strategies:
+        cost = strategy.cost()
+        if cost is None:
+            # If all strategies have infinite cost, take the first one.
+            if best_strategy is None:
+                best_strategy = strategy
+        else:
+            # Take this strategy if it beats the current best cost.
+            if best_cost is None or cost < best_cost:
+                best_strategy = strategy
+                best_cost = cost
+    if best_strategy is None:
+        best_strategy = _unknown_strategy(item_id)
+    return best_strategy
+
+def _restore_strategy(item_id, which):
+    '''Rebuild a strategy chosen by a previous run from the persisted
+    strategy cache.  `which` is 0 for the optimal strategy and 1 for the
+    optimal craft strategy.  Returns `None` if nothing was persisted.'''
+    choices = _RESTORED_CHOICES.get(item_id)
+    if choices is None:
+        return None
+    idx = choices[which]
+    if idx < 0:
+        return _unknown_strategy(item_id)
+    strategies = list(valid_strategies(item_id, allow_buy=(which == 0)))
+    if idx >= len(strategies):
+        return None
+    return strategies[idx]
+
 def optimal_strategy(item_id):
     best_strategy = _OPTIMAL_STRATEGY_CACHE.get(item_id)
-    if best_strategy is None:
-        strats = []
-        best_strategy = None
-        best_cost = None
-        
-        for strategy in valid_strategies(item_id):
-            cost = strategy.cost()
-            strats.append((strategy, cost))
-            
-            if cost is None:
-                # If all strategies have infinite cost, take the first one.
-                if best_strategy is None:
-                    best_strategy = strategy
-            else:
-                # Take this strategy if it beats the current best cost.
-                if best_cost is None or cost < best_cost:
-                    best_strategy = strategy
-                    best_cost = cost
+    if gw2.profiling.ENABLED:
+        gw2.profiling.COUNTERS['optimal_strategy'] += 1
         if best_strategy is None:
-            best_strategy = StrategyUnknown(item_id)
-        _OPTIMAL_STRATEGY_CACHE[item_id] = best_strategy
+            gw2.profiling.COUNTERS['optimal_strategy_miss'] += 1
+    if best_strategy is None:
+        best_strategy = _restore_strategy(item_id, 0)
+    if best_strategy is None:
+        best_strategy = _choose_strategy(item_id, valid_strategies(item_id))
+    _OPTIMAL_STRATEGY_CACHE[item_id] = best_strategy
+    return best_strategy
+
+def optimal_craft_strategy(item_id):
+    '''Like `optimal_strategy`, but never buys `item_id` itself (its
+    ingredients may still be bought).  This gives the same result as adding
+    `item_id` to `forbid_buy`, but shares the optimal strategy cache for all
+    the ingredients, so it can be called for many items without resetting
+    the strategy parameters in between.'''
+    best_strategy = _OPTIMAL_CRAFT_STRATEGY_CACHE.get(item_id)
+    if best_strategy is None:
+        best_strategy = _restore_strategy(item_id, 1)
+    if best_strategy is None:
+        best_strategy = _choose_strategy(item_id,
+                valid_strategies(item_id, allow_buy=False))
+    _OPTIMAL_CRAFT_STRATEGY_CACHE[item_id] = best_strategy
     return best_strategy
 
 def optimal_cost(item_id):
-    cost = _OPTIMAL_COST_CACHE.get(item_id)
-    if cost is None:
-        cost = optimal_strategy(item_id).cost()
-        _OPTIMAL_COST_CACHE[item_id] = cost
+    if gw2.profiling.ENABLED:
+        gw2.profiling.COUNTERS['optimal_cost'] += 1
+    if item_id in _OPTIMAL_COST_CACHE:
+        return _OPTIMAL_COST_CACHE[item_id]
+    if gw2.profiling.ENABLED:
+        gw2.profiling.COUNTERS['optimal_cost_miss'] += 1
+    cost = optimal_strategy(item_id).cost()
+    _OPTIMAL_COST_CACHE[item_id] = cost
     return cost
 
+def optimal_craft_cost(item_id):
+    '''Cost of obtaining `item_id` without buying it directly.  See
+    `optimal_craft_strategy`.'''
+    if item_id in _OPTIMAL_CRAFT_COST_CACHE:
+        return _OPTIMAL_CRAFT_COST_CACHE[item_id]
+    cost = optimal_craft_strategy(item_id).cost()
+    _OPTIMAL_CRAFT_COST_CACHE[item_id] = cost
+    return cost
+
+
+def _strategy_deps(strategies):
+    return {d for strategy in strategies for d in strategy.related_items()
+            if d is not None}
+
+def _topological_levels(deps):
+    '''Assign each item in `deps` (a dict mapping item IDs to the items they
+    depend on) a level that is greater than the levels of all its
+    dependencies.  Dependencies that aren't keys of `deps` are assumed to be
+    solved already.  Items that are part of a dependency cycle, or depend on
+    one, are left out of the result.'''
+    deps = {item_id: {d for d in ds if d in deps} for item_id, ds in deps.items()}
+
+    users = defaultdict(list)
+    remaining = {}
+    for item_id, ds in deps.items():
+        remaining[item_id] = len(ds)
+        for d in ds:
+            users[d].append(item_id)
+
+    levels = {}
+    frontier = [item_id for item_id, n in remaining.items() if n == 0]
+    level = 0
+    while frontier:
+        next_frontier = []
+        for item_id in frontier:
+            levels[item_id] = level
+            for user in users[item_id]:
+                remaining[user] -= 1
+                if remaining[user] == 0:
+                    next_frontier.append(user)
+        frontier = next_frontier
+        level += 1
+    return levels
+
+def _has_price_strategy(item_id):
+    '''Check whether `valid_strategies(item_id)` starts with buying the item
+    at its `STRATEGY_PRICES` price.  This is the one strategy that
+    `optimal_craft_strategy` excludes.'''
+    return item_id not in STRATEGY_FORBID_BUY and STRATEGY_PRICES.get(item_id) is not None
+
+def _first_min_per_group(costs, starts, owner):
+    '''For consecutive groups of `costs` beginning at `starts`, return the
+    index of the first minimal entry in each group.  `owner` gives the group
+    number of each entry.  As in `optimal_strategy`, a group where every cost
+    is infinite picks its first entry.'''
+    mins = np.minimum.reduceat(costs, starts)
+    candidates = np.flatnonzero(costs == mins[owner])
+    _, first = np.unique(owner[candidates], return_index=True)
+    return candidates[first]
+
+def _solve_strategies(item_ids, known):
+    '''Solve every item reachable from `item_ids`, except those in `known`,
+    which maps already-solved item IDs to their costs.  Stores the results in
+    the optimal strategy caches and returns a dict mapping each newly solved
+    item ID to a `StrategyCacheEntry`.'''
+    strategies = {}
+    pending = list(item_ids)
+    while pending:
+        item_id = pending.pop()
+        if item_id is None or item_id in strategies or item_id in known:
+            continue
+        strategies[item_id] = list(valid_strategies(item_id))
+        for strategy in strategies[item_id]:
+            pending.extend(strategy.related_items())
+
+    levels = _topological_levels(
+            {item_id: _strategy_deps(strats) for item_id, strats in strategies.items()})
+    order = sorted(levels, key=levels.get)
+    if len(order) == 0:
+        return {}
+    index = {item_id: i for i, item_id in enumerate(order)}
+
+    # Already-solved ingredients get indices after all the items being solved,
+    # with their costs filled in up front.
+    external_cost = []
+    def ingredient_index_of(item_id):
+        i = index.get(item_id)
+        if i is None:
+            i = len(order) + len(external_cost)
+            index[item_id] = i
+            c = known[item_id]
+            external_cost.append(np.inf if c is None else c)
+        return i
+
+    # One entry per strategy, grouped by item in `order`.
+    owner = []
+    strategy_kind = []      # 0 = buy, 1 = craft, 2 = other
+    fixed_cost = []
+    ingredient_ptr = [0]
+    ingredient_index = []
+    ingredient_coef = []
+    item_start = np.zeros(len(order) + 1, dtype=np.int64)
+    for i, item_id in enumerate(order):
+        item_start[i] = len(owner)
+        for j, strategy in enumerate(strategies[item_id]):
+            owner.append(i)
+            if j == 0 and _has_price_strategy(item_id):
+                strategy_kind.append(0)
+                fixed_cost.append(strategy.price)
+            elif isinstance(strategy, StrategyCraft):
+                strategy_kind.append(1)
+                output_count = strategy.output_count
+                known_inputs = True
+                for ingredient_id, count in strategy.ingredients:
+                    if ingredient_id is None:
+                        known_inputs = False
+                        continue
+                    ingredient_index.append(ingredient_index_of(ingredient_id))
+                    ingredient_coef.append(count / output_count)
+                fixed_cost.append(0 if known_inputs else np.inf)
+            else:
+                strategy_kind.append(2)
+                fixed_cost.append(0)
+            ingredient_ptr.append(len(ingredient_index))
+    item_start[len(order)] = len(owner)
+
+    owner = np.array(owner, dtype=np.int64)
+    strategy_kind = np.array(strategy_kind, dtype=np.int8)
+    strategy_cost = np.array(fixed_cost, dtype=np.float64)
+    ingredient_ptr = np.array(ingredient_ptr, dtype=np.int64)
+    ingredient_index = np.array(ingredient_index, dtype=np.int64)
+    ingredient_coef = np.array(ingredient_coef, dtype=np.float64)
+    item_level = np.array([levels[item_id] for item_id in order], dtype=np.int64)
+
+    cost = np.concatenate((np.full(len(order), np.inf), external_cost))
+    choice = np.full(len(order), -1, dtype=np.int64)
+    craft_choice = np.full(len(order), -1, dtype=np.int64)
+    craft_cost = np.full(len(order), np.inf)
+    strategy_offset = np.arange(len(owner)) - item_start[owner]
+
+    def finite_or_none(x):
+        return x.item() if np.isfinite(x) else None
+
+    results = {}
+    def store(i):
+        item_id = order[i]
+        strats = strategies[item_id]
+        c = choice[i]
+        craft_c = craft_choice[i]
+        _OPTIMAL_STRATEGY_CACHE[item_id] = \
+                strats[c] if c >= 0 else _unknown_strategy(item_id)
+        _OPTIMAL_COST_CACHE[item_id] = finite_or_none(cost[i])
+        _OPTIMAL_CRAFT_STRATEGY_CACHE[item_id] = \
+                strats[craft_c] if craft_c >= 0 else _unknown_strategy(item_id)
+        _OPTIMAL_CRAFT_COST_CACHE[item_id] = finite_or_none(craft_cost[i])
+        # Strategy indices are persisted relative to `valid_strategies`, and
+        # the craft choice relative to the list without the buy strategy.
+        results[item_id] = StrategyCacheEntry(
+                STRATEGY_PRICES.get(item_id),
+                _OPTIMAL_COST_CACHE[item_id],
+                int(c),
+                int(craft_c - _has_price_strategy(item_id)) if craft_c >= 0 else -1,
+                _OPTIMAL_CRAFT_COST_CACHE[item_id],
+                sorted(_strategy_deps(strats)))
+
+    level_bounds = np.searchsorted(item_level, np.arange(item_level[-1] + 2))
+    for level in range(len(level_bounds) - 1):
+        lo, hi = level_bounds[level], level_bounds[level + 1]
+        s_lo, s_hi = item_start[lo], item_start[hi]
+
+        # Craft strategies: sum of ingredient costs weighted by count.  Only
+        # crafts have ingredients, so this level's ingredients are contiguous.
+        a, b = ingredient_ptr[s_lo], ingredient_ptr[s_hi]
+        if a < b:
+            terms = ingredient_coef[a:b] * cost[ingredient_index[a:b]]
+            crafts = np.arange(s_lo, s_hi)
+            crafts = crafts[ingredient_ptr[crafts + 1] > ingredient_ptr[crafts]]
+            strategy_cost[crafts] += np.add.reduceat(terms, ingredient_ptr[crafts] - a)
+
+        # Other strategies depend on already-solved items via the caches.
+        for j in np.flatnonzero(strategy_kind[s_lo:s_hi] == 2) + s_lo:
+            strategy = strategies[order[owner[j]]][strategy_offset[j]]
+            c = strategy.cost()
+            strategy_cost[j] = np.inf if c is None else c
+
+        # Pick the best strategy for each item.
+        local_owner = owner[s_lo:s_hi]
+        local_costs = strategy_cost[s_lo:s_hi]
+        if s_lo < s_hi:
+            items, starts = np.unique(local_owner, return_index=True)
+            best = _first_min_per_group(local_costs, starts,
+                    np.searchsorted(items, local_owner)) + s_lo
+            cost[items] = strategy_cost[best]
+            choice[items] = strategy_offset[best]
+
+        # Best strategy excluding buying the item itself.
+        not_buy = np.flatnonzero(strategy_kind[s_lo:s_hi] != 0)
+        if len(not_buy) > 0:
+            nb_owner = local_owner[not_buy]
+            items, starts = np.unique(nb_owner, return_index=True)
+            best = _first_min_per_group(local_costs[not_buy], starts,
+                    np.searchsorted(items, nb_owner))
+            craft_choice[items] = strategy_offset[not_buy[best] + s_lo]
+            craft_cost[items] = local_costs[not_buy[best]]
+
+        for i in range(lo, hi):
+            store(i)
+
+    return results
+
+# Persisted solver result for one item.  `choice` and `craft_choice` index
+# into `valid_strategies(item_id)` and `valid_strategies(item_id,
+# allow_buy=False)` respectively, or are -1 for `StrategyUnknown`.  `price` is
+# the buy price the result was computed with, and `deps` lists the items that
+# any of the item's strategies use.
+StrategyCacheEntry = namedtuple('StrategyCacheEntry',
+        ('price', 'cost', 'choice', 'craft_choice', 'craft_cost', 'deps'))
+
+STRATEGY_CACHE_DIR = os.path.join(STORAGE_DIR, 'strategy_cache')
+
+# Number of fingerprints to keep results for, on disk and in memory.
+# Commands solve with different parameters (`status` forbids buying its goal
+# items, for example, and `craft_profit` doesn't), so keeping only the last
+# one would make alternating commands throw away each other's results.
+FINGERPRINT_CACHE_SIZE = 4
+
+def _file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def _recipe_graph_key():
+    '''Describe everything that determines which strategies
+    `valid_strategies` yields for each item, apart from buy prices and
+    `STRATEGY_FORBID_BUY`.  Returns `None` if the current strategy parameters
+    can't be described.'''
+    if STRATEGY_CAN_CRAFT_RECIPE is policy_can_craft_recipe:
+        can_craft = gw2.character.get_max_of_each_discipline()
+    elif STRATEGY_CAN_CRAFT_RECIPE is can_craft_any_recipe:
+        can_craft = 'any'
+    else:
+        return None
+    return {
+        'build': gw2.build.current(),
+        'forbid_craft': sorted(STRATEGY_FORBID_CRAFT),
+        'can_craft': can_craft,
+        'research_note_separate': STRATEGY_RESEARCH_NOTE_SEPARATE,
+        'policy': _file_digest(policy.__file__) if policy is not None else None,
+        'mystic_forge': _file_digest(gw2.mystic_forge.__file__),
+    }
+
+def _load_fingerprint_file(directory, fingerprint):
+    '''Return the JSON stored for `fingerprint` in `directory`, or `None` if
+    there is none, and mark it as recently used.'''
+    path = os.path.join(directory, fingerprint + '.json')
+    try:
+        with open(path) as f:
+            j = json.load(f)
+    except FileNotFoundError:
+        return None
+    os.utime(path)
+    return j
+
+def _save_fingerprint_file(directory, fingerprint, j):
+    '''Store `j` for `fingerprint` in `directory`, and delete all but the
+    `FINGERPRINT_CACHE_SIZE` most recently used files there.'''
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, fingerprint + '.json')
+    with open(path + '.new', 'w') as f:
+        json.dump(j, f)
+    os.replace(path + '.new', path)
+
+    mtimes = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            try:
+                mtimes.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+    mtimes.sort(reverse=True)
+    for _, old_path in mtimes[FINGERPRINT_CACHE_SIZE:]:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(old_path)
+
+def _memo_put(memo, fingerprint, value):
+    memo[fingerprint] = value
+    memo.move_to_end(fingerprint)
+    while len(memo) > FINGERPRINT_CACHE_SIZE:
+        memo.popitem(last=False)
+
+def _hash_key(key):
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _strategy_cache_fingerprint():
+    '''Hash of everything other than prices that solver results depend on, or
+    `None` if the current strategy parameters can't be fingerprinted.'''
+    key = _recipe_graph_key()
+    if key is None:
+        return None
+    key['forbid_buy'] = sorted(STRATEGY_FORBID_BUY)
+    return _hash_key(key)
+
+# Entries most recently loaded from or saved to `STRATEGY_CACHE_DIR`, by
+# fingerprint, so a long-running process doesn't reread the files for every
+# command.
+_STRATEGY_CACHE_MEMO = OrderedDict()
+
+def _load_strategy_cache(fingerprint):
+    entries = _STRATEGY_CACHE_MEMO.get(fingerprint)
+    if entries is not None:
+        _STRATEGY_CACHE_MEMO.move_to_end(fingerprint)
+        return entries
+    j = _load_fingerprint_file(STRATEGY_CACHE_DIR, fingerprint)
+    if j is None:
+        return {}
+    entries = {item_id: StrategyCacheEntry(*entry) for item_id, *entry in j['items']}
+    _memo_put(_STRATEGY_CACHE_MEMO, fingerprint, entries)
+    return entries
+
+def _save_strategy_cache(fingerprint, entries):
+    _memo_put(_STRATEGY_CACHE_MEMO, fingerprint, entries)
+    _save_fingerprint_file(STRATEGY_CACHE_DIR, fingerprint, {
+        'items': [(item_id,) + tuple(entry) for item_id, entry in entries.items()],
+        })
+
+def _reusable_cache_entries(cache, item_ids):
+    '''Return the entries of `cache` that are still valid for computing
+    `item_ids`: those reachable from `item_ids` whose own price and the
+    prices of everything they depend on are unchanged.'''
+    reachable = set()
+    pending = list(item_ids)
+    while pending:
+        item_id = pending.pop()
+        if item_id in reachable or item_id not in cache:
+            continue
+        reachable.add(item_id)
+        pending.extend(cache[item_id].deps)
+
+    users = defaultdict(list)
+    for item_id in reachable:
+        for d in cache[item_id].deps:
+            users[d].append(item_id)
+
+    # Everything downstream of a changed price must be recomputed.
+    dirty = set()
+    pending = [item_id for item_id in reachable
+            if cache[item_id].price != STRATEGY_PRICES.get(item_id)
+                or any(d not in cache for d in cache[item_id].deps)]
+    while pending:
+        item_id = pending.pop()
+        if item_id in dirty:
+            continue
+        dirty.add(item_id)
+        pending.extend(users[item_id])
+
+    return {item_id: cache[item_id] for item_id in reachable - dirty}
+
+def solve_strategies(item_ids):
+    '''Compute the optimal strategy and cost of every item in `item_ids` and
+    everything they depend on, and store the results in the caches used by
+    `optimal_strategy`, `optimal_cost`, and `optimal_craft_strategy`.
+    Returns a dict mapping each item ID to its optimal cost.
+
+    The recipe graph is compiled into arrays: one row per strategy, with the
+    ingredients of each `StrategyCraft` stored CSR-style as item indices and
+    per-output counts.  Items are then processed in topological order, one
+    level at a time, with the cost of every strategy at that level computed
+    in a single vectorized step.  Strategies other than buying and crafting
+    (such as research note salvaging) are evaluated by calling their `cost`
+    method once their dependencies have been solved.
+
+    Results are persisted in `STRATEGY_CACHE_DIR`, in one file per
+    fingerprint of the game build, policy, and strategy parameters.  On the
+    next run with the same fingerprint, only items whose price changed, and
+    the items that use them, are solved again.'''
+    fingerprint = _strategy_cache_fingerprint()
+    cache = _load_strategy_cache(fingerprint) if fingerprint is not None else {}
+    reuse = _reusable_cache_entries(cache, item_ids)
+
+    for item_id, entry in reuse.items():
+        _OPTIMAL_COST_CACHE[item_id] = entry.cost
+        _OPTIMAL_CRAFT_COST_CACHE[item_id] = entry.craft_cost
+        _RESTORED_CHOICES[item_id] = (entry.choice, entry.craft_choice)
+
+    solved = _solve_strategies(item_ids,
+            {item_id: entry.cost for item_id, entry in reuse.items()})
+
+    if fingerprint is not None and len(solved) > 0:
+        cache.update(solved)
+        _save_strategy_cache(fingerprint, cache)
+
+    entries = dict(reuse)
+    entries.update(solved)
+    _record_solved_graph({item_id: entry.deps for item_id, entry in entries.items()})
+    return {item_id: entry.cost for item_id, entry in entries.items()}
+
+def _record_solved_graph(deps):
+    '''Remember the dependency graph of the items solved so far, for use by
+    `update_strategy_prices`.'''
+    global _SOLVED_ORDER
+    deps = dict(deps)
+    for item_id, ds in _SOLVED_DEPS.items():
+        deps.setdefault(item_id, ds)
+    levels = _topological_levels(deps)
+    _SOLVED_DEPS.clear()
+    _SOLVED_USERS.clear()
+    for item_id in levels:
+        _SOLVED_DEPS[item_id] = deps[item_id]
+        for d in deps[item_id]:
+            _SOLVED_USERS[d].append(item_id)
+    _SOLVED_ORDER = levels
+
+def update_strategy_prices(prices):
+    '''Change the buy prices of some items without resetting the strategy
+    caches.  `prices` maps item IDs to their new price, or `None` if the item
+    can no longer be bought.  Only items downstream of the changed ones are
+    re-evaluated, in topological order, and propagation stops at any item
+    whose optimal cost comes out unchanged.  Returns the set of item IDs
+    whose optimal cost or optimal craft cost changed.
+
+    Items that weren't covered by a previous `solve_strategies` call are
+    simply evicted from the caches, to be recomputed on demand.'''
+    global STRATEGY_PRICES
+    STRATEGY_PRICES = dict(STRATEGY_PRICES)
+    for item_id, price in prices.items():
+        if price is None:
+            STRATEGY_PRICES.pop(item_id, None)
+        else:
+            STRATEGY_PRICES[item_id] = price
+    return _propagate_strategy_changes(prices)
+
+def update_strategy_params(prices, forbid_buy, forbid_craft):
+    '''Like `set_strategy_params`, but keep the strategy caches.  Items whose
+    price, `forbid_buy` or `forbid_craft` status differs from the current
+    parameters are re-evaluated along with the items downstream of them, as in
+    `update_strategy_prices`.  `prices` is used as is, not copied.  Returns the
+    set of item IDs whose optimal cost or optimal craft cost changed.'''
+    global STRATEGY_PRICES, STRATEGY_FORBID_BUY, STRATEGY_FORBID_CRAFT
+    forbid_buy = set(forbid_buy)
+    forbid_craft = set(forbid_craft)
+    item_ids = (forbid_buy ^ set(STRATEGY_FORBID_BUY)) | \
+            (forbid_craft ^ set(STRATEGY_FORBID_CRAFT))
+    if prices is not STRATEGY_PRICES:
+        item_ids.update(item_id for item_id in set(chain(prices, STRATEGY_PRICES))
+                if prices.get(item_id) != STRATEGY_PRICES.get(item_id))
+    STRATEGY_PRICES = prices
+    STRATEGY_FORBID_BUY = forbid_buy
+    STRATEGY_FORBID_CRAFT = forbid_craft
+    return _propagate_strategy_changes(item_ids)
+
+def _propagate_strategy_changes(item_ids):
+    '''Re-evaluate `item_ids` after a change to their strategy parameters,
+    and then everything downstream of them in topological order, stopping at
+    any item whose optimal cost comes out unchanged.  Returns the set of item
+    IDs whose optimal cost or optimal craft cost changed.'''
+    heap = []
+    for item_id in item_ids:
+        level = _SOLVED_ORDER.get(item_id)
+        if level is not None:
+            heapq.heappush(heap, (level, item_id))
+
+    # Anything computed lazily outside the solved graph might depend on the
+    # changed items, and we have no way to tell.
+    for cache in (_OPTIMAL_STRATEGY_CACHE, _OPTIMAL_COST_CACHE,
+            _OPTIMAL_CRAFT_STRATEGY_CACHE, _OPTIMAL_CRAFT_COST_CACHE):
+        for item_id in [i for i in cache if i not in _SOLVED_ORDER]:
+            del cache[item_id]
+    # Cached craft deltas follow the old optimal strategies.
+    _CRAFT_DELTA_CACHE.clear()
+
+    changed = set()
+    seen = set()
+    while heap:
+        _, item_id = heapq.heappop(heap)
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+
+        old_cost = optimal_cost(item_id)
+        old_craft_cost = optimal_craft_cost(item_id)
+        _RESTORED_CHOICES.pop(item_id, None)
+
+        strategy = _choose_strategy(item_id, valid_strategies(item_id))
+        craft_strategy = _choose_strategy(item_id,
+                valid_strategies(item_id, allow_buy=False))
+        _OPTIMAL_STRATEGY_CACHE[item_id] = strategy
+        _OPTIMAL_COST_CACHE[item_id] = strategy.cost()
+        _OPTIMAL_CRAFT_STRATEGY_CACHE[item_id] = craft_strategy
+        _OPTIMAL_CRAFT_COST_CACHE[item_id] = craft_strategy.cost()
+
+        if _OPTIMAL_CRAFT_COST_CACHE[item_id] != old_craft_cost:
+            changed.add(item_id)
+        if _OPTIMAL_COST_CACHE[item_id] != old_cost:
+            changed.add(item_id)
+            for user in _SOLVED_USERS[item_id]:
+                heapq.heappush(heap, (_SOLVED_ORDER[user], user))
+
+    return changed
+
+RELATED_ITEMS_DIR = os.path.join(STORAGE_DIR, 'related_items')
+
+# Direct dependencies of each item, by fingerprint of the recipe graph (see
+# `_recipe_graph_key`), loaded from and saved to `RELATED_ITEMS_DIR`.
+_RELATED_INDEXES = OrderedDict()
+
+def _related_index(fingerprint):
+    if fingerprint is None:
+        return {}
+    index = _RELATED_INDEXES.get(fingerprint)
+    if index is None:
+        j = _load_fingerprint_file(RELATED_ITEMS_DIR, fingerprint)
+        index = {item_id: deps for item_id, deps in j['deps']} if j is not None else {}
+    _memo_put(_RELATED_INDEXES, fingerprint, index)
+    return index
+
+def _save_related_index(fingerprint, index):
+    _save_fingerprint_file(RELATED_ITEMS_DIR, fingerprint, {
+        'deps': list(index.items()),
+        })
 
 def gather_related_items(item_ids):
+    '''Return the set of `item_ids` and every item that any of their
+    strategies use, transitively.  Direct dependencies are recorded in a
+    persistent index, so items seen by earlier runs with the same recipe
+    graph don't need their strategies enumerated again.
+
+    Which strategies are valid depends on the strategy parameters, so
+    `set_strategy_params` (or `update_strategy_params`) must be called with
+    the intended `forbid_craft` and `can_craft_recipe` first.  The prices
+    don't matter and can be filled in afterward.'''
+    key = _recipe_graph_key()
+    fingerprint = _hash_key(key) if key is not None else None
+    index = _related_index(fingerprint)
+
     all_items = set()
-    def add_item_and_related(item_id):
+    added = False
+    pending = list(item_ids)
+    while pending:
+        item_id = pending.pop()
         if item_id in all_items:
-            return
+            continue
         all_items.add(item_id)
-        for strategy in valid_strategies(item_id):
-            for related_item_id in strategy.related_items():
-                add_item_and_related(related_item_id)
-    for item_id in item_ids:
-        add_item_and_related(item_id)
+        deps = index.get(item_id)
+        if deps is None:
+            deps = sorted(_strategy_deps(valid_strategies(item_id)))
+            index[item_id] = deps
+            added = True
+        pending.extend(deps)
+
+    if added and fingerprint is not None:
+        _save_related_index(fingerprint, index)
     return all_items
 
+def clear_solver_caches(on_disk=False):
+    '''Forget the solver results and related-items indexes loaded so far, so
+    they are reread from disk.  With `on_disk`, also delete the files, so the
+    next run starts from scratch.'''
+    _STRATEGY_CACHE_MEMO.clear()
+    _RELATED_INDEXES.clear()
+    if on_disk:
+        for path in (STRATEGY_CACHE_DIR, RELATED_ITEMS_DIR):
+            shutil.rmtree(path, ignore_errors=True)
+
+class _InventoryOverlay(ChainMap):
+    '''Copy-on-write view of an inventory dict.  Writes go to a private dict;
+    missing items count as zero.'''
+    def __missing__(self, key):
+        return 0
+
+# Cached results of `_compute_craft_delta`, for `count_craftable`.  Maps each
+# target item ID to a list of `(guards, delta)` pairs.  Cleared by
+# `set_strategy_params`, and whenever `count_craftable` is called with a
+# different `buy_on_demand` set.
+_CRAFT_DELTA_CACHE = {}
+_CRAFT_DELTA_BUY_ON_DEMAND = None
+# Number of deltas to keep for each target.
+CRAFT_DELTA_CACHE_SIZE = 8
+
+def _compute_craft_delta(target_item_id, inventory, buy_on_demand):
+    '''Find a set of available materials that can be used to craft one copy
+    of `target_item_id`.  This may be a mix of raw materials and/or
+    intermediate items that happen to be available.  Returns the change to
+    `inventory` from crafting it as a list of `(item_id, count)` pairs (or
+    `None` if some material would have to be bought or obtained), along with
+    a list of guards recording every inventory check the result depends on.
+    Items in `buy_on_demand` are added to `inventory` as needed.'''
+    delta = defaultdict(int)
+    pending_items = set()
+    state = State(delta, pending_items,
+            defaultdict(int), defaultdict(int), defaultdict(int))
+    guards = []
+
+    optimal_strategy(target_item_id).apply(state, 1)
+    while len(pending_items) > 0:
+        item_id = pending_items.pop()
+        if delta[item_id] >= 0:
+            continue
+        # Figure out how many of this item we need to craft.
+        have = inventory[item_id]
+        craft_count = -delta[item_id] - have
+        if craft_count <= 0:
+            # We can fulfill this requirement using only items currently
+            # available in the inventory.
+            guards.append(('cover', item_id, -delta[item_id], 0))
+            continue
+        # If this item is bought on demand, buy it
+        if item_id in buy_on_demand:
+            guards.append(('topup', item_id, have, craft_count))
+            inventory[item_id] += craft_count
+            continue
+        guards.append(('craft', item_id, have, 0))
+        optimal_strategy(item_id).apply(state, craft_count)
+
+    # Make sure all requirements were satisfied by crafting.
+    if any(v > 0 for v in state.buy_items.values()):
+        return None, guards
+    if any(v > 0 for v in state.obtain_items.values()):
+        return None, guards
+
+    # Now `delta[target_item_id]` should be positive, and `delta` should
+    # have negative values for all the raw materials it consumes.  (Note
+    # some intermediate materials may have positive values, such as if the
+    # recipe produces 5 per craft but we only consume 1.)
+    assert delta[target_item_id] > 0
+    return [(item_id, count) for item_id, count in delta.items() if count != 0], guards
+
+def _check_craft_delta_guards(guards, inventory):
+    '''Check whether a delta computed with the given `guards` is still valid
+    for `inventory`: every item that was covered by the inventory still is,
+    and every item that had to be crafted or bought on demand has the same
+    count as before.  Returns the list of buy-on-demand top-ups to replay,
+    or `None` if the delta must be recomputed.'''
+    changed = {}
+    topups = []
+    for kind, item_id, value, amount in guards:
+        have = changed.get(item_id, inventory[item_id])
+        if kind == 'cover':
+            if have < value:
+                return None
+        else:
+            if have != value:
+                return None
+            if kind == 'topup':
+                changed[item_id] = have + amount
+                topups.append((item_id, amount))
+    return topups
+
+def _craft_delta(target_item_id, inventory, buy_on_demand):
+    '''Cached version of `_compute_craft_delta`.  `buy_on_demand` must be a
+    frozenset.'''
+    global _CRAFT_DELTA_BUY_ON_DEMAND
+    if buy_on_demand != _CRAFT_DELTA_BUY_ON_DEMAND:
+        _CRAFT_DELTA_CACHE.clear()
+        _CRAFT_DELTA_BUY_ON_DEMAND = buy_on_demand
+
+    entries = _CRAFT_DELTA_CACHE.setdefault(target_item_id, [])
+    for guards, delta in entries:
+        topups = _check_craft_delta_guards(guards, inventory)
+        if topups is not None:
+            for item_id, count in topups:
+                inventory[item_id] += count
+            return delta
+
+    delta, guards = _compute_craft_delta(target_item_id, inventory, buy_on_demand)
+    entries.insert(0, (guards, delta))
+    del entries[CRAFT_DELTA_CACHE_SIZE:]
+    return delta
+
+def _craft_up_to(target_item_id, target_goal, inventory, buy_on_demand):
+    '''Craft copies of `target_item_id` into `inventory` until it holds
+    `target_goal` of them or no more can be crafted from what is available.
+    Our approach here is the following:
+
+    1. Find a set of available materials that can be used to craft one copy
+       of `target_item_id` (see `_compute_craft_delta`).  This is called
+       `delta`.  Deltas are cached, and a cached delta is reused as long as
+       the inventory checks it depends on come out the same.
+    2. Apply `delta` to inventory as many times as we can while keeping all
+       item quantities non-negative.
+    3. Repeat steps 1-2 until no `delta` can be found.'''
+    while inventory[target_item_id] < target_goal:
+        delta = _craft_delta(target_item_id, inventory, buy_on_demand)
+        if delta is None:
+            break
+
+        # Figure out how many times we can apply `delta` without making any
+        # `inventory` entry negative.
+        target_delta = dict(delta)[target_item_id]
+        remaining = target_goal - inventory[target_item_id]
+        max_apply = (remaining + target_delta - 1) // target_delta
+        for item_id, count in delta:
+            if count >= 0:
+                continue
+            item_max_apply = inventory[item_id] // -count
+            assert item_max_apply >= 1
+            if item_max_apply < max_apply:
+                max_apply = item_max_apply
+
+        # Apply `delta` to `inventory` that many times.
+        for item_id, count in delta:
+            inventory[item_id] += count * max_apply
+
+        # Now repeat.  The next iteration will compute a different `delta`.
+        # For example, we may have used up all of some intermediate material,
+        # so the next iteration must craft it from raw materials instead.
+
 def count_craftable(targets, inventory, buy_on_demand):
     '''Given a list `targets` of item IDs and counts, return the number of
     requested items that can be crafted via the optimal strategy, using only
@@ -657,90 +1538,46 @@ def count_craftable(targets, inventory, buy_on_demand):
     order, so an earlier item may consume materials and make a later item
     uncraftable.'''
     orig_inventory = inventory
-    inventory = defaultdict(int)
-    inventory.update(orig_inventory)
+    inventory = _InventoryOverlay({}, orig_inventory)
+    buy_on_demand = frozenset(buy_on_demand)
 
     target_goals = {item_id: inventory[item_id] + count
             for item_id, count in targets}
     craft_counts = {}
 
     for target_item_id, _ in targets:
-        # Craft up to `target_count` copies of `target_item_id`.  Our approach
-        # here is the following:
-        #
-        # 1. Find a set of available materials that can be used to craft one copy
-        #    of `target_item_id`.  This may be a mix of  raw materials and/or
-        #    intermediate items that happen to be available.  This is called
-        #    `delta`.
-        # 2. Apply `delta` to inventory as many times as we can while keeping all
-        #    item quantities non-negative.
-        # 3. Repeat steps 1-2 until no `delta` can be found.
-
         target_goal = target_goals[target_item_id]
-
-        while inventory[target_item_id] < target_goal:
-            delta = defaultdict(int)
-            pending_items = set()
-            state = State(delta, pending_items,
-                    defaultdict(int), defaultdict(int), defaultdict(int))
-
-            optimal_strategy(target_item_id).apply(state, 1)
-            while len(pending_items) > 0:
-                item_id = pending_items.pop()
-                if delta[item_id] >= 0:
-                    continue
-                # Figure out how many of this item we need to craft.
-                craft_count = -delta[item_id] - inventory[item_id]
-                if craft_count <= 0:
-                    # We can fulfill this requirement using only items currently
-                    # available in the inventory.
-                    continue
-                # If this item is bought on demand, buy it
-                if item_id in buy_on_demand:
-                    inventory[item_id] += craft_count
-                    continue
-                optimal_strategy(item_id).apply(state, craft_count)
-
-            # Make sure all requirements were satisfied by crafting.
-            if any(v > 0 for v in state.buy_items.values()):
-                break
-            if any(v > 0 for v in state.obtain_items.values()):
-                break
-
-            # Now `delta[target_item_id]` should be positive, and `delta` should
-            # have negative values for all the raw materials it consumes.  (Note
-            # some intermediate materials may have positive values, such as if the
-            # recipe produces 5 per craft but we only consume 1.)
-            assert delta[target_item_id] > 0
-
-            # Figure out how many times we can apply `delta` without making any
-            # `inventory` entry negative.
-            remaining = target_goal - inventory[target_item_id]
-            max_apply = (remaining + delta[target_item_id] - 1) // delta[target_item_id]
-            for item_id, count in delta.items():
-                if count >= 0:
-                    continue
-                item_max_apply = inventory[item_id] // -count
-                assert item_max_apply >= 1
-                if max_apply is None or item_max_apply < max_apply:
-                    max_apply = item_max_apply
-
-            # Apply `delta` to `inventory` that many times.
-            for item_id, count in delta.items():
-                inventory[item_id] += count * max_apply
-
-            # Now repeat.  The next iteration will compute a different `delta`.
-            # For example, we may have used up all of some intermediate material,
-            # so the next iteration must craft it from raw materials instead.
+        _craft_up_to(target_item_id, target_goal, inventory, buy_on_demand)
 
         # Record the amount crafted, then subtract out the target items so they
         # can't be used as mats for later steps.
         craft_counts[target_item_id] = max(0,
-                inventory[target_item_id] - orig_inventory[target_item_id])
+                inventory[target_item_id] - orig_inventory.get(target_item_id, 0))
         inventory[target_item_id] -= min(inventory[target_item_id], target_goal)
 
     return craft_counts
 
+def count_craftable_each(targets, inventory, buy_on_demand):
+    '''Like `count_craftable`, but count each target on its own, as if it
+    were the only item being crafted.  Returns a dict mapping each target
+    item ID to its count.
+
+    All targets are counted in one pass against a single overlay of
+    `inventory`, which is emptied between targets instead of being rebuilt.
+    Every target starts from the same base inventory, so deltas cached by
+    `count_craftable` or by earlier targets are reused whenever their guards
+    still hold.'''
+    overlay = _InventoryOverlay({}, inventory)
+    buy_on_demand = frozenset(buy_on_demand)
+
+    craft_counts = {}
+    for target_item_id, count in targets:
+        overlay.maps[0].clear()
+        have = overlay[target_item_id]
+        _craft_up_to(target_item_id, have + count, overlay, buy_on_demand)
+        craft_counts[target_item_id] = max(0, overlay[target_item_id] - have)
+    return craft_counts
+
 @policy_func
 def policy_can_craft_recipe(r):
     min_rating = r['min_rating']
@@ -750,17 +1587,43 @@ def policy_can_craft_recipe(r):
             return True
     return False
 
+@policy_func
+def policy_can_craft_recipes(recipes):
+    '''Batch form of `policy_can_craft_recipe`: return a sequence of bools
+    (or a numpy bool array), one for each recipe in `recipes`.  `policy.py` can
+    override this to decide for every recipe at once.'''
+    return [policy_can_craft_recipe(r) for r in recipes]
+
+def _overrides_can_craft_recipes():
+    return policy is not None and hasattr(policy, 'policy_can_craft_recipes')
+
+def craftable_recipe_ids():
+    '''Return the set of IDs of recipes that `policy_can_craft_recipes`
+    allows.  The policy is evaluated once per run.  This covers every recipe,
+    so the solver only uses it if `policy.py` overrides the batch hook, and
+    otherwise checks recipes one at a time as it reaches them.'''
+    craftable = _POLICY_CACHE.get('craftable_recipe_ids')
+    if craftable is None:
+        recipes = list(gw2.recipes.iter_all())
+        mask = np.asarray(policy_can_craft_recipes(recipes), dtype=bool)
+        assert mask.shape == (len(recipes),)
+        craftable = frozenset(r['id'] for r, ok in zip(recipes, mask) if ok)
+        _POLICY_CACHE['craftable_recipe_ids'] = craftable
+    return craftable
+
 @policy_func
 def get_char_names():
     return gw2.api.fetch('/v2/characters')
 
+@policy_once
 @policy_func
 def policy_forbid_buy():
     forbid = set()
 
     # Forbid buying or selling intermediate crafting items.
+    craftable = craftable_recipe_ids()
     for r in gw2.recipes.iter_all():
-        if not policy_can_craft_recipe(r):
+        if r['id'] not in craftable:
             continue
 
         item = gw2.items.get(r['output_item_id'])
@@ -836,6 +1699,7 @@ def policy_forbid_buy():
 
     return forbid
 
+@policy_once
 @policy_func
 def policy_forbid_craft():
     forbid = set()
@@ -853,6 +1717,7 @@ def policy_forbid_craft():
 
     return forbid
 
+@policy_once
 @policy_func
 def policy_buy_on_demand():
     buy = set()
@@ -878,6 +1743,7 @@ def policy_buy_on_demand():
 
     return buy
 
+@policy_once
 @policy_func
 def policy_auto_refine():
     '''Items that should be crafted if their inputs are already available, even
@@ -909,10 +1775,18 @@ def policy_auto_refine():
             gw2.items.search_name('Imperial Favor'),
             )
 
+@policy_once
 @policy_func
 def policy_enhance_craft_profit():
     return False
 
+@policy_func
+def policy_row_filter_mask(rows):
+    '''Batch form of `policy_row_filter`: return a sequence of bools (or a
+    numpy bool array), one for each row in `rows`.  `policy.py` can override
+    this to filter all rows at once.'''
+    return [policy_row_filter(row) for row in rows]
+
 @policy_func
 def policy_row_filter(craft_item_row):
     # if craft_item_row['sell_price'] >= craft_item_row['buy_price'] * 5.5:
@@ -996,7 +1870,351 @@ def policy_research_note_strategies():
 def cmd_init():
     os.makedirs('books', exist_ok=True)
 
-def calculate_status():
+def depth_adjusted_prices(buy_prices, books, buy_counts, vendor_items=()):
+    '''Return a copy of `buy_prices` where the price of each item in
+    `buy_counts` is raised by the marginal depth premium of buying that many:
+    how much more the last one costs than the cheapest sell listing in its
+    order book in `books` (see `OrderBook.buy_premium`).  The premium is
+    measured entirely on the sell listings, since those set the depth of the
+    market, and is added on top of the price we plan to pay.  The solver
+    compares the unit costs of buying and crafting, so it needs the cost of
+    the last unit rather than the average.  For liquid items the premium is
+    usually zero; for thin materials, buying thousands can cost far more than
+    the best listed price suggests.  Vendor items have unlimited supply and
+    are left unchanged.'''
+    prices = buy_prices.copy()
+    for item_id, count in buy_counts.items():
+        if count <= 0 or item_id in vendor_items or item_id not in prices:
+            continue
+        book = books.get(item_id)
+        if book is None:
+            continue
+        premium = book.buy_premium(count)
+        if premium:
+            prices[item_id] = buy_prices[item_id] + premium
+    return prices
+
+def plan_buy_cost(buy_items, buy_prices, books, vendor_items=()):
+    '''Total cost of buying `buy_items`, including the slippage of buying
+    that many from each item's order book in `books`.  Like
+    `depth_adjusted_prices`, the slippage is measured on the sell listings,
+    but averaged over the whole quantity, since this is a total.'''
+    total = 0
+    for item_id, count in buy_items.items():
+        if count <= 0:
+            continue
+        unit_price = buy_prices.get(item_id, 0)
+        book = books.get(item_id)
+        if book is not None and item_id not in vendor_items:
+            unit_price += book.buy_slippage(count) or 0
+        total += count * unit_price
+    return total
+
+def resolve_shortages(inventory, stockpile, shortage_items, keys):
+    '''Choose strategies to bring every item in `inventory` up to zero (for
+    items in `shortage_items`) and then up to its `stockpile` target (for items
+    in `keys`), using the current strategy parameters.  Updates `inventory` in
+    place and returns a dict describing the items to buy, obtain, and craft.'''
+    # Process items until all stockpile requirements are satisfied.
+    buy_items = defaultdict(int)
+    craft_items = defaultdict(int)
+    obtain_items = defaultdict(int)
+    pending_items = set()
+    state = State(
+            inventory,
+            pending_items,
+            buy_items,
+            craft_items,
+            obtain_items,
+            )
+
+    # First pass: run until all inventory quantities are non-negative.  This
+    # amounts to successfully crafting all the goal items.
+    with phase('shortages: first pass'):
+        pending_items.update(shortage_items)
+        while len(pending_items) > 0:
+            item_id = pending_items.pop()
+            shortage = -inventory.get(item_id, 0)
+            if shortage <= 0:
+                continue
+
+            strategy = optimal_strategy(item_id)
+            strategy.apply(state, shortage)
+            assert inventory.get(item_id, 0) >= 0, \
+                    'strategy %r failed to produce %d %s' % (
+                            strategy, shortage, gw2.items.name(item_id))
+
+    # Compute what items we need to craft to restore all stockpiles.
+    shortage_items = set(shortage_items)
+    craft_stockpile_items = {}
+    for item_id in keys:
+        shortage = stockpile.get(item_id, 0) - inventory.get(item_id, 0)
+        if shortage <= 0:
+            continue
+        shortage_items.add(item_id)
+        if isinstance(optimal_strategy(item_id), (StrategyBuy, StrategyUnknown)):
+            continue
+        craft_stockpile_items[item_id] = shortage
+
+    # Second pass: run until stockpile requirements are satisfied.
+    with phase('shortages: second pass'):
+        assert len(pending_items) == 0
+        pending_items.update(shortage_items)
+        while len(pending_items) > 0:
+            item_id = pending_items.pop()
+            shortage = stockpile.get(item_id, 0) - inventory.get(item_id, 0)
+            if shortage <= 0:
+                continue
+
+            strategy = optimal_strategy(item_id)
+            strategy.apply(state, shortage)
+            assert inventory.get(item_id, 0) >= stockpile.get(item_id, 0), \
+                    'strategy %r failed to produce %d %s' % (
+                            strategy, shortage, gw2.items.name(item_id))
+
+    # Third pass: for items to be bought or otherwise obtained, try refining
+    # the item from extra materials on hand.
+    auto_refined = []
+    with phase('shortages: third pass'):
+        for item_id in policy_auto_refine():
+            buy_shortage = buy_items.get(item_id, 0)
+            obtain_shortage = obtain_items.get(item_id, 0)
+            shortage = buy_shortage + obtain_shortage
+            if shortage <= 0:
+                continue
+
+            total_refined = 0
+            for strategy in valid_strategies(item_id, allow_refine_only=True):
+                if not isinstance(strategy, StrategyCraft):
+                    continue
+                count = strategy.max_count(state, exclude=stockpile, max_output=shortage)
+                strategy.apply(state, count)
+                shortage -= count
+                total_refined += count
+
+            auto_refined.append((item_id, total_refined))
+
+            # Undo the previous decision to buy/obtain this item, since we can
+            # refine it instead.
+            count = total_refined
+            skip_buy = min(count, buy_shortage)
+            if skip_buy > 0:
+                buy_items[item_id] -= skip_buy
+                count -= skip_buy
+            skip_obtain = min(count, obtain_shortage)
+            if skip_obtain > 0:
+                obtain_items[item_id] -= skip_obtain
+                count -= skip_obtain
+            # `total_refined` should never exceed `buy_shortage + obtain_shortage`.
+            assert count == 0
+
+    return {
+            'buy_items': buy_items,
+            'obtain_items': obtain_items,
+            'craft_stockpile_items': craft_stockpile_items,
+            'auto_refined': auto_refined,
+            }
+
+
+# Cost per unit charged by the exact planner for items obtained by unknown
+# means.  This is large enough that buying or crafting always wins when it's
+# possible at all.
+EXACT_OBTAIN_PENALTY = 1e9
+# Tiny cost per craft, so the exact planner never crafts items it doesn't need.
+EXACT_CRAFT_EPSILON = 1e-3
+# Largest program the exact planner will build, in columns, and how long the
+# solver may run in seconds.  Beyond either, `status --exact` uses the greedy
+# plan.
+EXACT_MAX_COLUMNS = 100000
+EXACT_TIME_LIMIT = 10
+
+class ExactPlanUnavailable(Exception):
+    '''Raised by `resolve_shortages_exact` for shortages it can't plan, so
+    that the greedy plan can be used instead.'''
+
+def _exact_buy_segments(item_id, price, book, vendor_items):
+    '''Split the cost of buying `item_id` into `(unit_cost, capacity)`
+    segments of increasing cost, following the depth of its order book the
+    same way as `depth_adjusted_prices`.  The last segment has unlimited
+    capacity (`None`).'''
+    if book is None or item_id in vendor_items:
+        return [(price, None)]
+    levels = book.buy_levels()
+    if len(levels) == 0:
+        return [(price, None)]
+    best = levels[0][0]
+    segments = [(price + p - best, q) for p, q in levels[:-1]]
+    segments.append((price + levels[-1][0] - best, None))
+    return segments
+
+def resolve_shortages_exact(inventory, stockpile, shortage_items, keys,
+        books=None, vendor_items=()):
+    '''Exact alternative to `resolve_shortages`, using the same strategy
+    parameters.  Instead of resolving one item at a time at fixed unit
+    prices, this builds a mixed-integer program over every buy, craft and
+    research note strategy reachable from the shortages and minimizes the
+    total cost of bringing every item up to zero (and every item in `keys`
+    up to its `stockpile` target).  This accounts for materials on hand,
+    intermediates shared between several outputs, whole-recipe output counts,
+    and (if `books` is provided) order book depth.  Items in
+    `policy_auto_refine` may also use refine-only recipes.
+
+    Only crafts are integer variables.  Each buy and obtain column affects a
+    single item, with integer capacity, so they come out integral anyway, and
+    leaving them continuous makes the program far quicker to solve.
+
+    Requires `scipy`.  Updates `inventory` in place and returns a dict in the
+    same format as `resolve_shortages`.  Raises `ExactPlanUnavailable` if any
+    item has strategies from `policy_extra_strategies`, which can't be
+    expressed as linear constraints, if the program would have more than
+    `EXACT_MAX_COLUMNS` columns, or if it isn't solved within
+    `EXACT_TIME_LIMIT` seconds.'''
+    if scipy is None:
+        raise RuntimeError('the exact planner requires scipy')
+    if books is None:
+        books = {}
+
+    auto_refine = set(policy_auto_refine())
+
+    # Collect the items and strategies involved.
+    items = []
+    index = {}
+    strategies = {}
+    pending = [item_id for item_id in keys
+            if inventory.get(item_id, 0) < stockpile.get(item_id, 0)]
+    pending.extend(shortage_items)
+    while pending:
+        item_id = pending.pop()
+        if item_id is None or item_id in index:
+            continue
+        index[item_id] = len(items)
+        items.append(item_id)
+        strategies[item_id] = list(valid_strategies(item_id,
+            allow_refine_only=item_id in auto_refine))
+        for strategy in strategies[item_id]:
+            if not isinstance(strategy,
+                    (StrategyBuy, StrategyCraft, StrategyResearchNote)):
+                raise ExactPlanUnavailable(
+                        '%s has a strategy from policy_extra_strategies'
+                        % gw2.items.name(item_id))
+            pending.extend(strategy.related_items())
+
+    # Columns of the program.  Each is `(kind, item_id, detail)`, with a cost
+    # and an upper bound, plus a list of `(row, coefficient)` entries giving
+    # its effect on each item's final count.
+    columns = []
+    col_cost = []
+    col_upper = []
+    col_integer = []
+    entries_row = []
+    entries_col = []
+    entries_val = []
+
+    def add_column(kind, item_id, detail, cost, upper, integer, effects):
+        j = len(columns)
+        columns.append((kind, item_id, detail))
+        col_cost.append(cost)
+        col_upper.append(np.inf if upper is None else upper)
+        col_integer.append(1 if integer else 0)
+        for effect_item_id, amount in effects:
+            entries_row.append(index[effect_item_id])
+            entries_col.append(j)
+            entries_val.append(amount)
+
+    for item_id in items:
+        for strategy in strategies[item_id]:
+            if isinstance(strategy, StrategyBuy):
+                for unit_cost, capacity in _exact_buy_segments(item_id,
+                        strategy.price, books.get(item_id), vendor_items):
+                    add_column('buy', item_id, None, unit_cost, capacity, False,
+                            [(item_id, 1)])
+            elif isinstance(strategy, StrategyCraft):
+                effects = defaultdict(int)
+                effects[item_id] += strategy.output_count
+                for ingredient_id, count in strategy.ingredients:
+                    effects[ingredient_id] -= count
+                add_column('craft', item_id, strategy, EXACT_CRAFT_EPSILON, None,
+                        True, effects.items())
+            elif isinstance(strategy, StrategyResearchNote):
+                effects = defaultdict(int)
+                for ingredient_id, count, notes in strategy.items:
+                    effects[ITEM_RESEARCH_NOTE] += count * notes
+                    effects[ingredient_id] -= count
+                add_column('craft', item_id, strategy, EXACT_CRAFT_EPSILON, None,
+                        True, effects.items())
+        add_column('obtain', item_id, None, EXACT_OBTAIN_PENALTY, None, False,
+                [(item_id, 1)])
+
+    if len(columns) > EXACT_MAX_COLUMNS:
+        raise ExactPlanUnavailable('%d columns, more than %d' % (
+            len(columns), EXACT_MAX_COLUMNS))
+
+    # Every item must end up at or above its target.
+    start = np.array([inventory.get(item_id, 0) for item_id in items], dtype=np.float64)
+    target = np.array([max(0, stockpile.get(item_id, 0)) if item_id in keys else 0
+        for item_id in items], dtype=np.float64)
+    a = scipy.sparse.csr_array((entries_val, (entries_row, entries_col)),
+            shape=(len(items), len(columns)))
+
+    result = scipy.optimize.milp(
+            np.array(col_cost),
+            integrality=np.array(col_integer),
+            bounds=scipy.optimize.Bounds(0, np.array(col_upper)),
+            constraints=scipy.optimize.LinearConstraint(a, target - start, np.inf),
+            options={'time_limit': EXACT_TIME_LIMIT})
+    if result.status == 1:
+        raise ExactPlanUnavailable('not solved within %gs' % EXACT_TIME_LIMIT)
+    if result.x is None:
+        raise RuntimeError('exact planner failed: %s' % result.message)
+    # Round continuous columns up, so that rounding error never leaves an item
+    # short.
+    x = [int(round(v)) if integer else math.ceil(v - 1e-6)
+            for v, integer in zip(result.x, col_integer)]
+
+    buy_items = defaultdict(int)
+    obtain_items = defaultdict(int)
+    crafted = defaultdict(int)
+    auto_refined = defaultdict(int)
+    state = State(inventory, set(), buy_items, defaultdict(int), obtain_items)
+    for (kind, item_id, detail), count in zip(columns, x):
+        if count <= 0:
+            continue
+        if kind == 'buy':
+            buy_items[item_id] += count
+            inventory[item_id] = inventory.get(item_id, 0) + count
+        elif kind == 'obtain':
+            obtain_items[item_id] += count
+            inventory[item_id] = inventory.get(item_id, 0) + count
+        else:
+            if isinstance(detail, StrategyCraft):
+                output = detail.output_count * count
+                if detail.recipe.get('bookkeeper_refine_only'):
+                    auto_refined[item_id] += output
+            else:
+                output = sum(n * notes for _, n, notes in detail.items) * count
+            crafted[item_id] += output
+            detail.apply(state, output)
+
+    # As in `resolve_shortages`, report the crafts needed to restore
+    # stockpiles, after accounting for stock used up as ingredients.
+    craft_stockpile_items = {}
+    for item_id in keys:
+        if crafted.get(item_id, 0) <= 0:
+            continue
+        shortage = stockpile.get(item_id, 0) - (
+                inventory.get(item_id, 0) - crafted[item_id])
+        if shortage > 0:
+            craft_stockpile_items[item_id] = min(shortage, crafted[item_id])
+
+    return {
+            'buy_items': buy_items,
+            'obtain_items': obtain_items,
+            'craft_stockpile_items': craft_stockpile_items,
+            'auto_refined': sorted(auto_refined.items()),
+            }
+
+
+def calculate_status(exact=False):
     # Strategy:
     #
     # We keep a dict called `inventory`, which maps each item ID to an integer
@@ -1030,21 +2248,27 @@ def calculate_status():
     #   - update to_check when subtracting craft ingredients
     #   - loop until to_check is empty
 
+    inputs = _status_inputs()
+    return _plan_status(inputs, inputs['goals'], inputs['inventory'],
+            _status_prices, policy_forbid_buy(), policy_forbid_craft(), exact=exact)
+
+def _status_inputs():
+    '''Load the goals, stockpile targets and account state that
+    `calculate_status` plans from.  `orig_inventory` is everything on hand,
+    and `inventory` also counts items from pending buy orders.'''
     goals = _load_zero_dict(GOALS_PATH)
     stockpile = _load_zero_dict(STOCKPILE_PATH)
 
-    sold = gw2.trading_post.total_sold()
-    sell_orders, selling_items = gw2.trading_post.pending_sells()
-    buy_orders, buying_items = gw2.trading_post.pending_buys()
-    delivery = gw2.api.fetch_with_retries('/v2/commerce/delivery')
-    wallet_raw = gw2.api.fetch_with_retries('/v2/account/wallet')
-    wallet = {x['id']: x['value'] for x in wallet_raw}
+    with phase('account fetch'):
+        account = get_account_snapshot(*gw2.account.SOURCES)
+    wallet = account.wallet
+    delivery = account.delivery
 
     gold = wallet[CURRENCY_COIN]
     gold += delivery['coins']
 
     inventory = defaultdict(int)
-    inventory.update(get_inventory())
+    inventory.update(account.inventory())
     # Convert research notes in wallet to research note items
     for c, i in CURRENCY_ITEMS:
         if c in wallet:
@@ -1057,10 +2281,54 @@ def calculate_status():
     orig_inventory = inventory.copy()
 
     # We assume all pending buy orders will eventually be fulfilled.
-    for item_id, count in buying_items.items():
+    for item_id, count in account.buying_items.items():
         inventory[item_id] += count
 
+    return {
+            'goals': goals,
+            'stockpile': stockpile,
+            'gold': gold,
+            'orig_inventory': orig_inventory,
+            'inventory': inventory,
+            'sold': account.sold,
+            'buy_orders': account.buy_orders,
+            'buying_items': account.buying_items,
+            'sell_orders': account.sell_orders,
+            'selling_items': account.selling_items,
+            }
+
+def _status_prices(related_items):
+    '''Fetch the prices and order books of `related_items` for
+    `calculate_status`.'''
+    with phase('price fetch'):
+        buy_prices, sell_prices, buy_listings, sell_listings = \
+                get_prices_and_listings(related_items, max_age=STATUS_PRICE_MAX_AGE)
+
+    for item_id, buy_price in buy_prices.items():
+        if item_id not in sell_prices:
+            sell_prices[item_id] = buy_price
+
+    return {
+            'buy_prices': buy_prices,
+            'sell_prices': sell_prices,
+            'buy_listings': buy_listings,
+            'sell_listings': sell_listings,
+            'books': {item_id: gw2.order_book.OrderBook(buy_listings[item_id],
+                sell_listings[item_id]) for item_id in buy_listings},
+            }
 
+def _plan_status(inputs, goals, inventory, fetch_prices, forbid_buy, forbid_craft,
+        exact=False, incremental=False):
+    '''Plan how to reach `goals` from the account state in `inputs` (see
+    `_status_inputs`), and return the result of `calculate_status`.
+    `inventory` is updated in place.  `fetch_prices(related_items)` returns
+    prices in the format of `_status_prices`.  With `incremental`, the
+    strategy parameters are changed with `update_strategy_params` instead of
+    being reset by `set_strategy_params` and solved from scratch.'''
+    stockpile = inputs['stockpile']
+    sold = inputs['sold']
+    selling_items = inputs['selling_items']
+    orig_inventory = inputs['orig_inventory']
 
     # Subtract from `inventory` any additional sell orders we need to place to
     # achieve the current `goals`.
@@ -1086,112 +2354,81 @@ def calculate_status():
         if inventory.get(item_id, 0) < stockpile.get(item_id, 0):
             shortage_items.add(item_id)
     
-    related_items = set(chain(
-        gather_related_items(chain(shortage_items, goals.keys())),
-        buying_items, selling_items))
-    buy_prices, sell_prices, buy_listings, sell_listings = \
-            get_prices_and_listings(related_items)
-
-    for item_id, buy_price in buy_prices.items():
-        if item_id not in sell_prices:
-            sell_prices[item_id] = buy_price
-
-    set_strategy_params(
-            buy_prices,
-            set(chain(policy_forbid_buy(), goals.keys())),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
-
-    # Process items until all stockpile requirements are satisfied.
-    buy_items = defaultdict(int)
-    craft_items = defaultdict(int)
-    obtain_items = defaultdict(int)
-    pending_items = set()
-    state = State(
-            inventory,
-            pending_items,
-            buy_items,
-            craft_items,
-            obtain_items,
-            )
-
-    # First pass: run until all inventory quantities are non-negative.  This
-    # amounts to successfully crafting all the goal items.
-    pending_items.update(shortage_items)
-    while len(pending_items) > 0:
-        item_id = pending_items.pop()
-        shortage = -inventory.get(item_id, 0)
-        if shortage <= 0:
-            continue
-
-        strategy = optimal_strategy(item_id)
-        strategy.apply(state, shortage)
-        assert inventory.get(item_id, 0) >= 0, \
-                'strategy %r failed to produce %d %s' % (
-                        strategy, shortage, gw2.items.name(item_id))
-
-    # Compute what items we need to craft to restore all stockpiles.
-    craft_stockpile_items = {}
-    for item_id in keys:
-        shortage = stockpile.get(item_id, 0) - inventory.get(item_id, 0)
-        if shortage <= 0:
-            continue
-        shortage_items.add(item_id)
-        if isinstance(optimal_strategy(item_id), (StrategyBuy, StrategyUnknown)):
-            continue
-        craft_stockpile_items[item_id] = shortage
-
-    # Second pass: run until stockpile requirements are satisfied.
-    assert len(pending_items) == 0
-    pending_items.update(shortage_items)
-    while len(pending_items) > 0:
-        item_id = pending_items.pop()
-        shortage = stockpile.get(item_id, 0) - inventory.get(item_id, 0)
-        if shortage <= 0:
-            continue
-
-        strategy = optimal_strategy(item_id)
-        strategy.apply(state, shortage)
-        assert inventory.get(item_id, 0) >= stockpile.get(item_id, 0), \
-                'strategy %r failed to produce %d %s' % (
-                        strategy, shortage, gw2.items.name(item_id))
-
-    # Third pass: for items to be bought or otherwise obtained, try refining
-    # the item from extra materials on hand.
-    for item_id in policy_auto_refine():
-        buy_shortage = buy_items.get(item_id, 0)
-        obtain_shortage = obtain_items.get(item_id, 0)
-        shortage = buy_shortage + obtain_shortage
-        if shortage <= 0:
-            continue
-
-        total_refined = 0
-        for strategy in valid_strategies(item_id, allow_refine_only=True):
-            if not isinstance(strategy, StrategyCraft):
-                continue
-            count = strategy.max_count(state, exclude=stockpile, max_output=shortage)
-            strategy.apply(state, count)
-            shortage -= count
-            total_refined += count
-
-        print('auto-refined %d %s' % (total_refined,
-            gw2.items.name(item_id)))
-
-        # Undo the previous decision to buy/obtain this item, since we can
-        # refine it instead.
-        count = total_refined
-        skip_buy = min(count, buy_shortage)
-        if skip_buy > 0:
-            buy_items[item_id] -= skip_buy
-            count -= skip_buy
-        skip_obtain = min(count, obtain_shortage)
-        if skip_obtain > 0:
-            obtain_items[item_id] -= skip_obtain
-            count -= skip_obtain
-        # `total_refined` should never exceed `buy_shortage + obtain_shortage`.
-        assert count == 0
+    # The related items depend on which items can be crafted, so the strategy
+    # parameters are set before gathering them, and the prices are filled in
+    # once they've been fetched.
+    forbid_buy = set(chain(forbid_buy, goals.keys()))
+    if incremental:
+        update_strategy_params(STRATEGY_PRICES, forbid_buy, forbid_craft)
+    else:
+        set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
+    with phase('gather_related_items'):
+        related_items = set(chain(
+            gather_related_items(chain(shortage_items, goals.keys())),
+            inputs['buying_items'], selling_items))
+    prices = fetch_prices(related_items)
+    buy_prices = prices['buy_prices']
+    sell_prices = prices['sell_prices']
+
+    # Plan using the best listed prices, then re-plan once with buy prices
+    # adjusted for the depth of the order book at the quantities we actually
+    # need to buy.  The first plan solves every related item; the re-plan
+    # only re-solves the items whose price changed and those downstream of
+    # them (see `update_strategy_params`).
+    books = prices['books']
+    vendor_items = add_vendor_prices({})
+    strategy_prices = buy_prices
+    base_inventory = inventory
+    greedy_start = time.perf_counter()
+    update_strategy_params(strategy_prices, forbid_buy, forbid_craft)
+    if not incremental:
+        with phase('solve_strategies'):
+            solve_strategies(related_items)
+    while True:
+        inventory = base_inventory.copy()
+        with phase('resolve_shortages'):
+            plan = resolve_shortages(inventory, stockpile, shortage_items, keys)
+        if strategy_prices is not buy_prices:
+            break
+        adjusted_prices = depth_adjusted_prices(buy_prices, books,
+                plan['buy_items'], vendor_items)
+        if adjusted_prices == buy_prices:
+            break
+        strategy_prices = adjusted_prices
+        update_strategy_params(strategy_prices, forbid_buy, forbid_craft)
+    greedy_time = time.perf_counter() - greedy_start
+
+    if exact:
+        def describe_plan(plan, elapsed):
+            cost = plan_buy_cost(plan['buy_items'], buy_prices, books, vendor_items)
+            num_obtain = sum(count for count in plan['obtain_items'].values() if count > 0)
+            return '%s, %d to obtain, %.3fs' % (format_price(cost), num_obtain, elapsed)
+        greedy_desc = describe_plan(plan, greedy_time)
+        greedy = (plan, inventory, strategy_prices)
+
+        strategy_prices = buy_prices
+        update_strategy_params(buy_prices, forbid_buy, forbid_craft)
+        exact_start = time.perf_counter()
+        inventory = base_inventory.copy()
+        try:
+            with phase('resolve_shortages_exact'):
+                plan = resolve_shortages_exact(inventory, stockpile, shortage_items,
+                        keys, books, vendor_items)
+        except ExactPlanUnavailable as e:
+            print('greedy plan: %s' % greedy_desc)
+            print('exact plan:  unavailable (%s), using the greedy plan' % e)
+            plan, inventory, strategy_prices = greedy
+            update_strategy_params(strategy_prices, forbid_buy, forbid_craft)
+        else:
+            exact_time = time.perf_counter() - exact_start
+            print('greedy plan: %s' % greedy_desc)
+            print('exact plan:  %s' % describe_plan(plan, exact_time))
 
+    buy_items = plan['buy_items']
+    obtain_items = plan['obtain_items']
+    craft_stockpile_items = plan['craft_stockpile_items']
+    for item_id, count in plan['auto_refined']:
+        print('auto-refined %d %s' % (count, gw2.items.name(item_id)))
 
     used_items = {}
     for item_id, old_count in orig_inventory.items():
@@ -1205,24 +2442,25 @@ def calculate_status():
             sorted(craft_goal_items.items(), key=lambda x: gw2.items.name(x[0])),
             sorted(craft_stockpile_items.items(), key=lambda x: gw2.items.name(x[0]))):
         craft_items[item_id] += count
-    craft_counts = count_craftable(list(craft_items.items()), orig_inventory,
-            policy_buy_on_demand())
-
-    craft_only_counts = {
-            item_id: count_craftable([(item_id, count)], orig_inventory,
-                policy_buy_on_demand()).get(item_id, 0)
-            for item_id, count in craft_items.items()
-            }
+    buy_on_demand = policy_buy_on_demand()
+    with phase('count_craftable'):
+        craft_counts = count_craftable(list(craft_items.items()), orig_inventory,
+                buy_on_demand)
+        craft_only_counts = count_craftable_each(craft_items.items(), orig_inventory,
+                buy_on_demand)
 
     return {
-            'gold': gold,
+            'gold': inputs['gold'],
             'orig_inventory': orig_inventory,
             'buy_prices': buy_prices,
+            # `buy_prices`, adjusted for order book depth.  These are the
+            # prices used when choosing strategies.
+            'strategy_prices': strategy_prices,
             'sell_prices': sell_prices,
-            'buy_listings': buy_listings,
-            'sell_listings': sell_listings,
-            'buy_orders': buy_orders,
-            'sell_orders': sell_orders,
+            'buy_listings': prices['buy_listings'],
+            'sell_listings': prices['sell_listings'],
+            'buy_orders': inputs['buy_orders'],
+            'sell_orders': inputs['sell_orders'],
             'sold': sold,
             'goals': goals,
             'craft_goal_items': craft_goal_items,
@@ -1239,6 +2477,160 @@ def calculate_status():
             }
 
 
+class Scenario:
+    '''A what-if change to the inputs of `calculate_status`.  `price_factors`
+    maps item IDs to a factor to multiply their buy and sell prices by,
+    `goals` maps item IDs to an amount to add to their goal, and `forbid_buy`
+    and `forbid_craft` are extra items that may not be bought or crafted.'''
+    __slots__ = ('name', 'price_factors', 'goals', 'forbid_buy', 'forbid_craft')
+
+    def __init__(self, name, price_factors=None, goals=None, forbid_buy=(),
+            forbid_craft=()):
+        self.name = name
+        self.price_factors = price_factors or {}
+        self.goals = goals or {}
+        self.forbid_buy = forbid_buy
+        self.forbid_craft = forbid_craft
+
+    @staticmethod
+    def from_json(j):
+        '''Build a `Scenario` from a dict with the same keys, where items can
+        be given by name or ID.'''
+        def items(xs):
+            return [parse_item_id(str(x)) for x in xs]
+        def item_dict(d):
+            return {parse_item_id(str(k)): v for k, v in d.items()}
+        return Scenario(j['name'],
+                item_dict(j.get('price_factors', {})),
+                item_dict(j.get('goals', {})),
+                items(j.get('forbid_buy', ())),
+                items(j.get('forbid_craft', ())))
+
+class ScenarioEngine:
+    '''Evaluates any number of `Scenario`s against one base state.  The
+    account state and prices are fetched once, and each scenario sees them
+    through copy-on-write `ChainMap` overlays holding only the goals, prices
+    and inventory counts it changes.  The strategy solver is primed once with
+    `solve_strategies`; after that, each scenario only re-solves the items
+    whose price or forbid status differs from the previous one, and the items
+    downstream of them (see `update_strategy_params`).
+
+    Order book depth is taken from the real listings, so `price_factors`
+    don't scale the slippage added for large purchases.  `base` holds the
+    result with no changes applied.'''
+
+    def __init__(self):
+        self.inputs = _status_inputs()
+        # These are shared by every scenario's overlays, which read through
+        # to them.  Reading a missing item from a `defaultdict` would insert
+        # it.
+        for key in ('inventory', 'orig_inventory'):
+            self.inputs[key] = dict(self.inputs[key])
+        self.forbid_buy = set(policy_forbid_buy())
+        self.forbid_craft = set(policy_forbid_craft())
+        self.prices = None
+        self.priced = set()
+        # Scenarios update the strategy parameters set here.
+        set_strategy_params({}, self.forbid_buy, self.forbid_craft,
+                policy_can_craft_recipe)
+        self.base = self.evaluate(Scenario('base'))
+
+    def _fetch_prices(self, related_items):
+        if self.prices is None:
+            self.prices = _status_prices(related_items)
+            self.priced = set(related_items)
+            set_strategy_params(
+                    self.prices['buy_prices'],
+                    self.forbid_buy,
+                    self.forbid_craft,
+                    policy_can_craft_recipe,
+                    )
+            with phase('solve_strategies'):
+                solve_strategies(related_items)
+            return self.prices
+
+        missing = [item_id for item_id in related_items if item_id not in self.priced]
+        if len(missing) > 0:
+            # Items outside the base state, such as new goals, are priced
+            # when first needed.  Their strategies are computed on demand
+            # instead of through the solved graph.
+            new = _status_prices(missing)
+            self.prices = {key: {**self.prices[key], **new[key]}
+                    for key in self.prices}
+            self.priced.update(missing)
+        return self.prices
+
+    def evaluate(self, scenario):
+        '''Return the `calculate_status` result for `scenario`.'''
+        base_goals = self.inputs['goals']
+        goals = ChainMap({item_id: base_goals.get(item_id, 0) + count
+                for item_id, count in scenario.goals.items()}, base_goals)
+
+        def fetch_prices(related_items):
+            prices = self._fetch_prices(related_items)
+            if len(scenario.price_factors) == 0:
+                return prices
+            prices = dict(prices)
+            for key in ('buy_prices', 'sell_prices'):
+                base = prices[key]
+                prices[key] = ChainMap({item_id: round(base[item_id] * factor)
+                    for item_id, factor in scenario.price_factors.items()
+                    if base.get(item_id) is not None}, base)
+            return prices
+
+        return _plan_status(
+                self.inputs,
+                goals,
+                _InventoryOverlay({}, self.inputs['inventory']),
+                fetch_prices,
+                self.forbid_buy.union(scenario.forbid_buy),
+                self.forbid_craft.union(scenario.forbid_craft),
+                incremental=True,
+                )
+
+def status_totals(status):
+    '''Return the total cost of the items to buy and the total proceeds from
+    the items to sell for the goals in a `calculate_status` result, as used
+    for the target gold in `status`.'''
+    buy_prices = status['buy_prices']
+    sell_prices = status['sell_prices']
+    buy_total = sum(count * buy_prices[item_id]
+            for item_id, count in status['buy_items'].items())
+    sell_total = sum(count * sell_prices[item_id] * 0.85
+            for item_id, count in chain(status['sell_goal_items'].items(),
+                status['craft_goal_items'].items()))
+    return buy_total, sell_total
+
+# Keys of the `calculate_status` result compared by `diff_status`, and the
+# suffix of the row fields for each.
+STATUS_DIFF_KEYS = (
+        ('buy', 'buy_items'),
+        ('craft', 'craft_items'),
+        ('use', 'used_items'),
+        ('sell', 'sell_goal_items'),
+        ('obtain', 'obtain_items'),
+        )
+
+def diff_status(base, status):
+    '''Compare two `calculate_status` results.  Returns a row for each item
+    whose count differs in any of `STATUS_DIFF_KEYS`, with `count_<kind>_base`
+    and `count_<kind>` for every kind.'''
+    changed = set()
+    for kind, key in STATUS_DIFF_KEYS:
+        old, new = base[key], status[key]
+        changed.update(item_id for item_id in set(chain(old, new))
+                if old.get(item_id, 0) != new.get(item_id, 0))
+
+    rows = []
+    for item_id in changed:
+        row = {'item_id': item_id}
+        for kind, key in STATUS_DIFF_KEYS:
+            row['count_%s_base' % kind] = base[key].get(item_id, 0)
+            row['count_' + kind] = status[key].get(item_id, 0)
+        rows.append(row)
+    return rows
+
+
 @policy_func
 def policy_sell_filter(r):
     if r['recent_age_sec'] is not None and r['recent_age_sec'] < 86400:
@@ -1251,7 +2643,7 @@ def policy_sell_filter(r):
 def policy_sell_batch_size(r):
     return None
 
-def cmd_status():
+def cmd_status(exact=False):
     '''Print a report listing the following:
 
     * Items to buy
@@ -1260,9 +2652,13 @@ def cmd_status():
     * Items to obtain by unknown means
     * Existing items to be sold
     * Pending sell orders
+
+    With `exact`, the plan comes from `resolve_shortages_exact` instead of
+    the greedy planner, and the cost and run time of both are printed.
     '''
 
-    x = calculate_status()
+    with phase('calculate_status'):
+        x = calculate_status(exact=exact)
     gold = x['gold']
     buy_prices = x['buy_prices']
     sell_prices = x['sell_prices']
@@ -1594,10 +2990,61 @@ def cmd_status():
     report_auto_goals(x)
     check_stockpile_once(x)
 
+SCENARIOS_PATH = 'books/scenarios.json'
+
+def cmd_whatif(path=SCENARIOS_PATH):
+    '''For each scenario in the JSON file at `path` (see `Scenario.from_json`),
+    print how the `status` plan would change: the buy and sell totals, and
+    the items whose buy, craft, use, sell or obtain counts differ, shown as
+    `base/scenario`.  All scenarios share one `ScenarioEngine`.'''
+    with open(path) as f:
+        scenarios = [Scenario.from_json(j) for j in json.load(f)]
+
+    with phase('whatif base'):
+        engine = ScenarioEngine()
+    base_buy, base_sell = status_totals(engine.base)
+    base_obtain = sum(count for count in engine.base['obtain_items'].values() if count > 0)
+    print('\nbase: buy %s, sell %s, %d to obtain' % (
+        format_price(base_buy), format_price(base_sell), base_obtain))
+
+    columns = [
+            ItemNameColumn(),
+            DualCountColumn('buy_base', 'buy', 'Buy'),
+            DualCountColumn('craft_base', 'craft', 'Craft'),
+            DualCountColumn('use_base', 'use', 'Use'),
+            DualCountColumn('sell_base', 'sell', 'Sell'),
+            DualCountColumn('obtain_base', 'obtain', 'Obtain'),
+            ]
+    for scenario in scenarios:
+        start = time.perf_counter()
+        with phase('whatif scenario'):
+            status = engine.evaluate(scenario)
+        elapsed = time.perf_counter() - start
+
+        buy, sell = status_totals(status)
+        obtain = sum(count for count in status['obtain_items'].values() if count > 0)
+        rows = diff_status(engine.base, status)
+        print('\n%s: buy %s (%s), sell %s (%s), net %s, %d to obtain (%+d), %.3fs' % (
+            scenario.name,
+            format_price(buy), format_price_delta(buy - base_buy),
+            format_price(sell), format_price_delta(sell - base_sell),
+            format_price_delta((sell - base_sell) - (buy - base_buy)),
+            obtain, obtain - base_obtain, elapsed))
+        gw2.items.names(row['item_id'] for row in rows)
+        rows.sort(key=lambda row: gw2.items.name(row['item_id']))
+        render_table('%s: changes' % scenario.name, columns, rows,
+                render_title=True, render_total=False)
+
 class CountColumn:
+    field = 'count'
+    value_type = 'int'
+
     def format(self):
         return '%6s'
 
+    def value(self, row):
+        return row.get('count')
+
     def title(self):
         return 'Count'
 
@@ -1611,14 +3058,20 @@ class CountColumn:
         return ''
 
 class AltCountColumn:
+    value_type = 'float'
+
     def __init__(self, suffix, title, format='%6s'):
         self.suffix = suffix
         self.title_ = title
         self.format_ = format
+        self.field = 'count_' + suffix
 
     def format(self):
         return self.format_
 
+    def value(self, row):
+        return row.get(self.field)
+
     def title(self):
         return self.title_
 
@@ -1634,14 +3087,20 @@ class AltCountColumn:
         return ''
 
 class DualCountColumn:
+    value_type = 'str'
+
     def __init__(self, suffix1, suffix2, title):
         self.suffix1 = suffix1
         self.suffix2 = suffix2
         self.title_ = title
+        self.field = 'count_%s_%s' % (suffix1, suffix2)
 
     def format(self):
         return '%9s'
 
+    def value(self, row):
+        return self.render(row)
+
     def title(self):
         return self.title_
 
@@ -1662,9 +3121,15 @@ class DualCountColumn:
         return ''
 
 class AgeColumn:
+    field = 'age_sec'
+    value_type = 'int'
+
     def format(self):
         return '%6s'
 
+    def value(self, row):
+        return row.get('age_sec')
+
     def title(self):
         return 'Age'
 
@@ -1678,9 +3143,15 @@ class AgeColumn:
         return ''
 
 class NumberOfStacksColumn:
+    field = 'stacks'
+    value_type = 'str'
+
     def format(self):
         return '%8s'
 
+    def value(self, row):
+        return self.render(row)
+
     def title(self):
         return 'Number Of Stacks'
 
@@ -1697,9 +3168,15 @@ class NumberOfStacksColumn:
         return ''
 
 class RecentColumn:
+    field = 'recent'
+    value_type = 'str'
+
     def format(self):
         return '%10s'
 
+    def value(self, row):
+        return self.render(row)
+
     def title(self):
         return 'Recent'
 
@@ -1725,9 +3202,18 @@ class RecentColumn:
         return ''
 
 class ItemNameColumn:
+    field = 'item'
+    value_type = 'str'
+
     def format(self):
         return '%-36.36s'
 
+    def value(self, row):
+        item_id = row.get('item_id')
+        if item_id is None:
+            return None
+        return gw2.items.name(item_id)
+
     def title(self):
         return 'Item'
 
@@ -1741,9 +3227,15 @@ class ItemNameColumn:
         return 'Total'
     
 class ItemTrendColumn:
+    field = 'trend'
+    value_type = 'str'
+
     def format(self):
         return '%-10.10s'
 
+    def value(self, row):
+        return row.get('trend')
+
     def title(self):
         return '7d Trend'
 
@@ -1756,6 +3248,8 @@ class ItemTrendColumn:
         return 'Total'
 
 class UnitPriceColumn:
+    value_type = 'float'
+
     def __init__(self, key='unit_price', title='Unit Price',
             show_buried=False, total_count_key=None):
         self.key = key
@@ -1763,6 +3257,10 @@ class UnitPriceColumn:
         self.show_buried = show_buried
         self.total_count_key = total_count_key
         self.total = 0
+        self.field = key
+
+    def value(self, row):
+        return row.get(self.key)
 
     def format(self):
         if self.show_buried:
@@ -1804,10 +3302,20 @@ class UnitPriceColumn:
         return format_price(self.total)
 
 class TotalPriceColumn:
+    field = 'total_price'
+    value_type = 'float'
+
     def __init__(self, mult=1):
         self.total = 0
         self.mult = mult
 
+    def value(self, row):
+        count = row.get('count')
+        unit_price = row.get('unit_price')
+        if count is None or unit_price is None:
+            return None
+        return count * unit_price * self.mult
+
     def title(self):
         return 'Total Price'
 
@@ -1826,9 +3334,15 @@ class TotalPriceColumn:
         return format_price(self.total * self.mult)
 
 class PercentColumn:
+    value_type = 'float'
+
     def __init__(self, key='roi', title='ROI'):
         self.key = key
         self.title_ = title
+        self.field = key
+
+    def value(self, row):
+        return row.get(self.key)
 
     def format(self):
         return '%8s'
@@ -1846,9 +3360,20 @@ class PercentColumn:
         return ''
 
 class AltPriceDeltaColumn:
+    field = 'alt_price_delta'
+    value_type = 'float'
+
     def __init__(self):
         self.total = 0
 
+    def value(self, row):
+        count = row.get('count')
+        unit_price = row.get('unit_price')
+        alt_unit_price = row.get('alt_unit_price')
+        if count is None or unit_price is None or alt_unit_price is None:
+            return None
+        return count * (alt_unit_price - unit_price)
+
     def title(self):
         return 'Inst. Delta'
 
@@ -1869,18 +3394,74 @@ class AltPriceDeltaColumn:
         return format_price_delta(self.total)
 
 
-def render_table(name, columns, rows, render_title=False, render_total=True):
-    rows = [r for r in rows if r is not None]
-    if len(rows) == 0:
-        return
-    print('\n%s:' % name)
-    fmt = '  '.join(col.format() for col in columns)
-    if render_title:
-        print((fmt % tuple(col.title() for col in columns)).rstrip())
-    for row in rows:
-        print((fmt % tuple(col.render(row) for col in columns)).rstrip())
-    if render_total:
-        print((fmt % tuple(col.render_total() for col in columns)).rstrip())
+# If set, `render_table` also writes each table to a file in this directory,
+# in `TABLE_FORMAT` (see `gw2.table_output`).
+TABLE_OUT_DIR = None
+TABLE_FORMAT = 'jsonl'
+
+# Number of rows `render_table` formats at a time.
+RENDER_CHUNK_SIZE = 512
+
+def _table_writer(name, columns):
+    fields = [(col.field, col.value_type) for col in columns]
+    if any(isinstance(col, ItemNameColumn) for col in columns):
+        fields.insert(0, ('item_id', 'int'))
+    path = gw2.table_output.table_path(TABLE_OUT_DIR, name, TABLE_FORMAT)
+    return gw2.table_output.open_writer(path, TABLE_FORMAT, fields), \
+            len(fields) > len(columns)
+
+def render_table(name, columns, rows, render_title=False, render_total=True,
+        limit=None, key=None):
+    '''Print `rows` (dicts, with `None` entries skipped) as a table.  `rows`
+    can be any iterable, and is consumed lazily, `RENDER_CHUNK_SIZE` rows at a
+    time.  The item names for each chunk are looked up together.  If `limit`
+    is set, only the first `limit` rows are printed, or with `key`, the
+    `limit` rows with the smallest `key`, which are selected without sorting
+    all the rows.'''
+    with phase('render_table'):
+        rows = (r for r in rows if r is not None)
+        if limit is not None:
+            if key is not None:
+                rows = heapq.nsmallest(limit, rows, key=key)
+            else:
+                rows = islice(rows, limit)
+
+        fmt = '  '.join(col.format() for col in columns)
+        renders = tuple(col.render for col in columns)
+        values = tuple(col.value for col in columns)
+        writer = None
+        started = False
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, RENDER_CHUNK_SIZE))
+            if len(chunk) == 0:
+                break
+            gw2.items.names(row['item_id'] for row in chunk
+                    if row.get('item_id') is not None)
+
+            if not started:
+                started = True
+                print('\n%s:' % name)
+                if render_title:
+                    print((fmt % tuple(col.title() for col in columns)).rstrip())
+                if TABLE_OUT_DIR is not None:
+                    writer, with_item_id = _table_writer(name, columns)
+
+            sys.stdout.write(''.join((fmt % tuple(r(row) for r in renders)).rstrip() + '\n'
+                for row in chunk))
+            if writer is not None:
+                if with_item_id:
+                    writer.write([(row.get('item_id'),) + tuple(v(row) for v in values)
+                        for row in chunk])
+                else:
+                    writer.write([tuple(v(row) for v in values) for row in chunk])
+
+        if not started:
+            return
+        if render_total:
+            print((fmt % tuple(col.render_total() for col in columns)).rstrip())
+        if writer is not None:
+            writer.close()
 
 
 def cmd_steps(names):
@@ -1988,15 +3569,12 @@ def cmd_goal(count, name):
 
 
     if count > 0:
+        forbid_buy = policy_forbid_buy().union((item_id,))
+        forbid_craft = policy_forbid_craft()
+        set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
         related_items = gather_related_items([item_id])
         buy_prices, sell_prices = get_prices(related_items)
-
-        set_strategy_params(
-                buy_prices,
-                policy_forbid_buy().union((item_id,)),
-                policy_forbid_craft(),
-                policy_can_craft_recipe,
-                )
+        update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
         sell_price = sell_prices[item_id]
         buy_price = buy_prices[item_id]
@@ -2064,15 +3642,12 @@ def cmd_profit(names):
     '''Show the profit to be made by crafting the named item.'''
     item_ids = [parse_item_id(name) for name in names]
 
+    forbid_buy = policy_forbid_buy().union(item_ids)
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
     related_items = gather_related_items(item_ids)
     buy_prices, sell_prices = get_prices(related_items)
-
-    set_strategy_params(
-            buy_prices,
-            policy_forbid_buy().union(item_ids),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
     print_cv_tp_prices(related_items, set(item_ids), buy_prices, sell_prices)
 
@@ -2094,20 +3669,17 @@ def cmd_profit(names):
 def cmd_jade_bot_core_profits():
     jade_bot_cores_names = ['Jade Bot Core: Tier ' + str(tier_level) for tier_level in reversed(range(1,11))]
     jade_bot_core_item_ids = [parse_item_id(name) for name in jade_bot_cores_names]
-    related_items = gather_related_items(jade_bot_core_item_ids)
-    buy_prices, sell_prices = get_prices(related_items)
-
-    for item_id in jade_bot_core_item_ids:
-        set_strategy_params(
-                buy_prices,
-                policy_forbid_buy().union((item_id,)),
-                policy_forbid_craft(),
-                policy_can_craft_recipe,
-                )
+    forbid_buy = policy_forbid_buy()
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
+    related_items = gather_related_items(jade_bot_core_item_ids)
+    buy_prices, sell_prices = get_prices(related_items)
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
+    for item_id in jade_bot_core_item_ids:
         buy_price = buy_prices[item_id]
         sell_price = sell_prices[item_id]
-        cost = optimal_cost(item_id)
+        cost = optimal_craft_cost(item_id)
         print('%s (%d)' % (gw2.items.name(item_id), item_id))
         print('Cost:        %s' % format_price(cost))
         print('Break even:  %s' % format_price(math.ceil(cost / 0.85)))
@@ -2203,8 +3775,8 @@ ALL_PROVISIONER_ITEMS = set(item_id for name, items in PROVISIONER_ITEMS
 def print_provisioner_token_totals():
     # Each of these items can be traded for 1 provisioner token
     items_to_trade = ['Charged Quartz Crystal', 'Spool of Thick Elonian Cord', 'Glob of Elder Spirit Residue', 'Lump of Mithrillium']
-    inventory = get_inventory()
-    wallet_raw = gw2.api.fetch_with_retries('/v2/account/wallet')
+    account = get_account_snapshot(*gw2.account.INVENTORY_SOURCES, 'wallet')
+    inventory = account.inventory()
 
     print('Current Provisioner Token Totals:')
     
@@ -2219,7 +3791,7 @@ def print_provisioner_token_totals():
             total += count
         print(item, count)
     
-    wallet = {x['id']: x['value'] for x in wallet_raw}
+    wallet = account.wallet
     count = 0
     if CURRENCY_PROVISIONER_TOKEN in wallet:
         count = wallet[CURRENCY_PROVISIONER_TOKEN]
@@ -2230,6 +3802,9 @@ def print_provisioner_token_totals():
     return item_counts
 
 def cmd_provisioner():
+    forbid_buy = policy_forbid_buy()
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
     related_items = gather_related_items(item_id
             for _, category in PROVISIONER_ITEMS for item_id in category.keys())
     buy_prices, sell_prices = get_prices(related_items)
@@ -2237,12 +3812,7 @@ def cmd_provisioner():
     print_provisioner_token_totals()
     print()
 
-    set_strategy_params(
-            buy_prices,
-            policy_forbid_buy(),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
     best_in_category = []
     for cat_name, category in PROVISIONER_ITEMS:
@@ -2275,17 +3845,13 @@ def cmd_obtain(names):
     '''Print out the optimal strategy for obtaining the named item.'''
     item_ids = [parse_item_id(name) for name in names]
 
-    related_items = gather_related_items(item_ids)
-    buy_prices, sell_prices = get_prices(related_items)
-
     forbid_buy = set(policy_forbid_buy())
     forbid_buy.update(item_ids)
-    set_strategy_params(
-            buy_prices,
-            forbid_buy,
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
+    related_items = gather_related_items(item_ids)
+    buy_prices, sell_prices = get_prices(related_items)
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
     inventory = defaultdict(int)
     for item_id in item_ids:
@@ -2350,13 +3916,95 @@ def cmd_obtain(names):
         for item_id, count in obtain_items.items():
             print('%10d  %-45.45s' % (count, gw2.items.name(item_id)))
 
-def gen_profit_sql(path):
-    if os.path.exists(path):
-        os.unlink(path)
-    conn = sqlite3.connect(path)
-    cur = conn.cursor()
-    cur.execute('''
-        CREATE TABLE items (
+# The function and item shards for `parallel_map` workers.  Workers are
+# forked after this is set, so they inherit it instead of having it pickled.
+_PARALLEL_TASK = None
+
+def _run_parallel_shard(i):
+    func, shards = _PARALLEL_TASK
+    return [func(x) for x in shards[i]]
+
+def parallel_map(func, xs, jobs=1):
+    '''Return `[func(x) for x in xs]`, computed in `jobs` worker processes.
+    `xs` is split into `jobs` contiguous shards, and the results are
+    concatenated in order, so the output is the same as running serially.
+
+    Workers are forked from the current process, so they share the prices,
+    solved strategy caches, and recipe data already loaded here (copy-on-write)
+    rather than rebuilding or unpickling them.  Only the results are sent back.
+    Any other effects of `func` are lost when the worker exits.  Runs serially
+    when `jobs` is 1 or the platform can't fork.'''
+    global _PARALLEL_TASK
+    xs = list(xs)
+    if jobs <= 1 or len(xs) < 2 or \
+            'fork' not in multiprocessing.get_all_start_methods():
+        return [func(x) for x in xs]
+
+    shard_size = (len(xs) + jobs - 1) // jobs
+    shards = [xs[i : i + shard_size] for i in range(0, len(xs), shard_size)]
+    _PARALLEL_TASK = (func, shards)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(len(shards),
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            results = []
+            for shard_results in executor.map(_run_parallel_shard, range(len(shards))):
+                results.extend(shard_results)
+            return results
+    finally:
+        _PARALLEL_TASK = None
+
+def _profit_sql_row(item_id, buy_prices, sell_prices, tp_prices):
+    craft_cost = optimal_craft_cost(item_id)
+    if craft_cost is None:
+        return None
+
+    craft_roi = None
+    sell_price = sell_prices.get(item_id)
+    if sell_price is not None:
+        profit = sell_price * 0.85 - craft_cost
+        craft_roi = profit / craft_cost
+
+    craft_roi_buy = None
+    buy_price = buy_prices.get(item_id)
+    if buy_price is not None:
+        profit = buy_price * 0.85 - craft_cost
+        craft_roi_buy = profit / craft_cost
+
+    prices = tp_prices.get(item_id)
+    if prices is None:
+        return None
+
+    item = gw2.items.get(item_id)
+    if item is None:
+        return None
+
+    return (
+        item_id,
+        item['name'],
+        buy_price,
+        sell_price,
+        prices['buys'].get('quantity'),
+        prices['sells'].get('quantity'),
+        craft_cost,
+        craft_roi,
+        craft_roi_buy,
+    )
+
+def _init_profit_sql(conn):
+    '''Create the tables used by `gen_profit_sql`, replacing an `items` table
+    left by older versions that rebuilt the database on every run.'''
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(items)')]
+    if len(columns) > 0 and 'run_id' not in columns:
+        conn.execute('DROP TABLE items')
+
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL
+        );
+
+        -- The latest results for each item.
+        CREATE TABLE IF NOT EXISTS items (
             id INTEGER NOT NULL PRIMARY KEY,
             name TEXT NOT NULL,
             buy_price INTEGER,
@@ -2365,155 +4013,185 @@ def gen_profit_sql(path):
             supply INTEGER,
             cost INTEGER,
             craft_roi REAL,
-            craft_roi_buy REAL
-        )
+            craft_roi_buy REAL,
+            run_id INTEGER NOT NULL REFERENCES runs(id),
+            timestamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS items_craft_roi ON items(craft_roi);
+        CREATE INDEX IF NOT EXISTS items_craft_roi_buy ON items(craft_roi_buy);
+        CREATE INDEX IF NOT EXISTS items_cost ON items(cost);
+        CREATE INDEX IF NOT EXISTS items_demand ON items(demand);
+
+        -- The results of every run.
+        CREATE TABLE IF NOT EXISTS item_history (
+            id INTEGER NOT NULL,
+            run_id INTEGER NOT NULL REFERENCES runs(id),
+            buy_price INTEGER,
+            sell_price INTEGER,
+            demand INTEGER,
+            supply INTEGER,
+            cost INTEGER,
+            craft_roi REAL,
+            craft_roi_buy REAL,
+            PRIMARY KEY (id, run_id)
+        );
+        CREATE INDEX IF NOT EXISTS item_history_run_id ON item_history(run_id);
     ''')
 
+def gen_profit_sql(path, jobs=1):
+    '''Update the sqlite database at `path` with the current craft cost and
+    ROI of every craftable item.  Each call is recorded as a new row in
+    `runs`.  `items` holds the latest results, replacing those of previous
+    runs, and `item_history` keeps the results of every run, so the database
+    can be refreshed periodically and queried over time.'''
     output_item_ids = set(craftable_items())
 
-    related_items = gather_related_items(output_item_ids)
-    buy_prices, sell_prices = get_prices(related_items)
     forbid_buy = policy_forbid_buy()
     forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
+    related_items = gather_related_items(output_item_ids)
+    buy_prices, sell_prices = get_prices(related_items)
+    tp_prices = _get_tp_prices(output_item_ids)
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
+    solve_strategies(output_item_ids)
 
     print('processing %d items' % len(output_item_ids))
-    num_written = 0
-    for item_id in output_item_ids:
-        set_strategy_params(
-                buy_prices,
-                set(chain(forbid_buy, (item_id,))),
-                forbid_craft,
-                policy_can_craft_recipe,
-                )
-        craft_cost = optimal_cost(item_id)
-        if craft_cost is None:
-            continue
-
-        craft_roi = None
-        sell_price = sell_prices.get(item_id)
-        if sell_price is not None:
-            profit = sell_price * 0.85 - craft_cost
-            craft_roi = profit / craft_cost
-
-        craft_roi_buy = None
-        buy_price = buy_prices.get(item_id)
-        if buy_price is not None:
-            profit = buy_price * 0.85 - craft_cost
-            craft_roi_buy = profit / craft_cost
-
-        prices = gw2.trading_post.get_prices(item_id)
-        if prices is None:
-            continue
-
-        item = gw2.items.get(item_id)
-        if item is None:
-            continue
+    rows = [row for row in parallel_map(
+            lambda item_id: _profit_sql_row(item_id, buy_prices, sell_prices, tp_prices),
+            output_item_ids, jobs)
+        if row is not None]
 
-        cur.execute('''
+    conn = sqlite3.connect(path)
+    _init_profit_sql(conn)
+    timestamp = int(time.time())
+    with conn:
+        run_id = conn.execute('INSERT INTO runs (timestamp) VALUES (?)',
+                (timestamp,)).lastrowid
+        conn.executemany('''
             INSERT INTO items
                 (id, name, buy_price, sell_price, demand, supply, cost,
-                    craft_roi, craft_roi_buy)
+                    craft_roi, craft_roi_buy, run_id, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name,
+                buy_price = excluded.buy_price,
+                sell_price = excluded.sell_price,
+                demand = excluded.demand,
+                supply = excluded.supply,
+                cost = excluded.cost,
+                craft_roi = excluded.craft_roi,
+                craft_roi_buy = excluded.craft_roi_buy,
+                run_id = excluded.run_id,
+                timestamp = excluded.timestamp
+            ''', (row + (run_id, timestamp) for row in rows))
+        conn.executemany('''
+            INSERT INTO item_history
+                (id, buy_price, sell_price, demand, supply, cost,
+                    craft_roi, craft_roi_buy, run_id)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                item_id,
-                item['name'],
-                buy_price,
-                sell_price,
-                prices['buys'].get('quantity'),
-                prices['sells'].get('quantity'),
-                craft_cost,
-                craft_roi,
-                craft_roi_buy,
-            ))
-        num_written += 1
-
-    print('wrote %d items to %s' % (num_written, path))
-    conn.commit()
+            ''', (row[:1] + row[2:] + (run_id,) for row in rows))
+        # Drop items that no longer have a craft cost or price.
+        conn.execute('DELETE FROM items WHERE run_id != ?', (run_id,))
     conn.close()
 
-def cmd_gen_profit_sql():
-    '''Generate a sqlite database containing information on profitable
-    recipes.'''
-    gen_profit_sql('profit.sqlite')
-
-def do_craft_profit(item_ids=None, sort=True, row_filter=None, title='Profits'):
-    if row_filter is None:
-        def row_filter(x):
-            return policy_row_filter(x)
-
-    if item_ids is None:
-        output_item_ids = set(craftable_items())
-    else:
-        output_item_ids = set(item_ids)
-
-    related_items = gather_related_items(output_item_ids)
-    buy_prices, sell_prices = get_prices(related_items)
-    forbid_buy = policy_forbid_buy()
-    forbid_craft = policy_forbid_craft()
-    historical_data = {}
-    if policy_enhance_craft_profit():
-        hd = bltc.historical_data.get_items_processed_historical_data(output_item_ids)
-        if hd is not None:
-            historical_data = hd
-
-    rows = []
-    for item_id in output_item_ids:
-        set_strategy_params(
-                buy_prices,
-                set(chain(forbid_buy, (item_id,))),
-                forbid_craft,
-                policy_can_craft_recipe,
-                )
+    print('wrote %d items to %s (run %d)' % (len(rows), path, run_id))
 
+def cmd_gen_profit_sql(jobs=1):
+    '''Update a sqlite database containing information on profitable
+    recipes.'''
+    gen_profit_sql('profit.sqlite', jobs=jobs)
+
+def _get_tp_prices(item_ids, max_age=gw2.trading_post.DEFAULT_MAX_AGE):
+    '''Fetch the full trading post price entries of `item_ids` in one batch.
+    Returns a dict mapping each item ID to its entry, or `None`.'''
+    item_ids = list(item_ids)
+    return dict(zip(item_ids,
+        gw2.trading_post.get_prices_multi(item_ids, max_age=max_age)))
+
+def _craft_profit_candidates(item_ids, sell_prices, min_roi=None):
+    '''Return the items in `item_ids` that are profitable to craft and sell,
+    with a return on investment of at least `min_roi` if set.  This only needs
+    the solved craft costs and sell prices, so it runs before the per-item
+    lookups for `_craft_profit_row`.'''
+    out = []
+    for item_id in item_ids:
         sell_price = sell_prices.get(item_id)
-        cost = optimal_cost(item_id)
-        if sell_price is None or cost is None:
+        if sell_price is None:
+            continue
+        cost = optimal_craft_cost(item_id)
+        if cost is None:
             continue
-
         profit = sell_price * 0.85 - cost
         if profit <= 0:
             continue
+        if min_roi is not None and profit / cost < min_roi:
+            continue
+        out.append(item_id)
+    return out
 
-        prices = gw2.trading_post.get_prices(item_id)
-        
-        item_historical_data = historical_data.get(item_id, None)
-        if item_historical_data is None:
-            sold_daily_data = 0
-            sold_weekly_data = 0
-            trend = 'N/A'
-        else:
-            sold_daily_data = item_historical_data.get('sold_daily', 0)
-            sold_weekly_data = item_historical_data.get('sold_weekly', 0)
-            trend = item_historical_data.get('trend', 'N/A')
+def _daily_volume(item_historical_data):
+    '''Average number of sales per day over the last week.'''
+    if item_historical_data is None:
+        return 0
+    return item_historical_data.get('sold_weekly', 0) / 7
 
-        row = {
-            'item_id': item_id,
-            'item': gw2.items.get(item_id),
-            'craft_cost': cost,
-            'profit': profit,
-            'roi': profit / cost,
-            'supply': prices['sells'].get('quantity', 0),
-            'demand': prices['buys'].get('quantity', 0),
-            'sell_price': sell_prices.get(item_id, 0),
-            'buy_price': buy_prices.get(item_id, 0),
-            }
-        
-        if policy_enhance_craft_profit():
-            row['count_volume'] = sold_daily_data
-            row['daily_profit'] = sold_daily_data * profit
-            row['count_dly_avg_volume'] = round(sold_weekly_data / 7, 1)
-            row['daily_avg_profit'] = (sold_weekly_data / 7) * profit * 0.1
-            row['daily_invest_max'] = (row['count_dly_avg_volume'] * 0.1 * row['craft_cost'])
-            row['trend'] = trend
+def _craft_profit_row(item_id, buy_prices, sell_prices, historical_data,
+        tp_prices):
+    sell_price = sell_prices.get(item_id)
+    cost = optimal_craft_cost(item_id)
+    if sell_price is None or cost is None:
+        return None
 
-        if row_filter(row):
-            rows.append(row)
+    profit = sell_price * 0.85 - cost
+    if profit <= 0:
+        return None
+
+    prices = tp_prices[item_id]
+
+    item_historical_data = historical_data.get(item_id, None)
+    if item_historical_data is None:
+        sold_daily_data = 0
+        sold_weekly_data = 0
+        trend = 'N/A'
+    else:
+        sold_daily_data = item_historical_data.get('sold_daily', 0)
+        sold_weekly_data = item_historical_data.get('sold_weekly', 0)
+        trend = item_historical_data.get('trend', 'N/A')
+
+    row = {
+        'item_id': item_id,
+        'item': gw2.items.get(item_id),
+        'craft_cost': cost,
+        'profit': profit,
+        'roi': profit / cost,
+        'supply': prices['sells'].get('quantity', 0),
+        'demand': prices['buys'].get('quantity', 0),
+        'sell_price': sell_prices.get(item_id, 0),
+        'buy_price': buy_prices.get(item_id, 0),
+        }
 
+    if policy_enhance_craft_profit():
+        row['count_volume'] = sold_daily_data
+        row['daily_profit'] = sold_daily_data * profit
+        row['count_dly_avg_volume'] = round(sold_weekly_data / 7, 1)
+        row['daily_avg_profit'] = (sold_weekly_data / 7) * profit * 0.1
+        row['daily_invest_max'] = (row['count_dly_avg_volume'] * 0.1 * row['craft_cost'])
+        row['trend'] = trend
+
+    return row
+
+def _render_craft_profit(rows, sort, title, top=None):
+    '''Print the craft profit table.  If `top` is set, only the best `top`
+    rows are shown, which are picked with a heap rather than by sorting all
+    of them.'''
+    sort_key = None
     if sort:
         if(policy_enhance_craft_profit()):
-            rows.sort(key=lambda row: row.get('daily_avg_profit', 0), reverse=True)
+            sort_key = lambda row: row.get('daily_avg_profit', 0)
         else:
-            rows.sort(key=lambda row: row.get('roi', 0), reverse=True)
+            sort_key = lambda row: row.get('roi', 0)
+        if top is None:
+            rows.sort(key=sort_key, reverse=True)
 
 
     columns = (ItemNameColumn(),
@@ -2536,27 +4214,136 @@ def do_craft_profit(item_ids=None, sort=True, row_filter=None, title='Profits'):
             columns,
             rows,
             render_title=True,
-            render_total=False)
+            render_total=False,
+            limit=top,
+            key=(lambda row: -sort_key(row)) if top is not None and sort else None)
+
+def do_craft_profit(item_ids=None, sort=True, row_filter=None, title='Profits',
+        watch_interval=None, jobs=1, top=None, min_roi=None, min_volume=None):
+    '''Print a table of profitable recipes.  If `watch_interval` is set, keep
+    running, refreshing prices every `watch_interval` seconds and reprinting
+    the table.  Each refresh only re-solves the items downstream of prices
+    that actually changed, but rebuilds every row with fresh trading post
+    entries, since the table shows and filters on them.  The rows are computed
+    in `jobs` processes (see `parallel_map`).
+
+    Only the `top` best rows are printed, if set.  Items with a return on
+    investment below `min_roi` or fewer than `min_volume` sales per day are
+    skipped before fetching their trading post entries or building rows.'''
+    if row_filter is None:
+        row_filter_mask = policy_row_filter_mask
+    else:
+        def row_filter_mask(rows):
+            return [row_filter(row) for row in rows]
+
+    if item_ids is None:
+        output_item_ids = set(craftable_items())
+    else:
+        output_item_ids = set(item_ids)
+
+    max_age = gw2.trading_post.DEFAULT_MAX_AGE
+    if watch_interval is not None:
+        max_age = watch_interval
+
+    forbid_buy = policy_forbid_buy()
+    forbid_craft = policy_forbid_craft()
+    # Set before gathering the related items, which depend on them.  The
+    # prices are filled in once they've been fetched.
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
+    with phase('gather_related_items'):
+        related_items = gather_related_items(output_item_ids)
+    with phase('price fetch'):
+        buy_prices, sell_prices = get_prices(related_items, max_age=max_age)
+    tp_prices = {}
+    historical_data = {}
+    need_history = policy_enhance_craft_profit() or min_volume is not None
+
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
+    with phase('solve_strategies'):
+        solve_strategies(output_item_ids)
+
+    def build_rows(item_ids):
+        '''Return a dict mapping each of `item_ids` to its row, or `None`.'''
+        out = dict.fromkeys(item_ids)
+        candidates = _craft_profit_candidates(item_ids, sell_prices, min_roi)
+        if need_history:
+            with phase('historical data'):
+                hd = bltc.historical_data.get_items_processed_historical_data(
+                        [item_id for item_id in candidates if item_id not in historical_data])
+                if hd is not None:
+                    historical_data.update(hd)
+        if min_volume is not None:
+            candidates = [item_id for item_id in candidates
+                    if _daily_volume(historical_data.get(item_id)) >= min_volume]
+        with phase('price fetch'):
+            tp_prices.update(_get_tp_prices(candidates, max_age=max_age))
+        out.update(zip(candidates, parallel_map(
+            lambda item_id: _craft_profit_row(item_id,
+                buy_prices, sell_prices, historical_data, tp_prices),
+            candidates, jobs)))
+        return out
+
+    with phase('build rows'):
+        row_by_item = build_rows(list(output_item_ids))
+
+    def render():
+        with phase('render craft_profit'):
+            rows = [row for row in row_by_item.values() if row is not None]
+            mask = np.asarray(row_filter_mask(rows), dtype=bool)
+            rows = [row for row, keep in zip(rows, mask) if keep]
+            _render_craft_profit(rows, sort, title, top)
+
+    render()
+    if watch_interval is None:
+        return
 
-def cmd_craft_profit():
+    while True:
+        time.sleep(watch_interval)
+        start = time.time()
+        new_buy_prices, new_sell_prices = get_prices(related_items, max_age=max_age)
+        changed_buy = {item_id: new_buy_prices.get(item_id)
+                for item_id in related_items
+                if new_buy_prices.get(item_id) != buy_prices.get(item_id)}
+        affected = update_strategy_prices(changed_buy)
+        affected.update(item_id for item_id in output_item_ids
+                if new_sell_prices.get(item_id) != sell_prices.get(item_id))
+        buy_prices, sell_prices = new_buy_prices, new_sell_prices
+
+        # Rows that weren't affected still show (and are filtered and ranked
+        # on) their own prices, supply and demand, which may have changed.
+        affected &= output_item_ids
+        rebuild = affected.union(item_id
+                for item_id, row in row_by_item.items() if row is not None)
+        row_by_item.update(build_rows(list(rebuild)))
+
+        print('\n%s: %d prices changed, %d rows re-solved in %.2fs' % (
+            datetime.datetime.now().strftime('%H:%M:%S'),
+            len(changed_buy), len(affected), time.time() - start))
+        render()
+
+def cmd_craft_profit(jobs=1, top=None, min_roi=None, min_volume=None):
     '''Print a table of recipes that are profitable at the buy price, along
     with market depth for each one.'''
-    do_craft_profit()
+    do_craft_profit(jobs=jobs, top=top, min_roi=min_roi, min_volume=min_volume)
+
+def cmd_craft_profit_watch(interval=60):
+    '''Like `craft_profit`, but keep running and reprint the table whenever
+    prices change.  Run `price_sync.py run` alongside this to keep the price
+    snapshot fresh.'''
+    do_craft_profit(watch_interval=interval)
 
 def cmd_craft_profit_buy():
     '''Print a table of recipes that are profitable at the buy price, along
     with market depth for each one.'''
     output_item_ids = set(craftable_items())
 
+    forbid_buy = policy_forbid_buy()
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
     related_items = gather_related_items(output_item_ids)
     buy_prices, sell_prices = get_prices(related_items)
-
-    set_strategy_params(
-            buy_prices,
-            policy_forbid_buy(),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
+    solve_strategies(output_item_ids)
 
     rows = []
     for item_id in output_item_ids:
@@ -2617,14 +4404,12 @@ def print_research_notes_table(all_strategies):
     cost per note for each one.'''
     all_strategies_items = [item_id for s in all_strategies for item_id in s.related_items()]
 
+    forbid_buy = policy_forbid_buy().union(all_strategies_items)
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
     related_items = gather_related_items(all_strategies_items)
     buy_prices, sell_prices = get_prices(related_items)
-    set_strategy_params(
-            buy_prices,
-            policy_forbid_buy().union(all_strategies_items),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
     xs = []
     for strategy in all_strategies:
@@ -2648,14 +4433,11 @@ def print_research_notes_table(all_strategies):
     roi_lines = policy_get_research_note_roi_lines()
     if roi_lines is not None:
         tier_10 = gw2.items.search_name('Jade Bot Core: Tier 10')
+        forbid_buy = policy_forbid_buy().union((item_id,))
+        set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
         related_items = gather_related_items([tier_10])
         buy_prices, sell_prices = get_prices(related_items)
-        set_strategy_params(
-            buy_prices,
-            policy_forbid_buy().union((item_id,)),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+        update_strategy_params(buy_prices, forbid_buy, forbid_craft)
         
         t10_partial_cost = optimal_cost(tier_10) - 1753 * optimal_cost(ITEM_RESEARCH_NOTE)
         current_t10_sell_price = sell_prices[tier_10]
@@ -2695,6 +4477,8 @@ def cmd_charr_commendations():
             (250, 50, gw2.items.search_name('Thick Leather Section'), 'specific'),
             (250, 100, gw2.items.search_name('Gossamer Scrap'), 'specific'),
     )
+    set_strategy_params({}, policy_forbid_buy(), policy_forbid_craft(),
+            policy_can_craft_recipe)
     related_items = gather_related_items([i for _,_,i,_ in options])
     buy_prices, sell_prices = get_prices(related_items)
 
@@ -2714,17 +4498,15 @@ def cmd_strategies(name):
     costs.'''
     item_id = parse_item_id(name)
 
+    forbid_buy = policy_forbid_buy() - {item_id}
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
     related_items = gather_related_items([item_id])
     buy_prices, sell_prices = get_prices(related_items)
 
     buy_prices[ITEM_SPIRIT_SHARD] = 10000
 
-    set_strategy_params(
-            buy_prices,
-            policy_forbid_buy() - {item_id},
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
     lines = []
     for strat in valid_strategies(item_id, allow_refine_only=True):
@@ -2771,14 +4553,15 @@ def cmd_dispose(dispose_item_names, item_ids=None, sort=True, row_filter=None, t
     else:
         output_item_ids = set(item_ids)
 
+    # Gather with every recipe allowed, which covers the items used under
+    # the stricter parameters set below.
+    set_strategy_params({}, set(), set(), can_craft_any_recipe,
+            research_note_separate = True)
     related_items = gather_related_items(output_item_ids)
     buy_prices, sell_prices = get_prices(related_items)
     forbid_buy = policy_forbid_buy()
     forbid_craft = policy_forbid_craft()
 
-    set_strategy_params({}, set(), set(), lambda x: True,
-            research_note_separate = True)
-
     for strat in valid_strategies(ITEM_RESEARCH_NOTE):
         forbid_buy.update(strat.related_items())
 
@@ -2849,29 +4632,35 @@ def cmd_dispose(dispose_item_names, item_ids=None, sort=True, row_filter=None, t
             format_price_float(cost_baseline),
             delta_str, name))
 
+    # Get the baseline costs with normal material prices
+    set_strategy_params(
+            orig_buy_prices,
+            forbid_buy,
+            forbid_craft,
+            policy_can_craft_recipe,
+            research_note_separate = True,
+            )
+    solve_strategies(output_item_ids)
+    baseline_costs = {item_id: optimal_craft_cost(item_id)
+            for item_id in output_item_ids}
+
+    # Get the reduced costs after adjusting the prices of disposed items
+    set_strategy_params(
+            buy_prices,
+            forbid_buy,
+            forbid_craft,
+            policy_can_craft_recipe,
+            research_note_separate = True,
+            )
+    solve_strategies(output_item_ids)
+
     rows = []
     for item_id in output_item_ids:
-        # Get the baseline cost with normal material prices
-        set_strategy_params(
-                orig_buy_prices,
-                set(chain(forbid_buy, (item_id,))),
-                forbid_craft,
-                policy_can_craft_recipe,
-                research_note_separate = True,
-                )
-        cost_baseline = optimal_cost(item_id)
+        cost_baseline = baseline_costs[item_id]
         if cost_baseline is None:
             continue
 
-        # Get the reduced cost after adjusting the prices of disposed items
-        set_strategy_params(
-                buy_prices,
-                set(chain(forbid_buy, (item_id,))),
-                forbid_craft,
-                policy_can_craft_recipe,
-                research_note_separate = True,
-                )
-        cost_dispose = optimal_cost(item_id)
+        cost_dispose = optimal_craft_cost(item_id)
         if cost_dispose is None:
             continue
 
@@ -3205,49 +4994,40 @@ def augment_with_cv_tp_data():
     gw2.items.augment(all_items)
     gw2.trading_post.augment(prices)
 
-def cmd_find_item_location(item_name_or_id):
-    # loops through bank, material storage, and all characters to find the item
-    # and prints out the location
-    target_item_id = parse_item_id(item_name_or_id)
-    if target_item_id is None:
-        print('bad item name or id %s?' % item_name_or_id)
-        return
-    
-    # loops through bank
-    bank = gw2.api.fetch('/v2/account/bank')
-    for item in bank:
-        if item is None:
-            continue
-        if item['id'] == target_item_id:
-            print('Item found in bank')
+def describe_location(loc):
+    kind, _, char_name = loc.container.partition(':')
+    if kind == 'bank':
+        return 'bank, slot %d' % (loc.slot + 1)
+    elif kind == 'materials':
+        return 'material storage'
+    elif kind == 'inventory':
+        return '%s\'s inventory, slot %d' % (char_name, loc.slot + 1)
+    elif kind == 'equipment':
+        return '%s\'s equipment, %s' % (char_name, loc.slot)
+    return loc.container
+
+def cmd_find_item_location(item_names_or_ids, refresh=False):
+    '''Print every place on the account (bank, material storage, character
+    inventories and equipment) holding each of the items, with counts.'''
+    item_ids = []
+    for s in item_names_or_ids:
+        item_id = parse_item_id(s)
+        if item_id is None:
+            print('bad item name or id %s?' % s)
             return
-    
-    # loops through characters
-    char_names = get_char_names()
-    for char_name in char_names:
-        char = gw2.api.fetch_with_retries('/v2/characters/%s/inventory' %
-                urllib.parse.quote(char_name))
-        for bag in char['bags']:
-            if bag is None:
-                continue
-            for item in bag['inventory']:
-                if item is None:
-                    continue
-                if item['id'] == target_item_id:
-                    print('Item found in %s\'s inventory' % char_name)
-                    return
+        item_ids.append(item_id)
 
-    # loops through material storage
-    materials = gw2.api.fetch_with_retries('/v2/account/materials')
-    for item in materials:
-        if item is None:
+    index = gw2.locations.get(get_account_snapshot,
+            max_age=0 if refresh else gw2.locations.MAX_AGE)
+    print('Locations as of %d seconds ago' % index.age())
+    for item_id, locations in index.find_multi(item_ids).items():
+        print()
+        if len(locations) == 0:
+            print('%s: not found' % gw2.items.name(item_id))
             continue
-        if item['id'] == target_item_id:
-            print('Item found in material storage')
-            return
-    
-    print('Item \'%s\' not found' % item_name_or_id)
-    return
+        print('%s: %d' % (gw2.items.name(item_id), sum(loc.count for loc in locations)))
+        for loc in locations:
+            print('  %-40s %6d' % (describe_location(loc), loc.count))
 
 def cmd_ecto_crafting():
     ASSUMED_ECTO_SALVAGE_RATE = 0.87
@@ -3260,6 +5040,9 @@ def cmd_ecto_crafting():
         if (item['type'] == 'Armor' or item['type'] == 'Weapon') and item['rarity'] == 'Rare' and item['level'] >= 68 and 'NoSalvage' not in item['flags']:
             craftable_armor_weapon_items.append(item_id)
 
+    forbid_buy = policy_forbid_buy().union(craftable_armor_weapon_items)
+    forbid_craft = policy_forbid_craft()
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
     related_items = gather_related_items(craftable_armor_weapon_items)
     buy_prices, sell_prices = get_prices(related_items)
 
@@ -3267,12 +5050,7 @@ def cmd_ecto_crafting():
     print('Assumed ecto salvage rate:', ASSUMED_ECTO_SALVAGE_RATE)
     print('Ectoplasm buy price:', format_price(ecto_price))
 
-    set_strategy_params(
-            buy_prices,
-            policy_forbid_buy().union(craftable_armor_weapon_items),
-            policy_forbid_craft(),
-            policy_can_craft_recipe,
-            )
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
     rows = []
     for item_id in craftable_armor_weapon_items:
         craft_cost = optimal_cost(item_id)
@@ -3317,8 +5095,10 @@ def cmd_ecto_crafting():
     
 def cmd_material_worth():
     '''Print a table of materials and their worth based on the current trading post prices.'''
-    materials = gw2.api.fetch_with_retries('/v2/account/materials')
+    materials = get_account_snapshot('materials').materials
     material_ids = [m['id'] for m in materials]
+    set_strategy_params({}, policy_forbid_buy(), policy_forbid_craft(),
+            policy_can_craft_recipe)
     related_items = gather_related_items(material_ids)
     buy_prices, sell_prices = get_prices(related_items)
 
@@ -3372,17 +5152,12 @@ def cmd_analyze_data(item_name_or_id):
     item = gw2.items.get(target_item_id)
     item_id = item['id']
 
-    related_items = gather_related_items([item_id])
-    buy_prices, sell_prices = get_prices(related_items)
     forbid_buy = policy_forbid_buy().union([item_id])
     forbid_craft = policy_forbid_craft()
-
-    set_strategy_params(
-            buy_prices,
-            set(chain(forbid_buy, (item_id,))),
-            forbid_craft,
-            policy_can_craft_recipe,
-            )
+    set_strategy_params({}, forbid_buy, forbid_craft, policy_can_craft_recipe)
+    related_items = gather_related_items([item_id])
+    buy_prices, sell_prices = get_prices(related_items)
+    update_strategy_params(buy_prices, forbid_buy, forbid_craft)
 
     sell_price = sell_prices.get(item_id)
     cost = optimal_cost(item_id)
@@ -3439,6 +5214,101 @@ def cmd_analyze_data(item_name_or_id):
         render_title=True,
         render_total=False)
 
+def parse_options(args, **types):
+    '''Parse `--name VALUE` options from `args`, which must contain nothing
+    else.  `types` maps each allowed option (with `-` written as `_`) to a
+    function that converts its value.  Returns a dict of the options given.'''
+    assert len(args) % 2 == 0, 'expected --name VALUE options, got %r' % (args,)
+    options = {}
+    for opt, value in zip(args[0::2], args[1::2]):
+        name = opt[2:].replace('-', '_')
+        assert opt.startswith('--') and name in types, \
+                'unknown option %r (expected %s)' % (opt,
+                        ', '.join('--' + k.replace('_', '-') for k in types))
+        options[name] = types[name](value)
+    return options
+
+def parse_jobs_arg(args):
+    '''Parse an optional `--jobs N` from `args`, which must contain nothing
+    else.  Returns the number of jobs, defaulting to 1.'''
+    jobs = parse_options(args, jobs=int).get('jobs', 1)
+    assert jobs >= 1
+    return jobs
+
+SERVER_SOCKET_PATH = os.path.join(STORAGE_DIR, 'bookkeeper.sock')
+# Commands that `serve` will run for clients.
+SERVER_COMMANDS = ('status', 'whatif', 'steps', 'profit', 'craft_profit',
+        'strategies')
+
+# Held while the server is running a command or refreshing its data.
+_SERVER_LOCK = threading.Lock()
+
+def _server_refresh():
+    '''Refetch account data and prices, so commands run by the server don't
+    have to wait for them.'''
+    gw2.api.clear_memo()
+    gw2.account.clear()
+    clear_policy_cache()
+    get_account_snapshot(*gw2.account.SOURCES)
+    output_item_ids = set(craftable_items())
+    # As in `do_craft_profit`, so the related items come from the current
+    # policy rather than whatever the last command set.
+    set_strategy_params({}, policy_forbid_buy(), policy_forbid_craft(),
+            policy_can_craft_recipe)
+    get_prices(gather_related_items(output_item_ids))
+    _get_tp_prices(output_item_ids)
+
+class _ServerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        argv = request['argv']
+        if len(argv) == 0 or argv[0] not in SERVER_COMMANDS:
+            # The client runs these itself.
+            self.wfile.write(b'{"unsupported": true}\n')
+            return
+
+        start = time.time()
+        out = io.StringIO()
+        status = 0
+        with _SERVER_LOCK, contextlib.redirect_stdout(out):
+            try:
+                run_command(argv[0], argv[1:])
+            except Exception:
+                traceback.print_exc(file=out)
+                status = 1
+        self.wfile.write(json.dumps({'output': out.getvalue(), 'status': status})
+                .encode('utf-8') + b'\n')
+        print('%s: %s (%.3fs)' % (datetime.datetime.now().strftime('%H:%M:%S'),
+            ' '.join(argv), time.time() - start), file=sys.stderr)
+
+def cmd_serve(path=SERVER_SOCKET_PATH, refresh_interval=300):
+    '''Keep item, recipe, price, account, and strategy data loaded in memory,
+    and run commands sent by `bookkeeper_client.py` over the Unix socket at
+    `path`.  Account data and prices are refreshed every `refresh_interval`
+    seconds.'''
+    gw2.api.MEMO_MAX_AGE = refresh_interval
+    with _SERVER_LOCK:
+        _server_refresh()
+
+    def refresh_loop():
+        while True:
+            time.sleep(refresh_interval)
+            with _SERVER_LOCK:
+                try:
+                    _server_refresh()
+                except Exception:
+                    traceback.print_exc()
+    threading.Thread(target=refresh_loop, daemon=True).start()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    with socketserver.UnixStreamServer(path, _ServerHandler) as server:
+        print('listening on %s' % path, file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
 def main():
     with open('api_key.txt') as f:
         gw2.api.API_KEY = f.read().strip()
@@ -3447,15 +5317,43 @@ def main():
     if int(os.environ.get('GW2_USE_CV_TP_DATA') or 0):
         augment_with_cv_tp_data()
 
-    cmd = sys.argv[1]
-    args = sys.argv[2:]
+    global TABLE_OUT_DIR, TABLE_FORMAT
+    argv = sys.argv[1:]
+    while len(argv) > 0 and argv[0].startswith('--'):
+        opt, _, value = argv[0].partition('=')
+        if opt == '--profile':
+            # Print a timing report (see `gw2.profiling`), and optionally
+            # write a profile to `value`.
+            gw2.profiling.ENABLED = True
+            if value != '':
+                gw2.profiling.OUTPUT_PATH = value
+        elif opt == '--table-out':
+            # Also write every table to a file in directory `value`.
+            TABLE_OUT_DIR = value
+        elif opt == '--table-format':
+            gw2.table_output.check_format(value)
+            TABLE_FORMAT = value
+        else:
+            raise ValueError('unknown option %r' % argv[0])
+        argv = argv[1:]
+
+    gw2.profiling.start()
+    try:
+        with phase(argv[0]):
+            run_command(argv[0], argv[1:])
+    finally:
+        gw2.profiling.report()
 
+def run_command(cmd, args):
     if cmd == 'init':
         assert len(args) == 0
         cmd_init()
     elif cmd == 'status':
-        assert len(args) == 0
-        cmd_status()
+        assert args in ([], ['--exact'])
+        cmd_status(exact=len(args) > 0)
+    elif cmd == 'whatif':
+        assert len(args) <= 1
+        cmd_whatif(*args)
     elif cmd == 'steps':
         cmd_steps(args)
     elif cmd == 'goal':
@@ -3479,11 +5377,14 @@ def main():
         names = args
         cmd_obtain(names)
     elif cmd == 'gen_profit_sql':
-        assert len(args) == 0
-        cmd_gen_profit_sql()
+        cmd_gen_profit_sql(parse_jobs_arg(args))
     elif cmd == 'craft_profit':
-        assert len(args) == 0
-        cmd_craft_profit()
+        options = parse_options(args, jobs=int, top=int, min_roi=float, min_volume=float)
+        assert options.get('jobs', 1) >= 1
+        cmd_craft_profit(**options)
+    elif cmd == 'craft_profit_watch':
+        assert len(args) <= 1
+        cmd_craft_profit_watch(*(int(x) for x in args))
     elif cmd == 'craft_profit_buy':
         assert len(args) == 0
         cmd_craft_profit_buy()
@@ -3529,9 +5430,10 @@ def main():
         name, = args
         cmd_profit(name)
     elif cmd == 'find_item_location':
-        assert len(args) == 1
-        item_name_or_id,  = args
-        cmd_find_item_location(item_name_or_id)
+        refresh = '--refresh' in args
+        item_names_or_ids = [a for a in args if a != '--refresh']
+        assert len(item_names_or_ids) >= 1
+        cmd_find_item_location(item_names_or_ids, refresh=refresh)
     elif cmd == 'ecto_crafting':
         assert len(args) == 0
         cmd_ecto_crafting()
@@ -3542,5 +5444,9 @@ def main():
     elif cmd == 'material_worth':
         assert len(args) == 0
         cmd_material_worth()
+    elif cmd == 'serve':
+        assert len(args) <= 2
+        path = args[0] if len(args) > 0 else SERVER_SOCKET_PATH
+        cmd_serve(path, *(int(x) for x in args[1:]))
     else:
         raise ValueError('unknown command %r' % cmd)
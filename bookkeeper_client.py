@@ -0,0 +1,41 @@
+'''Thin client for `bookkeeper.py serve`.  Sends the command line to the server
+and prints its output, so commands skip loading and solving everything from
+scratch.  Commands the server doesn't handle, or any command when no server is
+listening, run `bookkeeper.py` directly instead.
+
+    python3 bookkeeper_client.py status
+'''
+import json
+import os
+import socket
+import sys
+
+from gw2.constants import STORAGE_DIR
+
+SOCKET_PATH = os.environ.get('BOOKKEEPER_SOCKET') or \
+        os.path.join(STORAGE_DIR, 'bookkeeper.sock')
+
+def run_locally(argv):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bookkeeper.py')
+    os.execv(sys.executable, [sys.executable, script] + argv)
+
+def main():
+    argv = sys.argv[1:]
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(SOCKET_PATH)
+    except OSError:
+        run_locally(argv)
+
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps({'argv': argv}).encode('utf-8') + b'\n')
+        f.flush()
+        response = json.loads(f.readline())
+
+    if response.get('unsupported'):
+        run_locally(argv)
+    sys.stdout.write(response['output'])
+    sys.exit(response['status'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+'''Snapshot of the account state that commands work from: character
+inventories, the bank, material storage, the wallet, the trading post delivery
+box, current orders, and transaction history.  Each source is fetched on first
+use, so a command only pays for the requests it needs.  These are independent
+API requests (apart from character inventories, which need the character
+list), so `AccountSnapshot.load` issues several of them concurrently.  `get`
+keeps the snapshot for the rest of the run, so commands that call each other
+share one set of requests.'''
+
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+
+from gw2.api import fetch, fetch_with_retries
+import gw2.character
+import gw2.trading_post
+
+# Maximum number of requests in flight at once.
+FETCH_THREADS = 8
+
+# Sources that `AccountSnapshot.load` accepts.  `'buys'` covers `buy_orders`
+# and `buying_items`, `'sells'` covers `sell_orders` and `selling_items`, and
+# `'inventories'` covers `character_inventories`.
+SOURCES = ('characters', 'inventories', 'bank', 'materials', 'wallet',
+        'delivery', 'sold', 'buys', 'sells')
+# Sources that `AccountSnapshot.inventory` reads.
+INVENTORY_SOURCES = ('inventories', 'materials', 'bank')
+
+def _get_char_names():
+    return fetch('/v2/characters')
+
+def _get_character_inventory(char_name):
+    return fetch_with_retries('/v2/characters/%s/inventory' %
+            urllib.parse.quote(char_name))['bags']
+
+def _get_wallet():
+    return {x['id']: x['value'] for x in fetch_with_retries('/v2/account/wallet')}
+
+# Maps each source other than `'characters'` and `'inventories'` to its
+# `fetched_at` key and a function fetching it.
+_FETCHERS = {
+    'bank': ('bank', lambda: fetch('/v2/account/bank')),
+    'materials': ('materials', lambda: fetch_with_retries('/v2/account/materials')),
+    'wallet': ('wallet', _get_wallet),
+    'delivery': ('delivery', lambda: fetch_with_retries('/v2/commerce/delivery')),
+    'sold': ('history:sells', lambda: gw2.trading_post.total_sold()),
+    'buys': ('current:buys', lambda: gw2.trading_post.pending_buys()),
+    'sells': ('current:sells', lambda: gw2.trading_post.pending_sells()),
+}
+
+def _source_property(source, index=None, doc=None):
+    def get(self):
+        value = self._values.get(source)
+        if value is None:
+            self.load(source)
+            value = self._values[source]
+        return value if index is None else value[index]
+    return property(get, doc=doc)
+
+class AccountSnapshot:
+    '''Account state, fetched one source at a time as it's used.
+    `characters` is the list of character names, `character_inventories` maps
+    each name to its list of bags, and `bank`, `materials` and `delivery` are
+    the raw API responses.  `wallet` maps currency IDs to amounts.  `sold` maps
+    item IDs to the total quantity sold in the transaction history, and
+    `buy_orders`, `buying_items`, `sell_orders` and `selling_items` are as
+    returned by `gw2.trading_post.pending_buys` and `pending_sells`.  Equipped
+    gear is only fetched when needed, by `equipment`.  `fetched_at` maps each
+    source (`'bank'`, `'inventory:<name>'`, ...) to the time its response
+    arrived, and `timestamp` is when the snapshot was created, before any of
+    them were requested.'''
+    __slots__ = ('fetched_at', 'timestamp', '_get_char_names', '_values',
+            '_lock', '_inventory', '_equipment', '_containers')
+
+    def __init__(self, get_char_names=_get_char_names):
+        self.fetched_at = {}
+        self.timestamp = time.time()
+        self._get_char_names = get_char_names
+        self._values = {}
+        self._lock = threading.RLock()
+        self._inventory = None
+        self._equipment = None
+        self._containers = {}
+
+    characters = _source_property('characters')
+    character_inventories = _source_property('inventories')
+    bank = _source_property('bank')
+    materials = _source_property('materials')
+    wallet = _source_property('wallet')
+    delivery = _source_property('delivery')
+    sold = _source_property('sold')
+    buy_orders = _source_property('buys', 0)
+    buying_items = _source_property('buys', 1)
+    sell_orders = _source_property('sells', 0)
+    selling_items = _source_property('sells', 1)
+
+    def load(self, *sources):
+        '''Fetch those of `sources` (see `SOURCES`) that haven't been fetched
+        yet, concurrently.  Commands that know up front which sources they
+        need can call this to avoid fetching them one after another.'''
+        with self._lock:
+            missing = [s for s in sources if s not in self._values]
+            if 'inventories' in missing and 'characters' not in self._values:
+                missing.append('characters')
+            if not missing:
+                return
+
+            def timed(name, func, *args):
+                result = func(*args)
+                self.fetched_at[name] = time.time()
+                return result
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_THREADS) as executor:
+                futures = {}
+                for source in missing:
+                    if source == 'characters':
+                        futures[source] = executor.submit(timed, 'characters',
+                                lambda: list(self._get_char_names()))
+                    elif source != 'inventories':
+                        name, func = _FETCHERS[source]
+                        futures[source] = executor.submit(timed, name, func)
+
+                inventories = None
+                if 'inventories' in missing:
+                    if 'characters' in futures:
+                        self._values['characters'] = futures.pop('characters').result()
+                    inventories = {char_name: executor.submit(timed,
+                        'inventory:' + char_name, _get_character_inventory, char_name)
+                        for char_name in self._values['characters']}
+
+                for source, f in futures.items():
+                    self._values[source] = f.result()
+                if inventories is not None:
+                    self._values['inventories'] = {char_name: f.result()
+                            for char_name, f in inventories.items()}
+
+    def inventory(self):
+        '''Return a dict of the quantities of all items in material storage,
+        the bank, and character inventories.  The dict is shared, so callers
+        must copy it before making changes.'''
+        if self._inventory is None:
+            self.load(*INVENTORY_SOURCES)
+            counts = {}
+            def add(item):
+                if item is None or item['count'] == 0:
+                    return
+                counts[item['id']] = counts.get(item['id'], 0) + item['count']
+            for char_name in self.characters:
+                for bag in self.character_inventories[char_name]:
+                    if bag is None:
+                        continue
+                    for item in bag['inventory']:
+                        add(item)
+            for item in self.materials:
+                add(item)
+            for item in self.bank:
+                add(item)
+            self._inventory = counts
+        return self._inventory
+
+    def equipment(self):
+        '''Return a dict mapping each character name to its list of equipped
+        items, fetching them all concurrently on first use.'''
+        if self._equipment is None:
+            def get(char_name):
+                result = gw2.character.get_equipment_for_character(char_name)
+                self.fetched_at['equipment:' + char_name] = time.time()
+                return result
+            with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_THREADS) as executor:
+                self._equipment = dict(zip(self.characters,
+                    executor.map(get, self.characters)))
+        return self._equipment
+
+    def container(self, name):
+        '''Return the API response for one container: `'bank'`,
+        `'materials'`, `'inventory:<name>'` (a list of bags) or
+        `'equipment:<name>'`.  Sources that were already fetched are reused;
+        otherwise only that container is fetched.'''
+        if name in ('bank', 'materials'):
+            return getattr(self, name)
+        kind, char_name = name.split(':', 1)
+        if kind == 'inventory' and 'inventories' in self._values:
+            return self._values['inventories'][char_name]
+        if kind == 'equipment' and self._equipment is not None:
+            return self._equipment[char_name]
+
+        result = self._containers.get(name)
+        if result is None:
+            if kind == 'inventory':
+                result = _get_character_inventory(char_name)
+            else:
+                result = gw2.character.get_equipment_for_character(char_name)
+            self.fetched_at[name] = time.time()
+            self._containers[name] = result
+        return result
+
+    def age(self):
+        '''Seconds since the oldest response in the snapshot arrived.'''
+        return time.time() - min(self.fetched_at.values(), default=self.timestamp)
+
+def fetch_snapshot(get_char_names=_get_char_names, sources=SOURCES):
+    '''Create a new `AccountSnapshot` and fetch `sources` for it up front.
+    `get_char_names` returns the list of characters whose inventories to
+    include.'''
+    snapshot = AccountSnapshot(get_char_names)
+    snapshot.load(*sources)
+    return snapshot
+
+_SNAPSHOT = None
+_LOCK = threading.Lock()
+
+def get(get_char_names=_get_char_names, sources=()):
+    '''Return the current `AccountSnapshot`, creating it on first use, with
+    `sources` already fetched.  Other sources are fetched when first used.'''
+    global _SNAPSHOT
+    with _LOCK:
+        if _SNAPSHOT is None:
+            _SNAPSHOT = AccountSnapshot(get_char_names)
+        snapshot = _SNAPSHOT
+    snapshot.load(*sources)
+    return snapshot
+
+def clear():
+    '''Discard the current snapshot and the trading post order and history
+    caches, so the next `get` refetches everything.'''
+    global _SNAPSHOT
+    with _LOCK:
+        _SNAPSHOT = None
+        gw2.trading_post.clear_account_caches()
@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 import requests
@@ -11,7 +12,37 @@ CACHE_DIR = None
 
 OFFLINE = bool(int(os.environ.get('GW2_API_OFFLINE') or 0))
 
+# If set, `fetch` keeps account data in memory and reuses it for up to this
+# many seconds.  Long-running processes use this to avoid refetching account
+# data for every command.  Only paths starting with one of `MEMO_PREFIXES` are
+# kept: trading post prices and listings have their own per-item freshness
+# checks in `gw2.trading_post`, which the memo would bypass.
+MEMO_MAX_AGE = None
+MEMO_PREFIXES = ('/v2/account/', '/v2/characters', '/v2/commerce/delivery')
+_MEMO = {}
+
+def clear_memo():
+    _MEMO.clear()
+
+# Recorded API responses, as a dict mapping request paths (including the query
+# string) to `{'json': ..., 'headers': {...}}`.  If `REPLAY` is set, requests
+# are answered from it instead of the network, and paths missing from it raise
+# `KeyError`.  If `RECORD` is set, every response fetched from the network is
+# added to it.  See `benchmarks/record_fixtures.py`.
+REPLAY = None
+RECORD = None
+
+class _RecordedResponse:
+    def __init__(self, entry):
+        self._json = entry['json']
+        self.headers = entry.get('headers', {})
+
+    def json(self):
+        return copy.deepcopy(self._json)
+
 def _fetch_req(path):
+    if REPLAY is not None:
+        return _RecordedResponse(REPLAY[path])
     assert not OFFLINE
     headers = {
             'X-Schema-Version': API_VERSION,
@@ -27,8 +58,17 @@ def _fetch_req(path):
             r.raise_for_status()
             break
         except requests.HTTPError as e:
+            # 404 means the resource (or every ID in the query) doesn't
+            # exist, so retrying won't help.
+            if e.response.status_code == 404:
+                raise
             print('Error fetching path: %s (retry: %d)' % (e, i))
             time.sleep(i + 1)
+    if RECORD is not None:
+        RECORD[path] = {
+            'json': r.json(),
+            'headers': {k: v for k, v in r.headers.items() if k.startswith('X-')},
+        }
     return r
 
 def fetch(path, cache=False):
@@ -40,8 +80,18 @@ def fetch(path, cache=False):
             with open(cache_path) as f:
                 return json.load(f)
 
+    memoize = MEMO_MAX_AGE is not None and path.startswith(MEMO_PREFIXES)
+    if memoize:
+        memo = _MEMO.get(path)
+        if memo is not None and time.time() - memo[0] <= MEMO_MAX_AGE:
+            # Callers are free to modify the result.
+            return copy.deepcopy(memo[1])
+
     j = _fetch_req(path).json()
 
+    if memoize:
+        _MEMO[path] = (time.time(), copy.deepcopy(j))
+
     if cache and CACHE_DIR is not None:
         with open(cache_path, 'w') as f:
             json.dump(j, f)
@@ -49,8 +99,25 @@ def fetch(path, cache=False):
     return j
 
 def fetch_with_retries(path, retry_count=3, seconds_between_retries=2, cache=False):
+    '''Like `fetch`, but retry up to `retry_count` times if the connection
+    fails.  (`fetch` already retries HTTP errors other than 404.)'''
+    for i in range(retry_count):
+        try:
+            return fetch(path, cache=cache)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            print('Error fetching path: %s (retry: %d)' % (e, i), file=sys.stderr)
+            time.sleep(seconds_between_retries)
     return fetch(path, cache=cache)
 
+def fetch_page(path, page, page_size=None):
+    '''Fetch a single page of a paginated resource.  Returns the page contents
+    and the total number of pages.'''
+    query = '?page=%d' % page
+    if page_size is not None:
+        query += '&page_size=%d' % page_size
+    r = _fetch_req(path + query)
+    return r.json(), int(r.headers.get('X-Page-Total', 0))
+
 def fetch_paginated(path):
     '''Fetch all pages of a paginated resource.  This is a generator that
     yields each page in sequence, so the caller can break out of the loop to
@@ -14,10 +14,13 @@ BUILD_FILE = os.path.join(CHARACTERS_DIR, 'build.txt')
 CRAFTING_DISCIPLINES_FILE = os.path.join(CHARACTERS_DIR, 'characters_crafting.json')
 
 _CHARACTERS = None
+# Set by `clear` to refetch characters and crafting disciplines from the API
+# rather than reading the files, which are only rewritten on a build change.
+_FORCE_REFRESH = False
 def _get_characters():
     global _CHARACTERS
     if _CHARACTERS is None:
-        if gw2.build.need_refresh(BUILD_FILE):
+        if _FORCE_REFRESH or gw2.build.need_refresh(BUILD_FILE):
             _CHARACTERS = _refresh()
         else:
             with open(CHARACTERS_FILE) as f:
@@ -45,7 +48,7 @@ _CHARACTERS_CRAFTING = None
 def _get_characters_crafting():
     global _CHARACTERS_CRAFTING
     if _CHARACTERS_CRAFTING is None:
-        if gw2.build.need_refresh(BUILD_FILE):
+        if _FORCE_REFRESH or gw2.build.need_refresh(BUILD_FILE):
             _CHARACTERS_CRAFTING = _refresh_crafting()
         else:
             with open(CRAFTING_DISCIPLINES_FILE) as f:
@@ -84,7 +87,24 @@ def get_equipment_for_character(character_name):
 def get_all_character_disciplines():
     return _get_characters_crafting()
 
+_MAX_DISCIPLINES = None
 def get_max_of_each_discipline():
+    global _MAX_DISCIPLINES
+    if _MAX_DISCIPLINES is None:
+        _MAX_DISCIPLINES = _compute_max_of_each_discipline()
+    return dict(_MAX_DISCIPLINES)
+
+def clear():
+    '''Forget the characters and crafting disciplines loaded so far, so the
+    next call fetches them from the API again, picking up new characters and
+    crafting levels.'''
+    global _CHARACTERS, _CHARACTERS_CRAFTING, _MAX_DISCIPLINES, _FORCE_REFRESH
+    _CHARACTERS = None
+    _CHARACTERS_CRAFTING = None
+    _MAX_DISCIPLINES = None
+    _FORCE_REFRESH = True
+
+def _compute_max_of_each_discipline():
     characters_disciplines = get_all_character_disciplines()
     max_disciplines = {
         "Armorsmith": 0,
@@ -89,8 +89,25 @@ def iter_all():
 def get_multi(item_ids):
     return [get(i) for i in item_ids]
 
+# Names of all items looked up so far.
+_NAMES = {}
+
 def name(item_id):
-    return get(item_id)['name']
+    n = _NAMES.get(item_id)
+    if n is None:
+        n = _NAMES[item_id] = get(item_id)['name']
+    return n
+
+def names(item_ids):
+    '''Look up the names of all of `item_ids` at once, so later calls to
+    `name` for any of them are dict lookups.  Returns a dict mapping each
+    known ID to its name.'''
+    item_ids = set(item_ids)
+    missing = [i for i in item_ids if i not in _NAMES]
+    if len(missing) > 0:
+        for item_id, item in _get_data().get_multi(missing).items():
+            _NAMES[item_id] = item['name']
+    return {i: _NAMES[i] for i in item_ids if i in _NAMES}
 
 _BY_NAME = None
 def _by_name():
@@ -0,0 +1,227 @@
+'''Columnar view of the trading post transaction history.  `load` converts the
+JSON transaction records kept by `gw2.trading_post` into typed numpy arrays
+(cached on disk and extended as new transactions arrive), so aggregations over
+the whole history run as a handful of vectorized operations instead of a
+Python loop over every transaction.'''
+
+import datetime
+import functools
+import os
+
+import numpy as np
+
+import gw2.trading_post
+from gw2.trading_post import TRADING_POST_DIR
+
+COLUMNS = (
+    ('id', np.int64),
+    ('item_id', np.int32),
+    ('price', np.int64),
+    ('quantity', np.int32),
+    ('created', np.int64),
+    ('purchased', np.int64),
+)
+
+SECONDS_PER_DAY = 86400
+
+def _epoch(s):
+    '''Convert an API timestamp like `2024-01-01T12:34:56+00:00` to seconds
+    since the epoch.'''
+    if s.endswith('+00:00') or s.endswith('Z'):
+        return int(np.datetime64(s[:19], 's').astype(np.int64))
+    return int(datetime.datetime.fromisoformat(s).timestamp())
+
+class Ledger:
+    '''A set of transactions, stored as one array per column and sorted by
+    `purchased` time.'''
+    def __init__(self, cols):
+        order = np.argsort(cols['purchased'], kind='stable')
+        for name, _ in COLUMNS:
+            setattr(self, name, cols[name][order])
+
+    def __len__(self):
+        return len(self.id)
+
+    def columns(self):
+        return {name: getattr(self, name) for name, _ in COLUMNS}
+
+    def value(self):
+        '''Total price of each transaction.'''
+        return self.price * self.quantity
+
+    def select(self, mask):
+        cols = self.columns()
+        return Ledger({k: v[mask] for k, v in cols.items()})
+
+    def since(self, timestamp):
+        '''Transactions purchased at or after `timestamp`.'''
+        start = np.searchsorted(self.purchased, timestamp, side='left')
+        return self.select(slice(start, None))
+
+    def durations(self):
+        '''Time in seconds between listing and sale of each transaction.'''
+        return self.purchased - self.created
+
+    def totals_by_item(self):
+        '''Return arrays `(item_ids, quantity, value)` with the total quantity
+        and total price of each distinct item.'''
+        return _group_sums(self.item_id, self.quantity, self.value())
+
+    def totals_by_day(self):
+        '''Return arrays `(days, quantity, value)`, where `days` are the start
+        of each UTC day (in epoch seconds) that had transactions.'''
+        days, quantity, value = _group_sums(
+                self.purchased // SECONDS_PER_DAY, self.quantity, self.value())
+        return days * SECONDS_PER_DAY, quantity, value
+
+    def totals_by_price_band(self, edges):
+        '''Bucket transactions by unit price.  Returns arrays `(quantity,
+        value)` of length `len(edges) + 1`, where bucket `i` holds prices in
+        `[edges[i-1], edges[i])`.'''
+        band = np.digitize(self.price, edges)
+        n = len(edges) + 1
+        return (np.bincount(band, weights=self.quantity, minlength=n).astype(np.int64),
+                np.bincount(band, weights=self.value(), minlength=n).astype(np.int64))
+
+def _group_sums(keys, quantity, value):
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    return (uniq,
+            np.bincount(inverse, weights=quantity).astype(np.int64),
+            np.bincount(inverse, weights=value).astype(np.int64))
+
+def _empty_columns():
+    return {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}
+
+def _to_columns(txs):
+    cols = _empty_columns()
+    if len(txs) == 0:
+        return cols
+    cols['id'] = np.fromiter((t['id'] for t in txs), np.int64, len(txs))
+    cols['item_id'] = np.fromiter((t['item_id'] for t in txs), np.int32, len(txs))
+    cols['price'] = np.fromiter((t['price'] for t in txs), np.int64, len(txs))
+    cols['quantity'] = np.fromiter((t['quantity'] for t in txs), np.int32, len(txs))
+    cols['created'] = np.fromiter((_epoch(t['created']) for t in txs), np.int64, len(txs))
+    cols['purchased'] = np.fromiter((_epoch(t['purchased']) for t in txs), np.int64, len(txs))
+    return cols
+
+def _cache_path(kind):
+    return os.path.join(TRADING_POST_DIR, 'ledger_%s.npz' % kind)
+
+@functools.lru_cache(2)
+def load(kind):
+    '''Return a `Ledger` of all transactions of `kind` (`'buys'` or
+    `'sells'`).  Only transactions added since the last call are converted;
+    the rest come from the on-disk cache.'''
+    data = gw2.trading_post._get_history(kind)[0]
+    path = _cache_path(kind)
+
+    cols = None
+    start = 0
+    if os.path.exists(path):
+        with np.load(path) as f:
+            start = int(f['num_records'])
+            if start <= len(data.index):
+                cols = {name: f[name] for name, _ in COLUMNS}
+    if cols is None:
+        cols = _empty_columns()
+        start = 0
+
+    new = list(data.iter(start))
+    if len(new) > 0 or not os.path.exists(path):
+        new_cols = _to_columns(new)
+        cols = {k: np.concatenate((cols[k], new_cols[k])) for k in cols}
+        with open(path + '.new', 'wb') as f:
+            np.savez(f, num_records=len(data.index), **cols)
+        os.replace(path + '.new', path)
+
+    return Ledger(cols)
+
+def _cumulative_at(cum_qty, cum_value, price, target):
+    '''Given per-transaction cumulative quantities and values (in a fixed
+    order), return the total value of the first `target` units.'''
+    j = np.searchsorted(cum_qty, target, side='left')
+    j = np.minimum(j, len(cum_qty) - 1)
+    prev_qty = np.where(j > 0, cum_qty[j - 1], 0)
+    prev_value = np.where(j > 0, cum_value[j - 1], 0)
+    return prev_value + (target - prev_qty) * price[j]
+
+def _item_major(ledger):
+    '''Sort transactions by item, then time, and compute cumulative quantity
+    and value.  Returns `(item_ids, starts, cum_qty, cum_value, price, key)`,
+    where `starts` is the index of each item's first transaction and `key`
+    is the sorted `_item_time_key` of each transaction.'''
+    order = np.lexsort((ledger.purchased, ledger.item_id))
+    item_id = ledger.item_id[order]
+    quantity = ledger.quantity[order].astype(np.int64)
+    price = ledger.price[order]
+    cum_qty = np.cumsum(quantity)
+    cum_value = np.cumsum(quantity * price)
+    item_ids, starts = np.unique(item_id, return_index=True)
+    key = _item_time_key(item_id, ledger.purchased[order])
+    return item_ids, starts, cum_qty, cum_value, price, key
+
+def _item_time_key(item_id, purchased):
+    '''Combine item IDs and timestamps into one sortable int64 key.'''
+    return (item_id.astype(np.int64) << 32) | purchased
+
+def _group_cummin(values, group):
+    '''Running minimum of `values` that restarts at each new group.  `group`
+    is the group index of each value, in increasing order.'''
+    if len(values) == 0:
+        return values
+    # Shift each group below all earlier ones, so a single running minimum
+    # never reaches back into the previous group.
+    span = 2 * int(np.abs(values).max()) + 1
+    shift = group.astype(np.int64) * span
+    return np.minimum.accumulate(values - shift) + shift
+
+def fifo_profit(buys, sells, fee=0.15):
+    '''Match sales of each item against purchases of the same item in
+    first-in, first-out order, walking both in time order.  Each sale is
+    matched only against units bought at or before its `purchased` time
+    and not already matched to an earlier sale; units sold without such a
+    purchase (items obtained some other way, or bought before the history
+    starts) stay unmatched.  Returns arrays `(item_ids, matched, cost,
+    revenue)`: the number of units sold that were matched to a purchase, the
+    purchase cost of those units, and their sale price after the trading post
+    `fee`.  Only items that were both bought and sold are included.
+
+    With `bought` and `sold` the units of an item bought and sold up to each
+    sale, the units matched so far follow `m[k] = min(m[k-1] + q[k],
+    bought[k])`, which unrolls to `sold[k] + min(0, min(bought[j] - sold[j]
+    for j <= k))`, a running minimum per item.'''
+    if len(buys) == 0 or len(sells) == 0:
+        z = np.zeros(0, dtype=np.int64)
+        return z.astype(np.int32), z, z, z.astype(np.float64)
+
+    b_items, b_starts, b_cq, b_cv, b_price, b_key = _item_major(buys)
+    s_items, s_starts, s_cq, s_cv, s_price, s_key = _item_major(sells)
+
+    # Per sale: the item's group, and units of the item sold so far,
+    # including this sale.
+    s_counts = np.diff(np.append(s_starts, len(s_cq)))
+    s_group = np.repeat(np.arange(len(s_items)), s_counts)
+    s_before_qty = np.where(s_starts > 0, s_cq[s_starts - 1], 0)
+    sold = s_cq - s_before_qty[s_group]
+
+    # Units of the same item bought at or before each sale.
+    b_pos = np.minimum(np.searchsorted(b_items, s_items), len(b_items) - 1)
+    has_buys = b_items[b_pos] == s_items
+    b_before_qty = np.where(b_starts > 0, b_cq[b_starts - 1], 0)[b_pos]
+    b_before_value = np.where(b_starts > 0, b_cv[b_starts - 1], 0)[b_pos]
+    n = np.searchsorted(b_key, s_key, side='right')
+    bought = np.where(n > 0, b_cq[n - 1], 0) - b_before_qty[s_group]
+    bought = np.where(has_buys[s_group], bought, 0)
+
+    cum_matched = sold + np.minimum(0, _group_cummin(bought - sold, s_group))
+    prev_matched = np.concatenate(([0], cum_matched[:-1]))
+    prev_matched[s_starts] = 0
+    revenue = np.add.reduceat((cum_matched - prev_matched) * s_price, s_starts)
+    matched = cum_matched[np.append(s_starts[1:], len(sold)) - 1]
+
+    # Matched units are the first `matched` units bought, since each sale
+    # takes the oldest units still available.
+    cost = _cumulative_at(b_cq, b_cv, b_price, b_before_qty + matched) - b_before_value
+
+    return (s_items[has_buys], matched[has_buys], cost[has_buys],
+            revenue[has_buys] * (1 - fee))
@@ -0,0 +1,165 @@
+'''Index of where each item is kept on the account.  `LocationIndex` maps item
+IDs to a list of `Location`s, covering the bank, material storage, and the
+inventory and equipped gear of every character.  The index is saved to disk,
+and each container is stored separately with the time it was fetched and a
+digest of its API response.  A refresh only refetches the containers older
+than `MAX_AGE` seconds, and only rebuilds those whose contents changed, so
+queries shortly after a refresh need no API requests.'''
+
+from collections import namedtuple
+import concurrent.futures
+import hashlib
+from itertools import chain
+import json
+import os
+import time
+
+from gw2.account import FETCH_THREADS
+from gw2.constants import STORAGE_DIR
+
+LOCATIONS_FILE = os.path.join(STORAGE_DIR, 'item_locations.json')
+
+# Maximum age (in seconds) of a saved container, or of the saved character
+# list, that `get` will use without refetching it.
+MAX_AGE = 5 * 60
+
+# `container` is `'bank'`, `'materials'`, `'inventory:<name>'`, or
+# `'equipment:<name>'`.  `slot` is the index within the bank, material storage,
+# or character inventory (counting across all bags), or the equipment slot
+# name, such as `'Helm'`.  Upgrades and infusions are listed at the slot of the
+# item they're attached to.
+Location = namedtuple('Location', ('container', 'slot', 'count'))
+
+def _item_entries(item, slot):
+    if item is None or item.get('count', 1) == 0:
+        return
+    yield [item['id'], slot, item.get('count', 1)]
+    for upgrade_id in chain(item.get('upgrades') or (), item.get('infusions') or ()):
+        yield [upgrade_id, slot, 1]
+
+def _container_entries(container, raw):
+    '''Build the `[item_id, slot, count]` entries for one container from its
+    API response.'''
+    if container.startswith('inventory:'):
+        items = (item for bag in raw if bag is not None for item in bag['inventory'])
+        return [e for i, item in enumerate(items) for e in _item_entries(item, i)]
+    elif container.startswith('equipment:'):
+        return [e for item in raw for e in _item_entries(item, item.get('slot'))]
+    else:
+        return [e for i, item in enumerate(raw) for e in _item_entries(item, i)]
+
+def _digest(raw):
+    return hashlib.sha1(json.dumps(raw, sort_keys=True).encode('utf-8')).hexdigest()
+
+class LocationIndex:
+    def __init__(self, containers=None, timestamp=0):
+        # Maps each container name to a dict with its `fetched_at` time, the
+        # `digest` of its API response, and its `entries`.
+        self.containers = containers or {}
+        # When the character list, and so the set of containers, was fetched.
+        self.timestamp = timestamp
+        self._index = None
+
+    @staticmethod
+    def load(path=LOCATIONS_FILE):
+        if not os.path.exists(path):
+            return LocationIndex()
+        with open(path) as f:
+            j = json.load(f)
+        return LocationIndex(j['containers'], j['timestamp'])
+
+    def save(self, path=LOCATIONS_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.new', 'w') as f:
+            json.dump({'timestamp': self.timestamp, 'containers': self.containers}, f)
+        os.replace(path + '.new', path)
+
+    def stale(self, max_age=MAX_AGE, now=None):
+        '''Return whether the character list or any container is more than
+        `max_age` seconds old.'''
+        if now is None:
+            now = time.time()
+        return now - self.timestamp > max_age or \
+                any(now - c['fetched_at'] > max_age for c in self.containers.values())
+
+    def update(self, snapshot, max_age=0):
+        '''Bring the index up to date with `snapshot`, refetching only the
+        containers more than `max_age` seconds old (all of them, by default)
+        and rebuilding only those whose contents changed.  If the character
+        list is that old too, it is refetched, adding containers for new
+        characters and dropping those of deleted ones.  Returns the number of
+        containers rebuilt.'''
+        now = time.time()
+        if now - self.timestamp > max_age:
+            names = ['bank', 'materials']
+            for char_name in snapshot.characters:
+                names.append('inventory:' + char_name)
+                names.append('equipment:' + char_name)
+            self.timestamp = snapshot.fetched_at.get('characters', snapshot.timestamp)
+        else:
+            names = list(self.containers)
+
+        stale = [name for name in names if name not in self.containers or
+                now - self.containers[name]['fetched_at'] > max_age]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_THREADS) as executor:
+            raws = dict(zip(stale, executor.map(snapshot.container, stale)))
+
+        rebuilt = 0
+        containers = {}
+        for container in names:
+            old = self.containers.get(container)
+            raw = raws.get(container)
+            if raw is None:
+                containers[container] = old
+                continue
+            digest = _digest(raw)
+            if old is not None and old['digest'] == digest:
+                entries = old['entries']
+            else:
+                entries = _container_entries(container, raw)
+                rebuilt += 1
+            containers[container] = {
+                'fetched_at': snapshot.fetched_at.get(container, snapshot.timestamp),
+                'digest': digest,
+                'entries': entries,
+            }
+
+        if rebuilt > 0 or containers.keys() != self.containers.keys():
+            self._index = None
+        self.containers = containers
+        return rebuilt
+
+    def _get_index(self):
+        if self._index is None:
+            index = {}
+            for container, c in self.containers.items():
+                for item_id, slot, count in c['entries']:
+                    index.setdefault(item_id, []).append(Location(container, slot, count))
+            self._index = index
+        return self._index
+
+    def find(self, item_id):
+        '''Return a list of every `Location` holding `item_id`.'''
+        return self._get_index().get(item_id, [])
+
+    def find_multi(self, item_ids):
+        '''Return a dict mapping each of `item_ids` to its list of
+        `Location`s.'''
+        index = self._get_index()
+        return {item_id: index.get(item_id, []) for item_id in item_ids}
+
+    def age(self):
+        '''Seconds since the oldest container, or the character list, was
+        fetched.'''
+        return time.time() - min(chain((self.timestamp,),
+            (c['fetched_at'] for c in self.containers.values())))
+
+def get(get_snapshot, max_age=MAX_AGE):
+    '''Return the saved `LocationIndex`, first refetching any containers
+    more than `max_age` seconds old from the `gw2.account.AccountSnapshot`
+    returned by `get_snapshot()`.'''
+    index = LocationIndex.load()
+    if index.stale(max_age):
+        index.update(get_snapshot(), max_age)
+        index.save()
+    return index
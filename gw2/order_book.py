@@ -0,0 +1,111 @@
+'''Order books built from `/v2/commerce/listings`, answering quantity-aware
+price questions ("what does it cost to buy N?") in O(log levels).'''
+
+from bisect import bisect_left
+
+class _Side:
+    def __init__(self, levels):
+        '''`levels` is a list of `(unit_price, quantity)` pairs, already sorted
+        from best to worst price.'''
+        self.prices = []
+        # `depth[i]` is the total quantity available at levels `0 .. i`, and
+        # `total[i]` is the total price of all of those items.
+        self.depth = []
+        self.total = []
+        depth = 0
+        total = 0
+        for price, quantity in levels:
+            if quantity <= 0:
+                continue
+            depth += quantity
+            total += price * quantity
+            self.prices.append(price)
+            self.depth.append(depth)
+            self.total.append(total)
+
+    def max_quantity(self):
+        return self.depth[-1] if len(self.depth) > 0 else 0
+
+    def best_price(self):
+        return self.prices[0] if len(self.prices) > 0 else None
+
+    def total_price(self, n):
+        '''Total price of the best `n` items, or `None` if fewer than `n` are
+        listed.'''
+        if n <= 0:
+            return 0
+        if n > self.max_quantity():
+            return None
+        i = bisect_left(self.depth, n)
+        prev_depth = self.depth[i - 1] if i > 0 else 0
+        prev_total = self.total[i - 1] if i > 0 else 0
+        return prev_total + (n - prev_depth) * self.prices[i]
+
+    def marginal_price(self, n):
+        '''Price of the `n`th item, or `None` if fewer than `n` are listed.'''
+        if n <= 0 or n > self.max_quantity():
+            return None
+        return self.prices[bisect_left(self.depth, n)]
+
+class OrderBook:
+    def __init__(self, buys, sells):
+        '''Build an order book from the `buys` and `sells` lists of a
+        `/v2/commerce/listings` entry.'''
+        self.buys = _Side(sorted(((l['unit_price'], l['quantity']) for l in buys),
+            reverse=True))
+        self.sells = _Side(sorted((l['unit_price'], l['quantity']) for l in sells))
+
+    @classmethod
+    def from_listings(cls, listings):
+        return cls(listings['buys'], listings['sells'])
+
+    def cost_to_buy(self, n):
+        '''Total cost to instantly buy `n` items from the cheapest sell
+        listings, or `None` if fewer than `n` are for sale.'''
+        return self.sells.total_price(n)
+
+    def proceeds_from_selling(self, n):
+        '''Total (pre-tax) proceeds from instantly selling `n` items into the
+        highest buy orders, or `None` if fewer than `n` are wanted.'''
+        return self.buys.total_price(n)
+
+    def marginal_buy_price(self, n):
+        return self.sells.marginal_price(n)
+
+    def marginal_sell_price(self, n):
+        return self.buys.marginal_price(n)
+
+    def buy_levels(self):
+        '''List of `(unit_price, quantity)` for each price level that can be
+        bought from, cheapest first.'''
+        sells = self.sells
+        prev = 0
+        levels = []
+        for price, depth in zip(sells.prices, sells.depth):
+            levels.append((price, depth - prev))
+            prev = depth
+        return levels
+
+    def buy_premium(self, n):
+        '''Amount by which the `n`th item bought instantly costs more than the
+        lowest listed sell price, the marginal counterpart of `buy_slippage`.
+        Items beyond the depth of the book are assumed to cost as much as the
+        most expensive listing.  Returns `None` if nothing is for sale.'''
+        sells = self.sells
+        best = sells.best_price()
+        if best is None or n <= 0:
+            return None
+        return sells.prices[bisect_left(sells.depth, min(n, sells.max_quantity()))] - best
+
+    def buy_slippage(self, n):
+        '''Average amount per item, above the lowest listed sell price, that it
+        costs to instantly buy `n` items.  Items beyond the depth of the book
+        are assumed to cost as much as the most expensive listing.  Returns
+        `None` if nothing is for sale.'''
+        sells = self.sells
+        best = sells.best_price()
+        if best is None or n <= 0:
+            return None
+        avail = min(n, sells.max_quantity())
+        total = sells.total_price(avail) + (n - avail) * sells.prices[-1]
+        return total / n - best
@@ -0,0 +1,265 @@
+'''Local time-series store of trading post prices.  When enabled (set
+`GW2_PRICE_HISTORY=1`), every price or listings fetch made through
+`gw2.trading_post` is appended here, so trend and velocity analyses can run on
+our own data instead of scraping gw2bltc.
+
+New samples go into an append-only log of fixed-width records.  Once the log
+is large enough, the writer that filled it calls `compact`, which folds the
+log into a columnar store: all samples sorted by item and time, with each
+column delta-encoded per item (the first sample of each item holds absolute
+values) and compressed.  `query` decodes a single item's slice with a
+cumulative sum, and never modifies the store.
+
+Writers and readers hold a shared lock on `LOCK_FILE`, and `compact` holds it
+exclusively, so no samples are appended or read while the log is being folded
+into the store.'''
+
+import contextlib
+import fcntl
+import os
+import time
+
+import numpy as np
+
+from gw2.constants import STORAGE_DIR
+
+ENABLED = bool(int(os.environ.get('GW2_PRICE_HISTORY') or 0))
+
+HISTORY_DIR = os.path.join(STORAGE_DIR, 'price_history')
+LOG_FILE = os.path.join(HISTORY_DIR, 'log.bin')
+CHUNKS_FILE = os.path.join(HISTORY_DIR, 'chunks.npz')
+LOCK_FILE = os.path.join(HISTORY_DIR, 'lock')
+
+# Writers compact automatically once the log holds this many records.
+COMPACT_THRESHOLD = 200000
+
+# Length of the gw2bltc chart series, in seconds.  `covering_chart_rows` only
+# stands in for it if local history goes back at least this far.
+CHART_WINDOW = 7 * 24 * 3600
+
+COLUMNS = ('timestamp', 'buy', 'sell', 'supply', 'demand')
+
+RECORD_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('timestamp', '<i8'),
+    ('buy', '<i4'),
+    ('sell', '<i4'),
+    ('supply', '<i4'),
+    ('demand', '<i4'),
+])
+
+@contextlib.contextmanager
+def _lock(mode):
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    with open(LOCK_FILE, 'a') as f:
+        fcntl.flock(f, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _append(records):
+    if len(records) == 0:
+        return
+    with _lock(fcntl.LOCK_SH):
+        with open(LOG_FILE, 'ab') as f:
+            records.tofile(f)
+            size = f.tell()
+    if size >= COMPACT_THRESHOLD * RECORD_DTYPE.itemsize:
+        compact(COMPACT_THRESHOLD)
+
+def record_prices(entries, timestamp=None):
+    '''Record a batch of price objects from `/v2/commerce/prices`.'''
+    if timestamp is None:
+        timestamp = time.time()
+    entries = [x for x in entries if x is not None]
+    records = np.zeros(len(entries), dtype=RECORD_DTYPE)
+    for i, x in enumerate(entries):
+        records[i] = (
+                x['id'],
+                int(timestamp),
+                x['buys'].get('unit_price', 0),
+                x['sells'].get('unit_price', 0),
+                x['sells'].get('quantity', 0),
+                x['buys'].get('quantity', 0),
+                )
+    _append(records)
+
+def record_listings(entries, timestamp=None):
+    '''Record a batch of order books from `/v2/commerce/listings`.  Each book
+    is reduced to the best prices and total quantities on each side.'''
+    if timestamp is None:
+        timestamp = time.time()
+    entries = [x for x in entries if x is not None]
+    records = np.zeros(len(entries), dtype=RECORD_DTYPE)
+    for i, x in enumerate(entries):
+        buys = x['buys']
+        sells = x['sells']
+        records[i] = (
+                x['id'],
+                int(timestamp),
+                max((l['unit_price'] for l in buys), default=0),
+                min((l['unit_price'] for l in sells), default=0),
+                sum(l['quantity'] for l in sells),
+                sum(l['quantity'] for l in buys),
+                )
+    _append(records)
+
+
+def _read_log():
+    if not os.path.exists(LOG_FILE):
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    # Ignore a partial trailing record, in case a writer was interrupted.
+    count = os.path.getsize(LOG_FILE) // RECORD_DTYPE.itemsize
+    return np.fromfile(LOG_FILE, dtype=RECORD_DTYPE, count=count)
+
+class _Chunks:
+    def __init__(self, ids, offsets, columns):
+        # Sorted array of item IDs.  Samples for `ids[i]` are stored at
+        # `offsets[i] : offsets[i + 1]` in each column.
+        self.ids = ids
+        self.offsets = offsets
+        # Dict mapping each name in `COLUMNS` to its delta-encoded array.
+        self.columns = columns
+
+    def slice(self, item_id):
+        i = np.searchsorted(self.ids, item_id)
+        if i == len(self.ids) or self.ids[i] != item_id:
+            return None
+        return self.offsets[i], self.offsets[i + 1]
+
+_CHUNKS = None
+_CHUNKS_MTIME = None
+def _get_chunks():
+    global _CHUNKS, _CHUNKS_MTIME
+    try:
+        mtime = os.stat(CHUNKS_FILE).st_mtime
+    except OSError:
+        return None
+    if _CHUNKS is None or mtime != _CHUNKS_MTIME:
+        with np.load(CHUNKS_FILE) as f:
+            _CHUNKS = _Chunks(f['ids'], f['offsets'],
+                    {name: f[name] for name in COLUMNS})
+        _CHUNKS_MTIME = mtime
+    return _CHUNKS
+
+def _encode(records):
+    '''Sort `records` by item and time and build a `_Chunks` from them.'''
+    order = np.lexsort((records['timestamp'], records['id']))
+    records = records[order]
+    ids, starts = np.unique(records['id'], return_index=True)
+    offsets = np.append(starts, len(records)).astype(np.int64)
+    columns = {}
+    for name in COLUMNS:
+        values = records[name].astype(np.int64)
+        deltas = np.diff(values, prepend=0)
+        deltas[starts] = values[starts]
+        columns[name] = deltas
+    return _Chunks(ids, offsets, columns)
+
+def _decode(chunks):
+    '''Expand `chunks` back into an array of `RECORD_DTYPE`.'''
+    counts = np.diff(chunks.offsets)
+    starts = chunks.offsets[:-1]
+    out = np.zeros(int(chunks.offsets[-1]), dtype=RECORD_DTYPE)
+    out['id'] = np.repeat(chunks.ids, counts)
+    for name in COLUMNS:
+        total = np.cumsum(chunks.columns[name])
+        # Running total just before the start of each item's slice.
+        before = np.concatenate(([0], total))[starts]
+        out[name] = total - np.repeat(before, counts)
+    return out
+
+def compact(min_records=1):
+    '''Fold the log into the columnar store and truncate the log, if it holds
+    at least `min_records` records.'''
+    with _lock(fcntl.LOCK_EX):
+        # Another writer may have compacted while we waited for the lock.
+        log = _read_log()
+        if len(log) < max(min_records, 1):
+            return
+        chunks = _get_chunks()
+        if chunks is not None:
+            records = np.concatenate((_decode(chunks), log))
+        else:
+            records = log
+        chunks = _encode(records)
+
+        with open(CHUNKS_FILE + '.new', 'wb') as f:
+            np.savez_compressed(f, ids=chunks.ids, offsets=chunks.offsets,
+                    **chunks.columns)
+        os.replace(CHUNKS_FILE + '.new', CHUNKS_FILE)
+        os.remove(LOG_FILE)
+
+
+def query(item_id, start=None, end=None):
+    '''Return all samples for `item_id` with `start <= timestamp < end`, in
+    chronological order, as a structured array with the fields in `COLUMNS`.
+    Either bound may be `None`.'''
+    if not os.path.exists(HISTORY_DIR):
+        return np.zeros(0, dtype=RECORD_DTYPE)[list(COLUMNS)]
+    with _lock(fcntl.LOCK_SH):
+        log = _read_log()
+        chunks = _get_chunks()
+
+    parts = []
+    if chunks is not None:
+        bounds = chunks.slice(item_id)
+        if bounds is not None:
+            s, e = bounds
+            part = np.zeros(e - s, dtype=RECORD_DTYPE)
+            part['id'] = item_id
+            for name in COLUMNS:
+                part[name] = np.cumsum(chunks.columns[name][s:e])
+            parts.append(part)
+    parts.append(log[log['id'] == item_id])
+
+    samples = np.concatenate(parts)
+    samples = samples[np.argsort(samples['timestamp'], kind='stable')]
+    if start is not None:
+        samples = samples[samples['timestamp'] >= start]
+    if end is not None:
+        samples = samples[samples['timestamp'] < end]
+    return samples[list(COLUMNS)]
+
+def chart_rows(item_id, start=None, end=None):
+    '''Return samples for `item_id` in the same format as gw2bltc chart data:
+    `[timestamp, sell, buy, supply, demand, sold, offers, bought, bids]`.  The
+    last four are estimated from changes in supply and demand between
+    consecutive samples.'''
+    return _chart_rows(query(item_id, start, end))
+
+def covering_chart_rows(item_id, window=CHART_WINDOW, now=None):
+    '''Return `chart_rows` for the last `window` seconds, or `None` if the
+    local samples for `item_id` don't go back that far.  Statistics such as
+    weekly volume and trend would be skewed if computed from a partial
+    window, so callers should fall back to gw2bltc in that case.'''
+    if now is None:
+        now = time.time()
+    start = now - window
+    samples = query(item_id)
+    if len(samples) == 0 or samples['timestamp'][0] > start:
+        return None
+    samples = samples[samples['timestamp'] >= start]
+    if len(samples) == 0:
+        # Recording stopped more than `window` ago.
+        return None
+    return _chart_rows(samples)
+
+def _chart_rows(samples):
+    supply = samples['supply'].astype(np.int64)
+    demand = samples['demand'].astype(np.int64)
+    d_supply = np.diff(supply, prepend=supply[:1])
+    d_demand = np.diff(demand, prepend=demand[:1])
+    columns = (
+            samples['timestamp'],
+            samples['sell'],
+            samples['buy'],
+            supply,
+            demand,
+            np.maximum(-d_supply, 0),
+            np.maximum(d_supply, 0),
+            np.maximum(-d_demand, 0),
+            np.maximum(d_demand, 0),
+            )
+    return np.stack(columns, axis=1).tolist()
@@ -0,0 +1,149 @@
+'''Immutable, versioned snapshots of `/v2/commerce/prices` for every tradable
+item.  Snapshots are written by `price_sync.py` and read (memory-mapped,
+read-only) by `gw2.trading_post.get_prices_multi`, so interactive tools can
+use recent prices without waiting on the API.'''
+
+import json
+import os
+import time
+
+import numpy as np
+
+from gw2.constants import STORAGE_DIR
+
+SNAPSHOT_DIR = os.path.join(STORAGE_DIR, 'price_snapshot')
+CURRENT_FILE = os.path.join(SNAPSHOT_DIR, 'current.json')
+
+# Number of old snapshot files to keep around, so a reader that loaded an
+# older version doesn't have the file deleted out from under it.
+KEEP_VERSIONS = 3
+
+DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('buy', '<i4'),
+    ('sell', '<i4'),
+    ('buy_quantity', '<i4'),
+    ('sell_quantity', '<i4'),
+])
+
+def _snapshot_path(version):
+    return os.path.join(SNAPSHOT_DIR, 'prices-%d.npy' % version)
+
+class Snapshot:
+    def __init__(self, version, timestamp, arr):
+        self.version = version
+        # Time at which the sync that produced this snapshot finished.  The
+        # prices were fetched during the sync, so they can be up to its
+        # duration (a few seconds) older.  `get_prices_multi` compares this
+        # against its max age.
+        self.timestamp = timestamp
+        # Structured array with dtype `DTYPE`, sorted by `id`.
+        self.arr = arr
+
+    def __len__(self):
+        return len(self.arr)
+
+    def _find(self, item_id):
+        ids = self.arr['id']
+        i = np.searchsorted(ids, item_id)
+        if i < len(ids) and ids[i] == item_id:
+            return i
+        return None
+
+    def contains(self, item_id):
+        return self._find(item_id) is not None
+
+    def get(self, item_id):
+        '''Return the prices for `item_id` in the same format as the
+        `/v2/commerce/prices` API, or `None` if the item isn't tradable.'''
+        i = self._find(item_id)
+        if i is None:
+            return None
+        row = self.arr[i]
+        return {
+                'id': int(row['id']),
+                'buys': {
+                    'quantity': int(row['buy_quantity']),
+                    'unit_price': int(row['buy']),
+                    },
+                'sells': {
+                    'quantity': int(row['sell_quantity']),
+                    'unit_price': int(row['sell']),
+                    },
+                }
+
+def write(entries, timestamp=None):
+    '''Publish a new snapshot built from `entries`, a list of price objects as
+    returned by `/v2/commerce/prices`.  Returns the new version number.'''
+    if timestamp is None:
+        timestamp = time.time()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    arr = np.zeros(len(entries), dtype=DTYPE)
+    for i, x in enumerate(entries):
+        arr[i] = (
+                x['id'],
+                x['buys'].get('unit_price', 0),
+                x['sells'].get('unit_price', 0),
+                x['buys'].get('quantity', 0),
+                x['sells'].get('quantity', 0),
+                )
+    arr.sort(order='id')
+
+    old = _read_current()
+    version = old['version'] + 1 if old is not None else 1
+
+    path = _snapshot_path(version)
+    with open(path + '.new', 'wb') as f:
+        np.save(f, arr)
+    os.replace(path + '.new', path)
+
+    with open(CURRENT_FILE + '.new', 'w') as f:
+        json.dump({'version': version, 'timestamp': timestamp}, f)
+    os.replace(CURRENT_FILE + '.new', CURRENT_FILE)
+
+    for old_version in range(version - KEEP_VERSIONS, 0, -1):
+        old_path = _snapshot_path(old_version)
+        if not os.path.exists(old_path):
+            break
+        try:
+            os.remove(old_path)
+        except OSError:
+            # Probably still mapped by a reader on a platform that forbids
+            # removing open files.  We'll try again next time.
+            pass
+
+    return version
+
+def _read_current():
+    try:
+        with open(CURRENT_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+_CURRENT = None
+_CURRENT_MTIME = None
+def current():
+    '''Return the most recently published `Snapshot`, or `None` if the sync
+    process has never run.  The check for a newer version is just a `stat`, so
+    this is cheap to call repeatedly.'''
+    global _CURRENT, _CURRENT_MTIME
+    try:
+        mtime = os.stat(CURRENT_FILE).st_mtime
+    except OSError:
+        return None
+    if _CURRENT is not None and mtime == _CURRENT_MTIME:
+        return _CURRENT
+
+    info = _read_current()
+    if info is None:
+        return _CURRENT
+    if _CURRENT is None or _CURRENT.version != info['version']:
+        try:
+            arr = np.load(_snapshot_path(info['version']), mmap_mode='r')
+        except OSError:
+            return _CURRENT
+        _CURRENT = Snapshot(info['version'], info['timestamp'], arr)
+    _CURRENT_MTIME = mtime
+    return _CURRENT
@@ -0,0 +1,180 @@
+'''Lightweight phase timing for the command-line tools.  Code marks phases with
+`with phase('name'):` and bumps counters in `COUNTERS`.  When profiling is
+enabled (`BOOKKEEPER_PROFILE=1`, or `--profile` on the command line),
+`report` prints wall and CPU time, counter values, and peak RSS for each
+phase.  If `OUTPUT_PATH` is set, the whole run is also profiled: paths ending
+in `.prof` get `cProfile` stats, and anything else gets sampled stacks in the
+collapsed format used by `flamegraph.pl` and speedscope.'''
+
+from collections import defaultdict
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENABLED = bool(int(os.environ.get('BOOKKEEPER_PROFILE') or 0))
+OUTPUT_PATH = os.environ.get('BOOKKEEPER_PROFILE_OUT') or None
+
+# Event counts, such as calls to a function and how many of them were cache
+# hits.  Callers should check `ENABLED` before updating these.
+COUNTERS = defaultdict(int)
+
+# Seconds between stack samples for collapsed-stack output.
+SAMPLE_INTERVAL = 0.001
+
+class _PhaseStats:
+    def __init__(self, name, depth):
+        self.name = name
+        self.depth = depth
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.counters = defaultdict(int)
+        self.peak_rss = None
+
+# Stats for each phase, keyed by the names of the enclosing phases and the
+# phase itself, in the order the phases were first entered.
+_PHASES = {}
+_stack = []
+
+def _peak_rss():
+    '''Peak resident set size of this process so far, in bytes.'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _stack.append(self.name)
+        key = tuple(_stack)
+        stats = _PHASES.get(key)
+        if stats is None:
+            stats = _PHASES[key] = _PhaseStats(self.name, len(_stack) - 1)
+        self.stats = stats
+        self.counters = dict(COUNTERS)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        stats = self.stats
+        stats.wall += time.perf_counter() - self.wall
+        stats.cpu += time.process_time() - self.cpu
+        stats.calls += 1
+        for k, v in COUNTERS.items():
+            delta = v - self.counters.get(k, 0)
+            if delta != 0:
+                stats.counters[k] += delta
+        stats.peak_rss = _peak_rss()
+        _stack.pop()
+        return False
+
+_NO_PHASE = contextlib.nullcontext()
+
+def phase(name):
+    '''Context manager that times the enclosed code as phase `name`.  Phases
+    can be nested and entered repeatedly.  Repeated entries of a phase within
+    the same enclosing phases are added up.'''
+    if not ENABLED:
+        return _NO_PHASE
+    return _Phase(name)
+
+
+class _StackSampler:
+    '''Samples the stack of one thread at a fixed interval and counts each
+    distinct stack.'''
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write('%s %d\n' % (stack, count))
+
+_profiler = None
+_sampler = None
+
+def start():
+    '''Start profiling the whole run if `OUTPUT_PATH` is set.'''
+    global _profiler, _sampler
+    if not ENABLED or OUTPUT_PATH is None:
+        return
+    if OUTPUT_PATH.endswith('.prof'):
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    else:
+        _sampler = _StackSampler(threading.get_ident(), SAMPLE_INTERVAL)
+        _sampler.start()
+
+def _format_counter(counters, name):
+    calls = counters.get(name, 0)
+    if calls == 0:
+        return ''
+    misses = counters.get(name + '_miss', 0)
+    return '%d (%.0f%% hit)' % (calls, 100 * (calls - misses) / calls)
+
+def report(file=sys.stderr):
+    '''Stop profiling, write `OUTPUT_PATH`, and print the phase table.'''
+    global _profiler, _sampler
+    if not ENABLED:
+        return
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(OUTPUT_PATH)
+        _profiler = None
+        print('wrote cProfile stats to %s' % OUTPUT_PATH, file=file)
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler.write(OUTPUT_PATH)
+        _sampler = None
+        print('wrote collapsed stacks to %s' % OUTPUT_PATH, file=file)
+
+    print('%-32s %5s %9s %9s %22s %22s %9s' % ('Phase', 'Calls', 'Wall (s)',
+        'CPU (s)', 'optimal_strategy', 'optimal_cost', 'Peak RSS'), file=file)
+    for stats in _PHASES.values():
+        rss = '%7.1fMB' % (stats.peak_rss / 2**20) if stats.peak_rss is not None else ''
+        print('%-32s %5d %9.3f %9.3f %22s %22s %9s' % (
+            '  ' * stats.depth + stats.name, stats.calls, stats.wall, stats.cpu,
+            _format_counter(stats.counters, 'optimal_strategy'),
+            _format_counter(stats.counters, 'optimal_cost'),
+            rss), file=file)
+
+    other = sorted(k for k in COUNTERS
+            if not k.endswith('_miss') and k not in ('optimal_strategy', 'optimal_cost'))
+    for k in other:
+        print('%s: %s' % (k, _format_counter(COUNTERS, k)), file=file)
@@ -0,0 +1,87 @@
+'''Machine-readable copies of the tables printed by the command-line tools.
+`open_writer` returns a writer that takes rows in chunks, as lists of tuples,
+and writes them as JSON Lines, CSV, or an Arrow IPC file.  Arrow output needs
+`pyarrow` installed.'''
+
+import csv
+import json
+import os
+import re
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('jsonl', 'csv', 'arrow')
+
+# Value types of table fields, and the Arrow type used for each.
+_ARROW_TYPES = {
+    'int': 'int64',
+    'float': 'float64',
+    'str': 'string',
+}
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError('unknown table format %r (expected one of %s)' %
+                (fmt, ', '.join(FORMATS)))
+    if fmt == 'arrow' and pyarrow is None:
+        raise RuntimeError('arrow table output requires pyarrow')
+
+def table_path(out_dir, name, fmt):
+    '''Return the path of the output file for the table titled `name`.'''
+    slug = re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+    return os.path.join(out_dir, '%s.%s' % (slug, fmt))
+
+class _JsonLinesWriter:
+    def __init__(self, path, fields):
+        self.names = [name for name, _ in fields]
+        self.f = open(path, 'w')
+
+    def write(self, rows):
+        self.f.writelines(json.dumps(dict(zip(self.names, row))) + '\n' for row in rows)
+
+    def close(self):
+        self.f.close()
+
+class _CsvWriter:
+    def __init__(self, path, fields):
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow([name for name, _ in fields])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+class _ArrowWriter:
+    def __init__(self, path, fields):
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, _ARROW_TYPES[t])())
+            for name, t in fields])
+        self.writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(col, type=f.type) for col, f in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+_WRITERS = {
+    'jsonl': _JsonLinesWriter,
+    'csv': _CsvWriter,
+    'arrow': _ArrowWriter,
+}
+
+def open_writer(path, fmt, fields):
+    '''Open a writer for a table with the given `fields`, a list of `(name,
+    type)` pairs where `type` is `'int'`, `'float'`, or `'str'`.'''
+    check_format(fmt)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    return _WRITERS[fmt](path, fields)
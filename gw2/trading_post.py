@@ -1,14 +1,19 @@
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+import concurrent.futures
+import datetime
 import functools
 import json
+import math
 import os
 import requests
 import time
 
 import gw2.api
-from gw2.api import fetch, fetch_paginated, fetch_with_retries
+from gw2.api import fetch, fetch_page, fetch_paginated, fetch_with_retries
 from gw2.constants import STORAGE_DIR
 import gw2.build
+import gw2.price_history
+import gw2.price_snapshot
 from gw2.util import DataStorage
 
 TRADING_POST_DIR = os.path.join(STORAGE_DIR, 'trading_post')
@@ -17,168 +22,246 @@ DATA_FILE = os.path.join(TRADING_POST_DIR, 'data.json')
 LISTINGS_INDEX_FILE = os.path.join(TRADING_POST_DIR, 'listings_index.json')
 LISTINGS_DATA_FILE = os.path.join(TRADING_POST_DIR, 'listings_data.json')
 
-_DATA = None
-def _get_data():
-    global _DATA
-    try:
-        mtime = os.stat(DATA_FILE).st_mtime
-        refresh = mtime < time.time() - (60 * 30)
-    except OSError:
-        refresh = True
+# Default maximum age (in seconds) of cached prices and listings.  Callers
+# that need fresher data, such as `bookkeeper status`, can pass a smaller
+# `max_age`.
+DEFAULT_MAX_AGE = 60 * 30
+
+# Rewrite the cache files once they contain this many superseded records per
+# live entry.
+COMPACT_RATIO = 4
 
+def _open_storage(index_file, data_file):
+    os.makedirs(TRADING_POST_DIR, exist_ok=True)
+    data = DataStorage(index_file, data_file, allow_replace=True)
+    if data.num_records > COMPACT_RATIO * max(len(data.index), 1000):
+        data.compact()
+    return data
+
+def _unwrap(entry):
+    '''Split a cache entry into `(fetched_at, value)`.  Entries written by
+    older versions of this module have no timestamp, so they are treated as
+    infinitely old.'''
+    if isinstance(entry, list):
+        return entry[0], entry[1]
+    return 0, entry
+
+def _is_fresh(data, item_id, max_age, now):
+    if not data.contains(item_id):
+        return False
     if gw2.api.OFFLINE:
-        refresh = False
+        return True
+    fetched_at, _ = _unwrap(data.get(item_id))
+    return now - fetched_at <= max_age
 
-    if refresh:
-        if os.path.exists(INDEX_FILE):
-            os.remove(INDEX_FILE)
-        if os.path.exists(DATA_FILE):
-            os.remove(DATA_FILE)
+def _store(data, item_id, value, now):
+    data.replace(item_id, [now, value])
+
+def _fetch_chunks(path, query_ids):
+    '''Fetch `query_ids` from `path` (`/v2/commerce/prices` or `listings`) in
+    chunks of 100.  Returns a list of all entries returned by the API.'''
+    out = []
+    N = 100
+    for i in range(0, len(query_ids), N):
+        chunk = query_ids[i : i + N]
+        try:
+            out.extend(fetch_with_retries(path + '?ids=' + ','.join(str(x) for x in chunk)))
+        except requests.HTTPError as e:
+            if e.response.status_code == 404:
+                pass
+            else:
+                raise
+    return out
 
-    if _DATA is None or refresh:
-        os.makedirs(TRADING_POST_DIR, exist_ok=True)
-        _DATA = DataStorage(INDEX_FILE, DATA_FILE)
+_DATA = None
+def _get_data():
+    global _DATA
+    if _DATA is None:
+        _DATA = _open_storage(INDEX_FILE, DATA_FILE)
     return _DATA
 
-@functools.lru_cache(256)
-def get_prices(item_id):
-    data = _get_data()
-    if not data.contains(item_id):
-        item = fetch_with_retries('/v2/commerce/prices?id=%d' % item_id)
-        data.add(item_id, item)
-        return item
-    else:
-        return data.get(item_id)
+def get_prices(item_id, max_age=DEFAULT_MAX_AGE):
+    return get_prices_multi([item_id], max_age=max_age)[0]
 
-def get_prices_multi(item_ids):
+def get_prices_multi(item_ids, max_age=DEFAULT_MAX_AGE):
+    '''Get current prices for each item in `item_ids`.  Prices come from the
+    snapshot published by `price_sync.py` if it's at most `max_age` seconds
+    old; otherwise, cached entries are used if they are fresh enough, and all
+    other items are refetched in batches.  Returns a list with one entry per
+    item, which is `None` for items not available on the trading post.'''
     data = _get_data()
-    
+    now = time.time()
+
+    snapshot = gw2.price_snapshot.current()
+    if snapshot is not None and not gw2.api.OFFLINE \
+            and now - snapshot.timestamp > max_age:
+        snapshot = None
+
     dct = {}
     query_ids = []
     for item_id in item_ids:
-        if data.contains(item_id):
-            dct[item_id] = data.get(item_id)
+        if snapshot is not None and not data.is_augmented(item_id):
+            # The snapshot covers every tradable item, so anything missing
+            # from it is not available on the trading post.
+            dct[item_id] = snapshot.get(item_id)
+            continue
+        if _is_fresh(data, item_id, max_age, now):
+            dct[item_id] = _unwrap(data.get(item_id))[1]
             continue
         item = gw2.items.get(item_id)
         if any(f in ('AccountBound', 'SoulbindOnAcquire') for f in item['flags']):
             continue
         query_ids.append(item_id)
     query_ids = sorted(set(query_ids))
-    
-    N = 100
-    for i in range(0, len(query_ids), N):
-        chunk = query_ids[i : i + N]
-        items = []
-        try:
-            items = fetch_with_retries('/v2/commerce/prices?ids=' + ','.join(str(x) for x in chunk))
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                pass
-            else:
-                raise
-        for item in items:
-            data.add(item['id'], item)
-            dct[item['id']] = item
+
+    fetched = _fetch_chunks('/v2/commerce/prices', query_ids)
+    if gw2.price_history.ENABLED:
+        gw2.price_history.record_prices(fetched, now)
+    for item in fetched:
+        _store(data, item['id'], item, now)
+        dct[item['id']] = item
 
     out = []
     for item_id in item_ids:
         if item_id not in dct:
             # Record that this item was not available from the API.
-            data.add(item_id, None)
-        out.append(dct.get(item_id))
+            _store(data, item_id, None, now)
+            dct[item_id] = None
+        out.append(dct[item_id])
     return out
 
 
 _LISTINGS_DATA = None
 def _get_listings_data():
     global _LISTINGS_DATA
-    try:
-        mtime = os.stat(LISTINGS_DATA_FILE).st_mtime
-        refresh = mtime < time.time() - (60 * 30)
-    except OSError:
-        refresh = True
-
-    if gw2.api.OFFLINE:
-        refresh = False
-
-    if refresh:
-        if os.path.exists(LISTINGS_INDEX_FILE):
-            os.remove(LISTINGS_INDEX_FILE)
-        if os.path.exists(LISTINGS_DATA_FILE):
-            os.remove(LISTINGS_DATA_FILE)
-
-    if _LISTINGS_DATA is None or refresh:
-        os.makedirs(TRADING_POST_DIR, exist_ok=True)
-        _LISTINGS_DATA = DataStorage(LISTINGS_INDEX_FILE, LISTINGS_DATA_FILE)
+    if _LISTINGS_DATA is None:
+        _LISTINGS_DATA = _open_storage(LISTINGS_INDEX_FILE, LISTINGS_DATA_FILE)
     return _LISTINGS_DATA
 
-@functools.lru_cache(256)
-def get_listings(item_id):
-    data = _get_listings_data()
-    if not data.contains(item_id):
-        item = fetch_with_retries('/v2/commerce/listings?id=%d' % item_id)
-        data.add(item_id, item)
-        return item
-    else:
-        return data.get(item_id)
+def get_listings(item_id, max_age=DEFAULT_MAX_AGE):
+    return get_listings_multi([item_id], max_age=max_age)[0]
 
-def get_listings_multi(item_ids):
+def get_listings_multi(item_ids, max_age=DEFAULT_MAX_AGE):
+    '''Like `get_prices_multi`, but fetches the full order book for each
+    item from `/v2/commerce/listings`.'''
     data = _get_listings_data()
+    now = time.time()
 
     dct = {}
     query_ids = []
     for item_id in item_ids:
-        if data.contains(item_id):
-            dct[item_id] = data.get(item_id)
+        if _is_fresh(data, item_id, max_age, now):
+            dct[item_id] = _unwrap(data.get(item_id))[1]
         else:
             query_ids.append(item_id)
     query_ids = sorted(set(query_ids))
 
-    N = 100
-    for i in range(0, len(query_ids), N):
-        chunk = query_ids[i : i + N]
-        items = []
-        try:
-            items = fetch_with_retries('/v2/commerce/listings?ids=' + ','.join(str(x) for x in chunk))
-        except requests.HTTPError as e:
-            if e.response.status_code == 404:
-                pass
-            else:
-                raise
-        for item in items:
-            data.add(item['id'], item)
-            dct[item['id']] = item
+    fetched = _fetch_chunks('/v2/commerce/listings', query_ids)
+    if gw2.price_history.ENABLED:
+        gw2.price_history.record_listings(fetched, now)
+    for item in fetched:
+        _store(data, item['id'], item, now)
+        dct[item['id']] = item
 
     out = []
     for item_id in item_ids:
         if item_id not in dct:
             # Record that this item was not available from the API.
-            data.add(item_id, None)
-        out.append(dct.get(item_id))
+            _store(data, item_id, None, now)
+            dct[item_id] = None
+        out.append(dct[item_id])
     return out
 
 
+# Per-item summary of the transaction history.  `value` is the total price of
+# all `quantity` items, and `first` and `last` are the `purchased` timestamps
+# of the oldest and newest transactions for the item.
+ItemHistory = namedtuple('ItemHistory', ('quantity', 'value', 'first', 'last'))
+
+def avg_price(h):
+    '''Quantity-weighted average unit price of an `ItemHistory`.'''
+    return h.value / h.quantity if h.quantity else None
+
+# Number of history pages to request at once when catching up on a large
+# backlog of transactions.
+HISTORY_PARALLEL_PAGES = 4
+HISTORY_PAGE_SIZE = 200
+
+def _parse_timestamp(s):
+    return datetime.datetime.fromisoformat(s).timestamp()
+
+def _summarize(summary, tx):
+    t = _parse_timestamp(tx['purchased'])
+    h = summary.get(tx['item_id'])
+    if h is None:
+        h = ItemHistory(0, 0, t, t)
+    summary[tx['item_id']] = ItemHistory(
+            h.quantity + tx['quantity'],
+            h.value + tx['quantity'] * tx['price'],
+            min(h.first, t),
+            max(h.last, t))
+
+def _load_summary(path):
+    if not os.path.exists(path):
+        return None, None
+    with open(path) as f:
+        j = json.load(f)
+    summary = {item_id: ItemHistory(*rest) for item_id, *rest in j['items']}
+    return summary, j['high_water']
+
+def _dump_summary(path, summary, high_water):
+    with open(path + '.new', 'w') as f:
+        json.dump({
+            'high_water': high_water,
+            'items': [(item_id,) + tuple(h) for item_id, h in summary.items()],
+            }, f)
+    os.replace(path + '.new', path)
+
+def _iter_history_pages(path, high_water):
+    '''Yield pages of transaction history, newest first.  The first page is
+    fetched on its own.  If it's entirely newer than `high_water` (the
+    `purchased` timestamp of the newest transaction already stored), there is
+    a large gap to fill, so later pages are fetched several at a time.'''
+    page, num_pages = fetch_page(path, 0, HISTORY_PAGE_SIZE)
+    yield page
+
+    gap = len(page) > 0 and (high_water is None or
+            _parse_timestamp(page[-1]['purchased']) > high_water)
+    batch = HISTORY_PARALLEL_PAGES if gap else 1
+
+    next_page = 1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=batch) as executor:
+        while next_page < num_pages:
+            pages = range(next_page, min(next_page + batch, num_pages))
+            for page, num_pages in executor.map(
+                    lambda i: fetch_page(path, i, HISTORY_PAGE_SIZE), pages):
+                yield page
+            next_page = pages[-1] + 1
+
 def _update_history(kind):
     '''Update the transaction history for `kind`, which must be either `'buys'`
     or `'sells'`.  Returns the `DataStorage` object containing all the
-    transactions and a dict mapping item IDs to total quantity bought/sold.'''
+    transactions and a dict mapping item IDs to `ItemHistory` summaries.'''
 
     os.makedirs(TRADING_POST_DIR, exist_ok=True)
     index_file = os.path.join(TRADING_POST_DIR, 'history_%s_index.json' % kind)
     data_file = os.path.join(TRADING_POST_DIR, 'history_%s_data.json' % kind)
     data = DataStorage(index_file, data_file)
 
-    totals_file = os.path.join(TRADING_POST_DIR, 'history_%s_totals.json' % kind)
-    if os.path.exists(totals_file):
-        with open(totals_file) as f:
-            totals = defaultdict(int)
-            totals.update(dict(json.load(f)))
-    else:
-        totals = None
+    summary_file = os.path.join(TRADING_POST_DIR, 'history_%s_summary.json' % kind)
+    summary, high_water = _load_summary(summary_file)
+    if summary is None:
+        # First run with this version: summarize everything already stored.
+        summary = {}
+        high_water = None
+        for tx in data.iter():
+            _summarize(summary, tx)
+            high_water = max(high_water or 0, _parse_timestamp(tx['purchased']))
 
-    updated_totals = False
+    updated = False
     new_ids = set()
-    for page in fetch_paginated('/v2/commerce/transactions/history/%s' % kind):
+    path = '/v2/commerce/transactions/history/%s' % kind
+    for page in _iter_history_pages(path, high_water):
         done = False
         for tx in page:
             if data.contains(tx['id']):
@@ -194,34 +277,38 @@ def _update_history(kind):
 
             data.add(tx['id'], tx)
             new_ids.add(tx['id'])
-            if totals is not None:
-                totals[tx['item_id']] += tx['quantity']
-                updated_totals = True
+            _summarize(summary, tx)
+            high_water = max(high_water or 0, _parse_timestamp(tx['purchased']))
+            updated = True
 
         if done:
             break
 
-    if totals is None:
-        totals = defaultdict(int)
-        for tx in data.iter():
-            totals[tx['item_id']] += tx['quantity']
-        updated_totals = True
-
-    if updated_totals:
-        with open(totals_file, 'w') as f:
-            json.dump(list(totals.items()), f)
+    if updated or not os.path.exists(summary_file):
+        _dump_summary(summary_file, summary, high_water)
 
-    return data, totals
+    return data, summary
 
 @functools.lru_cache(2)
 def _get_history(kind):
     return _update_history(kind)
 
+def history_summary(kind):
+    '''Return a dict mapping item IDs to `ItemHistory` for `kind`, which must
+    be either `'buys'` or `'sells'`.'''
+    return _get_history(kind)[1]
+
+@functools.lru_cache(2)
+def _totals(kind):
+    totals = defaultdict(int)
+    totals.update((item_id, h.quantity) for item_id, h in history_summary(kind).items())
+    return totals
+
 def total_bought():
-    return _get_history('buys')[1]
+    return _totals('buys')
 
 def total_sold():
-    return _get_history('sells')[1]
+    return _totals('sells')
 
 
 @functools.lru_cache(2)
@@ -244,6 +331,13 @@ def pending_buys():
 def pending_sells():
     return _fetch_current('sells')
 
+def clear_account_caches():
+    '''Forget the transaction history and current orders loaded so far, so the
+    next call refetches them.'''
+    _get_history.cache_clear()
+    _totals.cache_clear()
+    _fetch_current.cache_clear()
+
 
 def augment(dct):
     prices = {}
@@ -275,7 +369,8 @@ def augment(dct):
                     { 'listings': 1, 'quantity': 1, 'unit_price': entry['sell'] })
         listings[item_id] = listings_entry
 
-    _get_data().augment(prices)
-    _get_listings_data().augment(listings)
+    # Augmented entries never go stale.
+    _get_data().augment({k: [math.inf, v] for k, v in prices.items()})
+    _get_listings_data().augment({k: [math.inf, v] for k, v in listings.items()})
 
 
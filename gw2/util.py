@@ -2,30 +2,59 @@ import functools
 import itertools
 import json
 import os
+import weakref
+
+# All `DataStorage` instances, so their files can be reopened after a fork.
+_OPEN_STORAGES = weakref.WeakSet()
 
 class DataStorage:
-    def __init__(self, index_path, data_path):
+    def __init__(self, index_path, data_path, allow_replace=False):
+        '''Open an append-only key-value store.  If `allow_replace` is set,
+        entries can be overwritten with `replace`; the newest record for each
+        key wins when the index is reloaded.'''
         # Read the existing index
         dct = {}
+        num_records = 0
         if os.path.exists(index_path):
             with open(index_path, 'r') as f:
                 for i, line in enumerate(f):
                     k, v = json.loads(line)
-                    assert k not in dct, 'duplicate key %r on line %d' % (k, i + 1)
+                    assert allow_replace or k not in dct, \
+                            'duplicate key %r on line %d' % (k, i + 1)
                     dct[k] = v
+                    num_records += 1
         self.index = dct
+        # Number of records in the files, including ones that were superseded
+        # by a later `replace`.
+        self.num_records = num_records
+        self.allow_replace = allow_replace
 
+        self.index_path = index_path
+        self.data_path = data_path
         self.index_file = open(index_path, 'a')
         self.data_file = open(data_path, 'a+')
 
         self.augment_dct = None
+        _OPEN_STORAGES.add(self)
+
+    def _reopen(self):
+        # A forked child shares the parent's file descriptors, including the
+        # file offset that `get` seeks, so it needs its own.
+        self.index_file = open(self.index_path, 'a')
+        self.data_file = open(self.data_path, 'a+')
+
+    def _flush(self):
+        self.index_file.flush()
+        self.data_file.flush()
 
     def contains(self, k):
         if self.augment_dct is not None and k in self.augment_dct:
             return True
         return k in self.index
 
-    @functools.lru_cache(256)
+    def is_augmented(self, k):
+        return self.augment_dct is not None and k in self.augment_dct
+
     def get(self, k):
         if self.augment_dct is not None:
             v = self.augment_dct.get(k)
@@ -34,24 +63,90 @@ class DataStorage:
         pos = self.index.get(k)
         if pos is None:
             return None
+        return self._read_record(pos)
+
+    # Records are never modified in place, so caching by position stays valid
+    # across `add` and `replace`, and misses are never cached.  `compact`
+    # moves records, so it clears the cache.
+    @functools.lru_cache(256)
+    def _read_record(self, pos):
         self.data_file.seek(pos)
         return json.loads(self.data_file.readline())
 
+    @staticmethod
+    def clear_cache():
+        DataStorage._read_record.cache_clear()
+
+    def get_multi(self, keys):
+        '''Return a dict mapping each of `keys` to its value, for keys that are
+        present.  Records are read in file order, bypassing the cache used
+        by `get`.'''
+        out = {}
+        positions = []
+        for k in keys:
+            if self.augment_dct is not None and self.augment_dct.get(k) is not None:
+                out[k] = self.augment_dct[k]
+                continue
+            pos = self.index.get(k)
+            if pos is not None:
+                positions.append((pos, k))
+        positions.sort()
+        for pos, k in positions:
+            self.data_file.seek(pos)
+            out[k] = json.loads(self.data_file.readline())
+        return out
+
     def add(self, k, v):
         assert k not in self.index
+        self._append(k, v)
+
+    def replace(self, k, v):
+        '''Set the value for `k`, overwriting any previous value.'''
+        assert self.allow_replace
+        self._append(k, v)
+
+    def _append(self, k, v):
         self.data_file.seek(0, 2)
         pos = self.data_file.tell()
         self.index[k] = pos
         self.data_file.write(json.dumps(v) + '\n')
         self.index_file.write(json.dumps((k, pos)) + '\n')
+        self.num_records += 1
+
+    def compact(self):
+        '''Rewrite the index and data files, dropping records that were
+        superseded by `replace`.'''
+        index_new_path = self.index_path + '.new'
+        data_new_path = self.data_path + '.new'
+        index = {}
+        with open(index_new_path, 'w') as index_f, open(data_new_path, 'w') as data_f:
+            for k, pos in self.index.items():
+                self.data_file.seek(pos)
+                line = self.data_file.readline()
+                index[k] = data_f.tell()
+                data_f.write(line)
+                index_f.write(json.dumps((k, index[k])) + '\n')
+
+        self.index_file.close()
+        self.data_file.close()
+        os.replace(data_new_path, self.data_path)
+        os.replace(index_new_path, self.index_path)
+        self.index_file = open(self.index_path, 'a')
+        self.data_file = open(self.data_path, 'a+')
+
+        self.index = index
+        self.num_records = len(index)
+        DataStorage.clear_cache()
 
     def keys(self):
         if self.augment_dct is not None:
             return itertools.chain(self.index.keys(), self.augment_dct.keys)
         return self.index.keys()
 
-    def iter(self):
-        for pos in self.index.values():
+    def iter(self, start=0):
+        '''Iterate over stored values in insertion order, skipping the first
+        `start` keys.'''
+        for pos in itertools.islice(self.index.values(), start, None):
             if pos is None:
                 continue
             self.data_file.seek(pos)
@@ -66,3 +161,14 @@ class DataStorage:
         else:
             self.augment_dct.update(dct)
 
+def _before_fork():
+    # Flush pending writes so the child can't write them a second time.
+    for storage in list(_OPEN_STORAGES):
+        storage._flush()
+
+def _after_fork_in_child():
+    for storage in list(_OPEN_STORAGES):
+        storage._reopen()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
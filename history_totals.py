@@ -1,73 +1,79 @@
-from collections import defaultdict
+import datetime
 import gw2.api
 import gw2.items
-import gw2.trading_post
-from bookkeeper import format_price, parse_timestamp
+import gw2.ledger
+from bookkeeper import format_price
 
 def main():
     with open('api_key.txt') as f:
         gw2.api.API_KEY = f.read().strip()
     gw2.api.CACHE_DIR = 'cache'
 
-    buys = gw2.trading_post._get_history('buys')[0]
-    total_buy = 0
-    buy_item_counts = defaultdict(int)
-    buy_item_prices = defaultdict(int)
-    oldest_buy = None
-    oldest_buy_str = None
-    for t in buys.iter():
-        total_buy += t['quantity'] * t['price']
-        buy_item_counts[t['item_id']] += t['quantity']
-        buy_item_prices[t['item_id']] += t['quantity'] * t['price']
-        timestamp = parse_timestamp(t['purchased'])
-        if oldest_buy is None or timestamp < oldest_buy:
-            oldest_buy = timestamp
-            oldest_buy_str = t['purchased']
+    buys = gw2.ledger.load('buys')
+    sells = gw2.ledger.load('sells')
+    # Only count sales made since the first recorded purchase.  With no
+    # purchases recorded, count all sales.
+    if len(buys) > 0:
+        oldest = buys.purchased[0]
+        sells = sells.since(oldest)
+    elif len(sells) > 0:
+        oldest = sells.purchased[0]
+    else:
+        oldest = None
 
-    sells = gw2.trading_post._get_history('sells')[0]
-    total_sell = 0
-    sell_item_counts = defaultdict(int)
-    sell_item_prices = defaultdict(int)
-    for t in sells.iter():
-        timestamp = parse_timestamp(t['purchased'])
-        if timestamp < oldest_buy:
-            continue
-        total_sell += t['quantity'] * t['price'] * 0.85
-        sell_item_counts[t['item_id']] += t['quantity']
-        sell_item_prices[t['item_id']] += t['quantity'] * t['price'] * 0.85
+    buy_items, buy_counts, buy_values = buys.totals_by_item()
+    sell_items, sell_counts, sell_values = sells.totals_by_item()
+    sell_values = sell_values * 0.85
+    total_buy = buy_values.sum()
+    total_sell = sell_values.sum()
 
-    def top_n(xs, n=None):
-        s = sorted(xs, key=lambda x: x[1], reverse=True)
+    def top_n(item_ids, xs, n=None):
+        # Descending by value; ties keep their order in `item_ids`.
+        order = (-xs).argsort(kind='stable')
         if n is not None:
-            s = s[:n]
-        return s
+            order = order[:n]
+        return zip(item_ids[order].tolist(), xs[order].tolist())
 
     #N = 10
     N = None
 
     print('\nTop items bought:')
-    for item_id, count in top_n(buy_item_counts.items(), N):
+    for item_id, count in top_n(buy_items, buy_counts, N):
         print('%8d  %s' % (count, gw2.items.name(item_id)))
 
     print('\nTop items bought, by gold spent:')
-    for item_id, price in top_n(buy_item_prices.items(), N):
+    for item_id, price in top_n(buy_items, buy_values, N):
         print('%12s  %s' % (format_price(price), gw2.items.name(item_id)))
 
     print('\nTop items sold:')
-    for item_id, count in top_n(sell_item_counts.items(), N):
+    for item_id, count in top_n(sell_items, sell_counts, N):
         print('%8d  %s' % (count, gw2.items.name(item_id)))
 
     print('\nTop items sold, by gold received:')
-    for item_id, price in top_n(sell_item_prices.items(), N):
+    for item_id, price in top_n(sell_items, sell_values, N):
         print('%12s  %s' % (format_price(price), gw2.items.name(item_id)))
 
-    print('\nTotals since %s:' % oldest_buy_str)
+    if oldest is not None:
+        print('\nTotals since %s:' % datetime.datetime.fromtimestamp(
+            int(oldest), datetime.timezone.utc).isoformat())
+    else:
+        print('\nTotals:')
 
     print('Bought:  %12s' % format_price(total_buy))
     print('Sold:    %12s' % format_price(total_sell))
     profit = total_sell - total_buy
     print('Profit:  %12s' % format_price(profit))
-    print('ROI:     %7.1f%%' % (100 * profit / total_buy))
+    if total_buy > 0:
+        print('ROI:     %7.1f%%' % (100 * profit / total_buy))
+
+    _, matched, cost, revenue = gw2.ledger.fifo_profit(buys, sells)
+    matched_profit = revenue.sum() - cost.sum()
+    print('\nMatched (FIFO) sales of %d items:' % matched.sum())
+    print('Cost:    %12s' % format_price(cost.sum()))
+    print('Revenue: %12s' % format_price(revenue.sum()))
+    print('Profit:  %12s' % format_price(matched_profit))
+    if cost.sum() > 0:
+        print('ROI:     %7.1f%%' % (100 * matched_profit / cost.sum()))
 
 if __name__ == '__main__':
     main()
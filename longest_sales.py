@@ -1,8 +1,7 @@
-from collections import defaultdict
+import datetime
 import gw2.api
 import gw2.items
-import gw2.trading_post
-from bookkeeper import format_price, parse_timestamp
+import gw2.ledger
 
 def format_duration(dur):
     days = dur // 86400
@@ -20,20 +19,19 @@ def main():
         gw2.api.API_KEY = f.read().strip()
     gw2.api.CACHE_DIR = 'cache'
 
-    sells = gw2.trading_post._get_history('sells')[0]
-    sells_by_age = []
-    for t in sells.iter():
-        listing_time = parse_timestamp(t['created'])
-        sale_time = parse_timestamp(t['purchased'])
-        duration = sale_time - listing_time
-        sells_by_age.append((duration, t))
+    sells = gw2.ledger.load('sells')
+    durations = sells.durations()
+    order = durations.argsort(kind='stable')
 
-    sells_by_age.sort(key=lambda x: x[0])
+    def fmt_time(t):
+        return datetime.datetime.fromtimestamp(
+                int(t), datetime.timezone.utc).isoformat()
 
-    for dur, t in sells_by_age:
+    for i in order:
         print('%10s  %3d %-40.40s  %s  %s' % (
-            format_duration(dur), t['quantity'], gw2.items.name(t['item_id']),
-                t['created'], t['purchased']))
+            format_duration(int(durations[i])), sells.quantity[i],
+                gw2.items.name(int(sells.item_id[i])),
+                fmt_time(sells.created[i]), fmt_time(sells.purchased[i])))
 
 if __name__ == '__main__':
     main()
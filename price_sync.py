@@ -0,0 +1,88 @@
+# Keeps `storage/price_snapshot` up to date with current trading post prices
+# for every tradable item.  Leave `python3 price_sync.py run` going in the
+# background, and other tools will read prices from the snapshot instead of
+# fetching them.
+import concurrent.futures
+import sys
+import time
+
+import requests
+
+import gw2.api
+import gw2.price_history
+import gw2.price_snapshot
+
+# Maximum number of ids per `/v2/commerce/prices` request.
+CHUNK_SIZE = 200
+DEFAULT_INTERVAL = 60
+DEFAULT_JOBS = 8
+
+def fetch_chunk(chunk):
+    try:
+        return gw2.api.fetch_with_retries(
+                '/v2/commerce/prices?ids=' + ','.join(str(x) for x in chunk))
+    except requests.HTTPError as e:
+        # The API returns 404 if none of the IDs in the chunk are valid.
+        if e.response.status_code == 404:
+            return []
+        raise
+
+def sync_once(jobs=DEFAULT_JOBS):
+    start = time.time()
+    all_ids = gw2.api.fetch('/v2/commerce/prices')
+    chunks = [all_ids[i : i + CHUNK_SIZE] for i in range(0, len(all_ids), CHUNK_SIZE)]
+
+    entries = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(fetch_chunk, chunks):
+            entries.extend(result)
+
+    # Readers check the snapshot's age against their own max age (60s for
+    # `bookkeeper.py status`), and a snapshot stamped with the start of the
+    # sync would already be nearly that old when the next one is written.
+    # A sync takes a few seconds, so stamp it when it's complete.
+    version = gw2.price_snapshot.write(entries, timestamp=time.time())
+    if gw2.price_history.ENABLED:
+        gw2.price_history.record_prices(entries, start)
+    print('wrote snapshot %d: %d items in %.1fs' % (
+        version, len(entries), time.time() - start), file=sys.stderr)
+
+def cmd_run(interval=DEFAULT_INTERVAL, jobs=DEFAULT_JOBS):
+    while True:
+        start = time.time()
+        try:
+            sync_once(jobs)
+        except Exception as e:
+            print('sync failed: %s' % e, file=sys.stderr)
+        time.sleep(max(0, start + interval - time.time()))
+
+def cmd_print_help():
+    help_string = '''
+    Command - Definition
+    help - prints this documentation
+    once [jobs] - fetch all prices and publish a snapshot
+    run [interval] [jobs] - publish a new snapshot every `interval` seconds
+    compact - fold the price history log into its columnar store
+    '''
+    print(help_string)
+
+def main():
+    cmd = sys.argv[1]
+    args = sys.argv[2:]
+    if cmd == 'help':
+        assert len(args) == 0
+        cmd_print_help()
+    elif cmd == 'once':
+        assert len(args) <= 1
+        sync_once(*(int(x) for x in args))
+    elif cmd == 'run':
+        assert len(args) <= 2
+        cmd_run(*(int(x) for x in args))
+    elif cmd == 'compact':
+        assert len(args) == 0
+        gw2.price_history.compact()
+    else:
+        raise ValueError('unknown command %r' % cmd)
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ from typing import List
 
 import gw2.api
 import gw2.items
+import gw2.price_history
 import bltc.api
 
 '''
@@ -29,7 +30,11 @@ class ChartDataPoint:
         self.Bids = Bids
 
 def get_data_points_from_raw(item_id: int) -> List[ChartDataPoint]:
-    historical_data = bltc.api.fetch(item_id)
+    historical_data = None
+    if gw2.price_history.ENABLED:
+        historical_data = gw2.price_history.covering_chart_rows(item_id)
+    if historical_data is None:
+        historical_data = bltc.api.fetch(item_id)
     data_point_list = []
     for data_list in historical_data:
         chart_data_point = ChartDataPoint(data_list[0], data_list[1], data_list[2], data_list[3], data_list[4], data_list[5], data_list[6], data_list[7], data_list[8])
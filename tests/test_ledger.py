@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+
+import gw2.ledger
+
+def _ledger(rows):
+    '''Build a `Ledger` from `(item_id, price, quantity, purchased)` tuples.'''
+    cols = gw2.ledger._empty_columns()
+    if rows:
+        item_id, price, quantity, purchased = zip(*rows)
+        cols['id'] = np.arange(len(rows), dtype=np.int64)
+        cols['item_id'] = np.array(item_id, dtype=np.int32)
+        cols['price'] = np.array(price, dtype=np.int64)
+        cols['quantity'] = np.array(quantity, dtype=np.int32)
+        cols['created'] = np.array(purchased, dtype=np.int64)
+        cols['purchased'] = np.array(purchased, dtype=np.int64)
+    return gw2.ledger.Ledger(cols)
+
+def _fifo_reference(buys, sells, fee):
+    '''Unit-by-unit FIFO matching, walking transactions in time order.'''
+    # Purchases at the same time as a sale are available to it; ties within
+    # one ledger keep their input order.
+    events = sorted([(t, 0, i, item, price, qty) for i, (item, price, qty, t) in enumerate(buys)] +
+            [(t, 1, i, item, price, qty) for i, (item, price, qty, t) in enumerate(sells)])
+    queues = {}
+    result = {}
+    for _, is_sale, _, item, price, qty in events:
+        q = queues.setdefault(item, [])
+        if not is_sale:
+            q.extend([price] * qty)
+            continue
+        n = min(qty, len(q))
+        matched, cost, revenue = result.get(item, (0, 0, 0))
+        result[item] = (matched + n, cost + sum(q[:n]), revenue + n * price)
+        del q[:n]
+    bought = {item for item, _, _, _ in buys}
+    return {item: (m, c, r * (1 - fee)) for item, (m, c, r) in result.items()
+            if item in bought}
+
+def _as_dict(result):
+    item_ids, matched, cost, revenue = result
+    return {int(i): (int(m), int(c), float(r))
+            for i, m, c, r in zip(item_ids, matched, cost, revenue)}
+
+def test_fifo_profit_sale_before_first_buy():
+    buys = [(1, 100, 5, 20)]
+    sells = [(1, 200, 3, 10), (1, 300, 4, 30)]
+    result = _as_dict(gw2.ledger.fifo_profit(_ledger(buys), _ledger(sells), fee=0))
+    # The first sale predates every purchase, so only the second one matches.
+    assert result == {1: (4, 400, 1200.0)}
+
+def test_fifo_profit_matches_oldest_available_units():
+    buys = [(1, 10, 2, 0), (1, 20, 2, 5), (2, 50, 1, 0)]
+    sells = [(1, 100, 1, 1), (1, 100, 3, 6), (2, 70, 2, 1), (3, 9, 1, 1)]
+    result = _as_dict(gw2.ledger.fifo_profit(_ledger(buys), _ledger(sells), fee=0.15))
+    assert result == {1: (4, 60, 400 * 0.85), 2: (1, 50, 70 * 0.85)}
+
+def test_fifo_profit_matches_reference():
+    rng = random.Random(1)
+    for _ in range(50):
+        buys = [(rng.randrange(4), rng.randrange(1, 100), rng.randrange(1, 5),
+            rng.randrange(50)) for _ in range(rng.randrange(1, 20))]
+        sells = [(rng.randrange(4), rng.randrange(1, 100), rng.randrange(1, 5),
+            rng.randrange(50)) for _ in range(rng.randrange(1, 20))]
+        actual = _as_dict(gw2.ledger.fifo_profit(_ledger(buys), _ledger(sells)))
+        expected = _fifo_reference(buys, sells, 0.15)
+        assert actual.keys() == expected.keys()
+        for item, (m, c, r) in expected.items():
+            assert actual[item][:2] == (m, c)
+            assert abs(actual[item][2] - r) < 1e-6
+
+def test_fifo_profit_empty():
+    item_ids, matched, cost, revenue = gw2.ledger.fifo_profit(
+            _ledger([]), _ledger([(1, 10, 1, 0)]))
+    assert len(item_ids) == len(matched) == len(cost) == len(revenue) == 0